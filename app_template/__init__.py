@@ -4,8 +4,7 @@ __author__ = 'MOIS3Y'
 
 from flask import Flask, current_app
 from config import Config, DevelopmentConfig  # noqa: F401
-from commands import create_users, create_tasks, create_links
-from .extensions import db, migrate, ma, guard, csrf, login
+from .extensions import db, migrate, csrf, login
 
 
 # *Create Flask app
@@ -13,45 +12,97 @@ def create_app(config_class=DevelopmentConfig):  # ! OR Config for production
     app = Flask(__name__)
     app.config.from_object(config_class)
 
+    # ? LAZY_LOADING: blueprints on the first request, no CLI extensions
+    cli = from_cli()
+    lazy = app.config.get('LAZY_LOADING') and not cli
+
     # *Init extensions
+    # ? here the ones of the whole app, the others in the setup of the
+    # ? blueprint that uses them (setup_api): lazy, they are not imported
     db.init_app(app)
-    migrate.init_app(app, db)
-    ma.init_app(app)
-    guard.init_app(app, User)
+    replicas.init_app(app)  # ? only if REPLICA_URLS
+    if not lazy:
+        migrate.init_app(app, db)
     csrf.init_app(app)
     login.init_app(app)
+    # ? here, not in the auth views: every blueprint renders base.html
+    login.login_view = 'auth.login'
+    # login.login_message = 'Che OXYEL kyda presh'
+    login.user_loader(load_user)
+    links_cache.init_app(app)
+    identity_cache.init_app(app)
+    hasher.init_app(app)  # ? auth and api
+    limiter.init_app(app)  # ? auth and api
+    compressor.init_app(app)
+    metrics.init_app(app)  # ? only if METRICS_ENABLED
+    nplusone.init_app(app)  # ? only if NPLUSONE_ENABLED
 
     # *Add click commands
-    app.cli.add_command(create_users)
-    app.cli.add_command(create_tasks)
-    app.cli.add_command(create_links)
+    if not lazy:
+        from commands import create_users, create_tasks, create_links, \
+            explain_queries, startup_profile, seed, replicate, \
+            compress_static, rebuild_search, reconcile_stats, export_tasks, \
+            prune_events
+        app.cli.add_command(create_users)
+        app.cli.add_command(create_tasks)
+        app.cli.add_command(create_links)
+        app.cli.add_command(seed)
+        app.cli.add_command(replicate)
+        app.cli.add_command(compress_static)
+        app.cli.add_command(rebuild_search)
+        app.cli.add_command(reconcile_stats)
+        app.cli.add_command(export_tasks)
+        app.cli.add_command(prune_events)
+        app.cli.add_command(explain_queries)
+        app.cli.add_command(startup_profile)
 
+    blueprints = LazyBlueprints(app)
     # Main Blueprint
-    from app_template.main import bp as main_bp
-    app.register_blueprint(main_bp)
-
+    blueprints.add('app_template.main')
     # Auth Blueprint
-    from app_template.auth import bp as auth_bp
-    app.register_blueprint(auth_bp)
-
+    blueprints.add('app_template.auth')
     # CORS Blueprint
-    from app_template.cors import bp as cors_bp
-    app.register_blueprint(cors_bp, url_prefix='/cors')
-
+    blueprints.add('app_template.cors', url_prefix='/cors')
     # API Blueprint
-    from app_template.api import bp as api_bp
-    app.register_blueprint(api_bp, url_prefix='/api')
-
-    # *Exclude all the views of a blueprint from protection CSRF
-    csrf.exempt(api_bp)
+    blueprints.add('app_template.api', url_prefix='/api', setup=setup_api)
+    blueprints.start(lazy=lazy)
 
     # *Add context to base.html
     @app.context_processor
     def inject_to_base_html():
-        links = Links.query.all()
-        return dict(current_app=current_app, links=links)
+        return dict(current_app=current_app, links=get_links())
 
     return app
 
 
-from .models import User, Links  # noqa E402;F401
\ No newline at end of file
+def load_user(id):
+    from .models import User
+    return User.identify(int(id))
+
+
+def setup_api(app, api_bp):
+    from app_template.api.serializers import task_serializer
+    from app_template.api.stats import stats_cache
+    from app_template.events import change_feed
+    from app_template.models import User
+    from app_template.search import search
+    from app_template.tokens import guard
+    guard.init_app(app, User)
+    search.init_app(app)
+    change_feed.init_app(app)
+    task_serializer.init_app(app)
+    stats_cache.init_app(app)
+
+    # *Exclude all the views of a blueprint from protection CSRF
+    csrf.exempt(api_bp)
+
+
+from .identity import identity_cache  # noqa E402
+from .navigation import get_links, links_cache  # noqa E402
+from .passwords import hasher  # noqa E402
+from .ratelimit import limiter  # noqa E402
+from .compression import compressor  # noqa E402
+from .metrics import metrics  # noqa E402
+from .nplusone import nplusone  # noqa E402
+from .replicas import replicas  # noqa E402
+from .startup import LazyBlueprints, from_cli  # noqa E402
\ No newline at end of file
@@ -0,0 +1,679 @@
+"""
+ASGI serving mode.
+The task and auth routes of /api/v.1.0 have async versions here, they
+use the async SQLite driver aiosqlite, so a slow query or a password
+hash does not hold a thread. Every other request (pages, admin and batch
+routes, streaming) goes to the usual Flask app through asgiref's
+WsgiToAsgi, so the sync routes keep working alongside.
+The change feed (SSE) of the tasks runs here on asyncio: an idle
+client is a coroutine and a queue, not a thread.
+Optional dependencies: $ pip install aiosqlite asgiref uvicorn
+Start: $ uvicorn asgi:asgi_app  (see asgi.py in the project root)
+"""
+import asyncio
+import re
+
+import aiosqlite
+from asgiref.wsgi import WsgiToAsgi
+from flask import json, jsonify
+from flask_praetorian.exceptions import PraetorianError
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.engine.url import make_url
+from werkzeug.datastructures import Headers, MIMEAccept
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+from werkzeug.urls import url_decode
+
+from .api.etags import make_etag
+from .api.filters import TaskListParams
+from .api.pagination import decode_cursor, encode_cursor, page_size
+from .api.serializers import task_serializer
+from .api.streaming import JSON_STREAM, NDJSON
+from .api.validators import TASK_FIELDS, valid_task_fields
+from .api.writes import task_write_statements
+from .compression import compress, negotiate, weak_etag
+from .engine import pragma_statements, sqlite_pragmas
+from .events import Event, FeedHub, Subscription, needs_replay, \
+    new_events_select, parse_last_event_id, task_event, user_events_select
+from .identity import IDENTITY_COLUMNS, cached_identity, remember_identity
+from .models import User
+from .passwords import hasher
+from .ratelimit import limiter
+from .tokens import guard
+
+
+SQLITE = sqlite.dialect()
+
+# ? The error messages of the api blueprint (api/routes.py)
+ERRORS = {400: 'Bad request', 404: 'Not found', 429: 'Too many requests',
+          503: 'Service unavailable'}
+
+
+def sqlite_statement(statement, rows=None):
+    """
+    The SQL of a SQLAlchemy Core statement for aiosqlite and its
+    parameters: a tuple per dict of 'rows' (executemany), or one tuple
+    of the values bound in the statement when 'rows' is None.
+    """
+    rows = rows or [{}]
+    compiled = statement.compile(
+        dialect=SQLITE, column_keys=list(rows[0]) or None)
+    params = []
+    for row in rows:
+        values = compiled.construct_params(row)
+        params.append(tuple(values[name] for name in compiled.positiontup))
+    return compiled.string, params
+
+
+def etag_headers(etag):
+    """ As api/etags.tag_response: the ETag depends on Accept """
+    return {'ETag': quote_etag(etag), 'Vary': 'Accept'}
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status, error):
+        self.status = status
+        self.error = error
+
+
+class Request(object):
+    """ What the async routes need from an ASGI http scope """
+
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.query_string = scope['query_string'].decode('latin-1')
+        self.args = url_decode(self.query_string)
+        self.headers = Headers([
+            (key.decode('latin-1'), value.decode('latin-1'))
+            for key, value in scope['headers']])
+        self.body = body
+
+    @property
+    def host_url(self):
+        host = self.headers.get('Host') or '{}:{}'.format(
+            *self.scope['server'])
+        return '{}://{}{}/'.format(
+            self.scope.get('scheme', 'http'), host,
+            self.scope.get('root_path', ''))
+
+    @property
+    def remote_addr(self):
+        client = self.scope.get('client')
+        return client[0] if client else ''
+
+    @property
+    def full_path(self):
+        return '{}?{}'.format(self.path, self.query_string)
+
+    def json(self):
+        if 'application/json' not in self.headers.get('Content-Type', ''):
+            return None
+        try:
+            return json.loads(self.body.decode('utf-8'))
+        except ValueError:
+            raise HTTPError(400, 'Bad request')
+
+
+class AsyncDatabase(object):
+    """
+    A small pool of aiosqlite connections.
+    Every connection has its own thread, ASYNC_DB_POOL_SIZE of them.
+    """
+
+    def __init__(self, path, size, pragmas=()):
+        self.path = path
+        self.size = size
+        # ? the PRAGMAs of the engine profile, see engine.py
+        self.pragmas = pragmas
+        self._pool = None
+
+    async def _connections(self):
+        if self._pool is None:
+            self._pool = asyncio.Queue()
+            for _ in range(self.size):
+                connection = await aiosqlite.connect(self.path)
+                connection.row_factory = aiosqlite.Row
+                for statement in self.pragmas:
+                    await connection.execute(statement)
+                self._pool.put_nowait(connection)
+        return self._pool
+
+    async def acquire(self):
+        return await (await self._connections()).get()
+
+    def release(self, connection):
+        self._pool.put_nowait(connection)
+
+    async def close(self):
+        if self._pool is not None:
+            while not self._pool.empty():
+                await self._pool.get_nowait().close()
+            self._pool = None
+
+
+async def drive_async(steps, feed):
+    """ drive() of events.py on asyncio: the actions are coroutines """
+    result = error = None
+    try:
+        while True:
+            try:
+                if error is not None:
+                    action, args = steps.throw(error)
+                else:
+                    action, args = steps.send(result)
+            except StopIteration:
+                return
+            result = error = None
+            if action == 'send':
+                yield args
+                continue
+            try:
+                result = await getattr(feed, action)(*args)
+            except Exception as exc:
+                error = exc
+    finally:
+        steps.close()
+
+
+class AsyncChangeFeed(FeedHub):
+    """
+    The change feed of events.py (ChangeFeed) on asyncio: the same
+    steps (FeedHub), the actions read the log through the pool.
+    One poll task fans the new events out to an asyncio.Queue per
+    client, at once after a write of the async routes, else every
+    EVENTS_POLL_INTERVAL seconds. Thousands of idle streams cost a queue
+    each: no thread and no database connection. The task runs only
+    while there are clients.
+    """
+
+    Full = asyncio.QueueFull
+
+    def __init__(self, api):
+        super(AsyncChangeFeed, self).__init__()
+        self.api = api
+        self.app = api.app
+        self.configure(api.app)
+        self._wake = None
+
+    def notify(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    def stream(self, user_id, last_id, uri_prefix):
+        """ The SSE messages of one client, an async iterator """
+        return drive_async(
+            self.stream_steps(user_id, last_id, uri_prefix), self)
+
+    # ! Actions of the steps
+
+    async def subscribe(self, user_id):
+        subscription = Subscription(
+            user_id, asyncio.Queue(maxsize=self.queue_size))
+        row = await self.api.query(
+            'SELECT coalesce(max(id), 0) FROM task_events', one=True)
+        return self.join(subscription, row[0], self._start)
+
+    async def log_window(self, user_id, last_id):
+        oldest, newest = await self.api.query(
+            'SELECT (SELECT min(id) FROM task_events), '
+            '(SELECT coalesce(max(id), 0) FROM task_events '
+            'WHERE user_id = ?)', user_id, one=True)
+        events = []
+        if needs_replay(last_id, newest):
+            events = [Event(*row) for row in await self.api.select(
+                user_events_select(user_id, last_id, self.replay_max + 1))]
+        return oldest, newest, events
+
+    async def next_event(self, subscription):
+        try:
+            return await asyncio.wait_for(
+                subscription.events.get(), self.heartbeat)
+        except asyncio.TimeoutError:
+            return None
+
+    async def sleep(self):
+        try:
+            await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
+
+    async def new_events(self, cursor):
+        rows = await self.api.select(new_events_select(cursor, 1000))
+        return [Event(*row) for row in rows]
+
+    def _start(self):
+        self._wake = asyncio.Event()
+        return asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        async for _ in drive_async(self.poll_steps(), self):
+            pass  # ? the poller sends nothing
+
+
+class AsyncApi(object):
+    """
+    ASGI application: the async API routes plus the Flask app.
+    Each route returns (status, body, headers) or None, None sends
+    the request on to the Flask app. A body that is an async iterator
+    of str is streamed (Server-Sent Events).
+    """
+
+    prefix = '/api/v.1.0'
+
+    def __init__(self, app):
+        self.app = app
+        # ? guard, the serializer and the search are set up with the API
+        # ? blueprint (setup_api): loaded now in the lazy mode
+        app.extensions['lazy_blueprints'].load('api')
+        self.wsgi = WsgiToAsgi(app)
+        url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+        if url.drivername.split('+')[0] != 'sqlite':
+            raise RuntimeError('The ASGI mode supports only SQLite')
+        self.db = AsyncDatabase(
+            url.database or ':memory:', app.config['ASYNC_DB_POOL_SIZE'],
+            pragma_statements(sqlite_pragmas(app)))
+        self.feed = AsyncChangeFeed(self)
+        self.routes = [
+            ('GET', r'/ping', self.ping),
+            ('POST', r'/login', self.login),
+            ('POST', r'/refresh', self.refresh),
+            ('GET', r'/protected', self.protected),
+            ('GET', r'/todo/tasks', self.get_tasks),
+            ('GET', r'/todo/tasks/events', self.task_events),
+            ('GET', r'/todo/tasks/(\d+)', self.get_task),
+            ('POST', r'/todo/tasks/new', self.create_task),
+            ('PUT', r'/todo/tasks/(\d+)', self.update_task),
+            ('DELETE', r'/todo/tasks/(\d+)', self.delete_task),
+        ]
+        self.routes = [
+            (method, re.compile(re.escape(self.prefix) + path + '$'), view)
+            for method, path, view in self.routes]
+
+    # ! ASGI
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http':
+            for method, pattern, view in self.routes:
+                match = pattern.match(scope['path'])
+                if match and scope['method'] == method:
+                    return await self.dispatch(
+                        view, match.groups(), scope, receive, send)
+        return await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.db.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def dispatch(self, view, groups, scope, receive, send):
+        body = b''
+        more = True
+        while more:
+            message = await receive()
+            body += message.get('body', b'')
+            more = message.get('more_body', False)
+        request = Request(scope, body)
+        try:
+            result = await view(request, *groups)
+        except HTTPError as error:
+            result = (error.status, {'error': error.error}, {})
+        except HTTPException as error:
+            headers = {}
+            if hasattr(error, 'retry_after'):
+                headers['Retry-After'] = str(error.retry_after)
+            result = (error.code, {'error': ERRORS.get(
+                error.code, error.name)}, headers)
+        except PraetorianError as error:
+            result = (error.status_code, {
+                'error': error.__class__.__name__,
+                'message': error.message}, {})
+        if result is None:
+            # ? not an async case, the Flask app answers
+            async def replay():
+                return {'type': 'http.request', 'body': body}
+            return await self.wsgi(scope, replay, send)
+        status, payload, headers = result
+        if hasattr(payload, '__aiter__'):
+            return await self.stream(status, payload, headers, receive, send)
+        content = b'' if payload is None else self.json_body(payload)
+        compressor = self.app.extensions.get('compressor')
+        if compressor is not None and 200 <= status < 300:
+            # ? as the after_request hook of the Flask app, compression.py
+            headers['Vary'] = ', '.join(
+                filter(None, (headers.get('Vary'), 'Accept-Encoding')))
+            coding = negotiate(request.headers.get('Accept-Encoding'))
+            if coding is not None and len(content) >= compressor.min_size:
+                content = compress(content, coding, compressor.level)
+                headers['Content-Encoding'] = coding
+                if 'ETag' in headers:
+                    headers['ETag'] = weak_etag(headers['ETag'])
+        raw = [(b'content-type', b'application/json'),
+               (b'content-length', str(len(content)).encode('latin-1'))]
+        raw += [(key.lower().encode('latin-1'), value.encode('latin-1'))
+                for key, value in headers.items()]
+        await send({
+            'type': 'http.response.start', 'status': status,
+            'headers': raw})
+        await send({'type': 'http.response.body', 'body': content})
+
+    async def stream(self, status, messages, headers, receive, send):
+        """ Sends the messages as they come, until the client is gone """
+        raw = [(b'content-type', b'text/event-stream; charset=utf-8')]
+        raw += [(key.lower().encode('latin-1'), value.encode('latin-1'))
+                for key, value in headers.items()]
+        await send({
+            'type': 'http.response.start', 'status': status,
+            'headers': raw})
+        disconnect = asyncio.ensure_future(self.disconnected(receive))
+        try:
+            while True:
+                message = asyncio.ensure_future(messages.__anext__())
+                await asyncio.wait(
+                    (message, disconnect),
+                    return_when=asyncio.FIRST_COMPLETED)
+                if not message.done():
+                    # ? gone: the stream leaves its feed (finally)
+                    message.cancel()
+                    await asyncio.wait((message,))
+                    return
+                try:
+                    chunk = message.result()
+                except StopAsyncIteration:
+                    break
+                await send({
+                    'type': 'http.response.body',
+                    'body': chunk.encode('utf-8'), 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnect.cancel()
+            await messages.aclose()
+
+    @staticmethod
+    async def disconnected(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    # ! Helpers
+
+    async def run_sync(self, func, *args):
+        """ Runs blocking code (hashing, JWT) in a thread, in app context """
+        def call():
+            with self.app.app_context():
+                return func(*args)
+        return await asyncio.get_running_loop().run_in_executor(None, call)
+
+    def json_body(self, payload):
+        """
+        The bytes of jsonify(payload): the bodies of the async routes are
+        byte for byte those of the Flask routes, so one ETag (make_etag)
+        always stands for one body.
+        """
+        with self.app.app_context():
+            return jsonify(payload).get_data()
+
+    async def query(self, sql, *params, one=False):
+        connection = await self.db.acquire()
+        try:
+            async with connection.execute(sql, params) as cursor:
+                if one:
+                    return await cursor.fetchone()
+                return await cursor.fetchall()
+        finally:
+            self.db.release(connection)
+
+    async def select(self, statement, one=False):
+        """ query() of a SQLAlchemy select, see sqlite_statement """
+        sql, (params,) = sqlite_statement(statement)
+        return await self.query(sql, *params, one=one)
+
+    async def write(self, user_id, statements, events=(), total=0, done=0):
+        """
+        Runs the statements of a write route in one transaction, with the
+        side effects of the sync routes (api/writes.py): the user tasks
+        version (ETag), the task counters and the task_events rows.
+        'events' may be a function of the cursors of the statements,
+        the event of a new task needs its id. The change feed is woken
+        up after the commit.
+        Returns the cursors: lastrowid, rowcount.
+        """
+        connection = await self.db.acquire()
+        try:
+            cursors = []
+            for sql, params in statements:
+                cursors.append(await connection.execute(sql, params))
+            if callable(events):
+                events = events(cursors)
+            for statement, rows in task_write_statements(
+                    user_id, events, total, done):
+                sql, params = sqlite_statement(statement, rows)
+                await connection.executemany(sql, params)
+            await connection.commit()
+            self.feed.notify()
+            return cursors
+        except Exception:
+            await connection.rollback()
+            raise
+        finally:
+            self.db.release(connection)
+
+    async def current_user(self, request):
+        """
+        Checks the bearer token, like @auth_required, and returns the
+        columns of its user, like current_user() of the sync app: the
+        token of a deleted user is refused (401). Verified tokens and
+        users are cached (tokens.py, identity.py), a miss of the
+        identity cache is one primary key lookup on the async pool.
+        """
+        with self.app.app_context():
+            token = guard.read_token(request.headers)
+            user_id = guard.extract_jwt_token(token)['id']
+            row = cached_identity('id', user_id)
+        if row is None:
+            row = await self.query(
+                'SELECT {} FROM user WHERE id = ?'.format(
+                    ', '.join(IDENTITY_COLUMNS)), user_id, one=True)
+            PraetorianError.require_condition(
+                row is not None,
+                'Could not identify the current user from the current id')
+            row = dict(row)
+            with self.app.app_context():
+                remember_identity(row)
+        return row
+
+    async def current_user_id(self, request):
+        return (await self.current_user(request))['id']
+
+    def uri_prefix(self, request):
+        return request.host_url + self.prefix[1:] + '/todo/tasks/'
+
+    def dump(self, request, rows):
+        return task_serializer.dump_many(rows, prefix=self.uri_prefix(request))
+
+    async def etag(self, request, user_id):
+        """ Same ETag as the sync routes, see api/etags.py """
+        row = await self.query(
+            'SELECT tasks_version FROM user WHERE id = ?', user_id, one=True)
+        etag = make_etag(
+            user_id, row['tasks_version'] if row else 0, request.full_path,
+            request.host_url, request.headers.get('Accept', ''))
+        if parse_etags(
+                request.headers.get('If-None-Match')).contains_weak(etag):
+            return etag, True
+        return etag, False
+
+    # ! Routes
+
+    async def ping(self, request):
+        return 200, {'response': 'Hello, friend'}, {}
+
+    async def protected(self, request):
+        user = await self.current_user(request)
+        return 200, {
+            'result': 'You are in a special area!',
+            'your_id': user['id'],
+            'your_name': user['username']}, {}
+
+    async def login(self, request):
+        data = request.json()
+        limiter.hit('LOGIN_IP', request.remote_addr)
+        if not data or 'username' not in data or 'password' not in data:
+            raise HTTPError(400, 'Bad request')
+        if isinstance(data['username'], str):
+            limiter.hit('LOGIN_USERNAME', data['username'])
+        row = await self.query(
+            'SELECT id, username, password_hash, roles FROM user '
+            'WHERE username = ?', data['username'], one=True)
+        if row is None:
+            raise HTTPError(401, 'Unauthorized')
+        user = User(**dict(row))
+        # ? hashing runs on the process pool, the thread only waits for it
+        if not await self.run_sync(user.check_password_hash, data['password']):
+            raise HTTPError(401, 'Unauthorized')
+        await self.run_sync(hasher.rehash_if_needed, user, data['password'])
+        token = await self.run_sync(guard.encode_jwt_token, user)
+        return 200, {'access_token': token}, {}
+
+    async def refresh(self, request):
+        limiter.hit('REFRESH_IP', request.remote_addr)
+        data = request.json()
+        if not data or 'token' not in data:
+            raise HTTPError(400, 'Bad request')
+        token = await self.run_sync(guard.refresh_jwt_token, data['token'])
+        return 200, {'update_token': token}, {}
+
+    async def get_tasks(self, request):
+        accept = MIMEAccept(parse_accept_header(
+            request.headers.get('Accept', '')))
+        if any(value in (NDJSON, JSON_STREAM) for value, _ in accept):
+            return None  # ? streaming stays with the Flask app
+        if any(name in request.args for name in TaskListParams._fields):
+            return None  # ? and so do the filters, sorts and projections
+        user_id = await self.current_user_id(request)
+        etag, cached = await self.etag(request, user_id)
+        if cached:
+            return 304, None, etag_headers(etag)
+        with self.app.app_context():
+            limit = page_size(request.args)
+            cursor = request.args.get('cursor')
+            after = decode_cursor(cursor) if cursor else 0
+        rows = await self.query(
+            'SELECT id, title, description, done FROM tasks '
+            'WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?',
+            user_id, after, limit + 1)
+        tasks = [_Row(row) for row in rows]
+        next_cursor = None
+        if len(tasks) > limit:
+            tasks = tasks[:limit]
+            with self.app.app_context():
+                next_cursor = encode_cursor(tasks[-1])
+        headers = etag_headers(etag)
+        if not tasks:
+            return 200, {'tasks': 'no tasks'}, headers
+        return 200, {
+            'tasks': self.dump(request, tasks),
+            'next_cursor': next_cursor}, headers
+
+    async def task_events(self, request):
+        """ Server-Sent Events of the user task changes, see api/routes.py """
+        user_id = await self.current_user_id(request)
+        last_id = parse_last_event_id(
+            request.headers.get('Last-Event-ID') or
+            request.args.get('last_event_id'))
+        if last_id == -1:
+            raise HTTPError(400, 'Bad request')
+        return 200, self.feed.stream(
+            user_id, last_id, self.uri_prefix(request)), {
+            'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+    async def get_task(self, request, task_id):
+        user_id = await self.current_user_id(request)
+        etag, cached = await self.etag(request, user_id)
+        if cached:
+            return 304, None, etag_headers(etag)
+        row = await self.query(
+            'SELECT id, title, description, done FROM tasks '
+            'WHERE user_id = ? AND id = ?', user_id, int(task_id), one=True)
+        if row is None:
+            raise HTTPError(404, 'Not found')
+        return 200, {'task': self.dump(request, [_Row(row)])[0]}, \
+            etag_headers(etag)
+
+    async def create_task(self, request):
+        user_id = await self.current_user_id(request)
+        data = request.json()
+        if not data or not valid_task_fields(data, required=('title',)):
+            raise HTTPError(400, 'Bad request')
+        task = {
+            'title': data['title'],
+            'description': data.get('description', ""),
+            'done': False}
+        cursor, = await self.write(user_id, [(
+            'INSERT INTO tasks (user_id, title, description, done) '
+            'VALUES (?, ?, ?, ?)',
+            (user_id, task['title'], task['description'], task['done']))],
+            lambda cursors: [task_event(
+                'create', dict(task, id=cursors[0].lastrowid))],
+            total=1)
+        task['id'] = cursor.lastrowid
+        return 201, {'new_task': self.dump(request, [_Row(task)])[0]}, {}
+
+    async def update_task(self, request, task_id):
+        user_id = await self.current_user_id(request)
+        data = request.json()
+        if not data or not valid_task_fields(data):
+            raise HTTPError(400, 'Bad request')
+        row = await self.query(
+            'SELECT id, title, description, done FROM tasks '
+            'WHERE user_id = ? AND id = ?', user_id, int(task_id), one=True)
+        if row is None:
+            raise HTTPError(404, 'Not found')
+        task = dict(row)
+        for field in TASK_FIELDS:
+            if field in data:
+                task[field] = data[field]
+        await self.write(user_id, [(
+            'UPDATE tasks SET title = ?, description = ?, done = ? '
+            'WHERE user_id = ? AND id = ?',
+            (task['title'], task['description'], task['done'],
+             user_id, task['id']))],
+            [task_event('update', task)],
+            done=int(bool(task['done'])) - int(bool(row['done'])))
+        return 200, {'task_update': self.dump(request, [_Row(task)])[0]}, {}
+
+    async def delete_task(self, request, task_id):
+        user_id = await self.current_user_id(request)
+        row = await self.query(
+            'SELECT id, done FROM tasks WHERE user_id = ? AND id = ?',
+            user_id, int(task_id), one=True)
+        if row is None:
+            raise HTTPError(404, 'Not found')
+        await self.write(user_id, [(
+            'DELETE FROM tasks WHERE user_id = ? AND id = ?',
+            (user_id, row['id']))],
+            [task_event('delete', dict(row))],
+            total=-1, done=-int(bool(row['done'])))
+        return 200, {'task_delete': 'Success'}, {}
+
+
+class _Row(object):
+    """ Task row for the serializer, which reads attributes """
+
+    def __init__(self, row):
+        row = dict(row)
+        self.__dict__.update(row)
+        self.done = bool(row['done'])
+
+
+def create_asgi_app(app):
+    return AsyncApi(app)
@@ -0,0 +1,153 @@
+from app_template.events import task_event
+from app_template.extensions import db
+from app_template.models import Tasks
+from .validators import TASK_FIELDS, valid_task_fields
+from .writes import record_task_write
+
+
+def validate_batch(data, max_size):
+    """
+    Checks the whole batch before anything is written.
+    Returns a list of invalid items: {'op': 'update', 'index': 3}.
+    An empty list means the batch may be applied.
+    """
+    if not isinstance(data, dict) or not any(
+            op in data for op in ('create', 'update', 'delete')):
+        return [{'op': None, 'index': None}]
+    invalid = []
+    size = 0
+    for op in ('create', 'update', 'delete'):
+        items = data.get(op, [])
+        if not isinstance(items, list):
+            invalid.append({'op': op, 'index': None})
+            continue
+        size += len(items)
+        for index, item in enumerate(items):
+            if op == 'create':
+                valid = valid_task_fields(item, required=('title',))
+            elif op == 'update':
+                valid = valid_task_fields(item, required=('id',)) and \
+                    type(item['id']) is int
+            else:
+                valid = type(item) is int
+            if not valid:
+                invalid.append({'op': op, 'index': index})
+    if size > max_size:
+        invalid.append({'op': None, 'index': None})
+    return invalid
+
+
+def owned_tasks(user_id, ids):
+    """ The tasks of the user among 'ids', read and deleted by a batch """
+    return Tasks.query.filter(Tasks.user_id == user_id, Tasks.id.in_(ids))
+
+
+def insert_tasks(user_id, rows):
+    """
+    Inserts the new tasks of a batch and sets their 'id'.
+    * PostgreSQL: one multi-row INSERT ... RETURNING.
+    * SQLite: one executemany, then one seek on (user_id, id) reads the
+      last len(rows) ids of the user. Only SQLite: the transaction holds
+      the database write lock since the INSERT, no other task can come
+      in between.
+    * Other databases: one INSERT per row, the id of each from the
+      cursor. There a concurrent batch of the same user may interleave.
+    (bulk_insert_mappings with return_defaults runs one INSERT per row.)
+    """
+    table = Tasks.__table__
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        ids = [row.id for row in db.session.execute(
+            table.insert().values(rows).returning(table.c.id))]
+    elif dialect == 'sqlite':
+        db.session.execute(table.insert(), rows)
+        ids = [row.id for row in db.session.query(Tasks.id).filter(
+            Tasks.user_id == user_id).order_by(Tasks.id.desc()).limit(
+            len(rows))][::-1]
+    else:
+        ids = [db.session.execute(
+            table.insert(), row).inserted_primary_key[0] for row in rows]
+    for row, task_id in zip(rows, ids):
+        row['id'] = task_id
+
+
+def apply_batch(user_id, data):
+    """
+    Applies a validated batch in one transaction (one commit).
+    * create - one INSERT for all the tasks, see insert_tasks.
+    * update - the owned tasks are read by one SELECT ... IN,
+      then written by one bulk update.
+    * delete - one DELETE ... IN.
+    The task counters of the user move by the net change of the batch,
+    the changes are logged for the change feed (events.py).
+    Returns transient 'Tasks' for the results, nothing is re-queried:
+    {'created': [Tasks], 'updated': [Tasks or id], 'deleted': [(id, bool)]}
+    Not found tasks in 'updated' are returned as their plain int id.
+    """
+    creates = data.get('create', [])
+    updates = data.get('update', [])
+    deletes = data.get('delete', [])
+
+    # *Owned tasks touched by the batch, one query
+    ids = {item['id'] for item in updates} | set(deletes)
+    rows = {}
+    if ids:
+        query = owned_tasks(user_id, ids).with_entities(
+            Tasks.id, Tasks.title, Tasks.description, Tasks.done)
+        rows = {row.id: row._asdict() for row in query}
+    # ? 'done' before the batch, for the task counters
+    was_done = {task_id: row['done'] for task_id, row in rows.items()}
+
+    # *Create
+    new_rows = [
+        {
+            'user_id': user_id,
+            'title': item['title'],
+            'description': item.get('description', ""),
+            'done': item.get('done', False),
+        }
+        for item in creates]
+    if new_rows:
+        insert_tasks(user_id, new_rows)
+
+    # *Update
+    updated = []
+    changes = {}
+    for item in updates:
+        row = rows.get(item['id'])
+        if row is None:
+            updated.append(item['id'])
+            continue
+        for field in TASK_FIELDS:
+            if field in item:
+                row[field] = item[field]
+        changes[row['id']] = row
+        updated.append(dict(row))
+    if changes:
+        db.session.bulk_update_mappings(Tasks, list(changes.values()))
+
+    # *Delete
+    found = [task_id for task_id in deletes if task_id in rows]
+    if found:
+        owned_tasks(user_id, found).delete(synchronize_session=False)
+
+    if new_rows or changes or found:
+        deleted = set(found)
+        done = sum(bool(row['done']) for row in new_rows)
+        done += sum(int(row['done']) - int(was_done[task_id])
+                    for task_id, row in changes.items())
+        done -= sum(bool(rows[task_id]['done']) for task_id in deleted)
+        record_task_write(
+            user_id, [task_event('create', row) for row in new_rows] +
+            [task_event('update', row) for row in changes.values()] +
+            [task_event('delete', {'id': task_id})
+             for task_id in sorted(deleted)],
+            total=len(new_rows) - len(deleted), done=done)
+    db.session.commit()
+    return {
+        'created': [Tasks(**row) for row in new_rows],
+        'updated': [
+            Tasks(**row) if isinstance(row, dict) else row
+            for row in updated],
+        'deleted': [(task_id, task_id in rows) for task_id in deletes],
+    }
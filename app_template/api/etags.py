@@ -0,0 +1,53 @@
+import hashlib
+
+from flask import make_response, request
+
+from app_template.extensions import db
+from app_template.models import User
+
+
+def tasks_version_query(user_id):
+    """ Current version of the user tasks, one primary key lookup """
+    return db.session.query(User.tasks_version).filter(User.id == user_id)
+
+
+def tasks_version(user_id):
+    return tasks_version_query(user_id).scalar()
+
+
+def make_etag(user_id, version, full_path, host_url, accept):
+    """
+    Strong ETag of a task response: the user tasks version plus
+    everything else that changes the body (path, query, host, Accept).
+    """
+    variant = hashlib.sha1('|'.join(
+        (full_path, host_url, accept)).encode('utf-8')).hexdigest()
+    return '{}-{}-{}'.format(user_id, version, variant[:16])
+
+
+def tasks_etag(user_id):
+    """ ETag of the current request for the tasks of the user """
+    return make_etag(
+        user_id, tasks_version(user_id), request.full_path,
+        request.host_url, request.headers.get('Accept', ''))
+
+
+def tag_response(response, etag):
+    """
+    Sets the ETag of a task response. The ETag depends on Accept
+    (make_etag), so does the cached response: 'Vary: Accept'.
+    """
+    response.set_etag(etag)
+    response.vary.add('Accept')
+    return response
+
+
+def not_modified(etag):
+    """
+    Returns a 304 response if the client already has this version
+    (If-None-Match), otherwise None. The comparison is weak: the ETag of
+    a compressed response is weak (compression.py).
+    """
+    if request.if_none_match.contains_weak(etag):
+        return tag_response(make_response('', 304), etag)
+    return None
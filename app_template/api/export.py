@@ -0,0 +1,80 @@
+import csv
+import io
+from itertools import islice
+from json import JSONEncoder
+
+from app_template.compression import compress_chunks
+from app_template.extensions import db
+from app_template.models import Tasks, User
+
+
+# ? Columns of an export, in this order
+EXPORT_COLUMNS = ('id', 'username', 'title', 'description', 'done')
+
+# ? The rows hold only int, str, bool and None: one plain encoder is
+# ? enough and much faster than flask.json.dumps per row
+encode = JSONEncoder().encode
+
+# * format -> media type
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def export_rows(username=None):
+    """
+    Every task with the name of its user, ordered by the task id:
+    plain rows of EXPORT_COLUMNS, one join on the user primary key.
+    'username' - the tasks of one user only.
+    """
+    query = db.session.query(
+        Tasks.id, User.username, Tasks.title, Tasks.description,
+        Tasks.done).join(User, User.id == Tasks.user_id)
+    if username is not None:
+        query = query.filter(User.username == username)
+    return query.order_by(Tasks.id)
+
+
+def csv_chunk(rows, header=False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    writer.writerows(
+        (row.id, row.username, row.title, row.description or '',
+         'true' if row.done else 'false')
+        for row in rows)
+    return buffer.getvalue()
+
+
+def ndjson_chunk(rows):
+    return ''.join(
+        encode(dict(zip(EXPORT_COLUMNS, row))) + '\n' for row in rows)
+
+
+def export_chunks(rows, export_format, size=1000):
+    """
+    Text of the export, one str per 'size' rows. The rows are read
+    with yield_per (a server-side cursor where the driver has one),
+    so neither the query nor the output is ever held in full:
+    the memory stays the same for a thousand or tens of millions of rows.
+    """
+    results = iter(rows.yield_per(size))
+    first = True
+    for chunk in iter(lambda: list(islice(results, size)), []):
+        if export_format == 'csv':
+            yield csv_chunk(chunk, header=first)
+        else:
+            yield ndjson_chunk(chunk)
+        first = False
+    if first and export_format == 'csv':
+        yield csv_chunk([], header=True)
+
+
+def export_stream(rows, export_format, size=1000, gzip=False, level=6):
+    """ export_chunks as bytes, gzipped on the fly if asked """
+    chunks = export_chunks(rows, export_format, size)
+    if gzip:
+        return compress_chunks(chunks, 'gzip', level, sync=False)
+    return (chunk.encode('utf-8') for chunk in chunks)
@@ -0,0 +1,73 @@
+from collections import namedtuple
+
+from flask import abort
+
+from app_template.models import Tasks
+from .pagination import SORTS
+from .serializers import task_serializer
+
+
+# ? Values of 'done'
+BOOLEANS = {'true': True, '1': True, 'false': False, '0': False}
+
+# ? Tasks.title is String(50), a longer prefix matches nothing
+TITLE_PREFIX_MAX = 50
+
+TaskListParams = namedtuple(
+    'TaskListParams', ('done', 'title_prefix', 'sort', 'fields'))
+
+
+def task_list_params(args):
+    """
+    Reads the filter, sort and projection parameters of the task lists.
+    Every value is checked against a whitelist, anything else -> 400:
+        done=true|false        --- only open or only closed tasks
+        title_prefix=<text>    --- titles starting with the text
+                                   (case-sensitive)
+        sort=[-]id|title|done  --- order, '-' is descending; id by default
+        fields=uri,title,...   --- output fields, all by default
+    """
+    done = args.get('done')
+    if done is not None:
+        done = BOOLEANS.get(done.lower())
+        if done is None:
+            abort(400)
+    title_prefix = args.get('title_prefix')
+    if title_prefix is not None and \
+            not 0 < len(title_prefix) <= TITLE_PREFIX_MAX:
+        abort(400)
+    sort = args.get('sort', 'id')
+    if sort not in SORTS:
+        abort(400)
+    fields = args.get('fields')
+    if fields is not None:
+        fields = tuple(name.strip() for name in fields.split(','))
+        if not set(fields) <= set(task_serializer.names()):
+            abort(400)
+    return TaskListParams(done, title_prefix, sort, fields)
+
+
+def prefix_end(prefix):
+    """ The smallest string after every string that starts with prefix """
+    last = ord(prefix[-1])
+    if last == 0x10FFFF:
+        return None
+    return prefix[:-1] + chr(last + 1)
+
+
+def filter_tasks(query, params):
+    """
+    Adds the filters of the parameters to a query of Tasks.
+    They are plain comparisons on indexed columns: 'done' is an equality
+    of (user_id, done), the title prefix is the range
+    prefix <= title < prefix_end of (user_id, title), not a LIKE,
+    which SQLite runs case-insensitive and without the index.
+    """
+    if params.done is not None:
+        query = query.filter(Tasks.done == params.done)
+    if params.title_prefix:
+        query = query.filter(Tasks.title >= params.title_prefix)
+        end = prefix_end(params.title_prefix)
+        if end is not None:
+            query = query.filter(Tasks.title < end)
+    return query
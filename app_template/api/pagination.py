@@ -0,0 +1,154 @@
+from flask import abort, current_app
+from itsdangerous import URLSafeSerializer, BadSignature
+from sqlalchemy import and_, literal, or_
+
+from app_template.models import Tasks
+
+
+# ? The 'sort' values of the task lists: name -> (attribute, descending).
+# ? The id breaks the ties, so every order is total and keyset-pageable
+SORTS = {
+    'id': ('id', False),
+    '-id': ('id', True),
+    'title': ('title', False),
+    '-title': ('title', True),
+    'done': ('done', False),
+    '-done': ('done', True),
+}
+
+
+def _cursor_serializer():
+    """
+    Cursors are signed with the app SECRET_KEY, so the client
+    can only hand back a value the server produced itself.
+    """
+    return URLSafeSerializer(
+        current_app.config['SECRET_KEY'], salt='tasks-cursor')
+
+
+def encode_cursor(task, sort='id'):
+    """
+    Makes an opaque cursor pointing right after the passed task.
+    Besides the id it keeps the sort and the value of the sort column.
+    """
+    payload = {'id': task.id}
+    if sort != 'id':
+        attribute, _ = SORTS[sort]
+        payload['sort'] = sort
+        if attribute != 'id':
+            payload['key'] = getattr(task, attribute)
+    return _cursor_serializer().dumps(payload)
+
+
+def decode_sort_cursor(cursor, sort='id'):
+    """
+    Returns (value of the sort column, task id) stored in the cursor.
+    Bad cursor or a cursor of another sort -> 400
+    """
+    try:
+        payload = _cursor_serializer().loads(cursor)
+        if payload.get('sort', 'id') != sort:
+            abort(400)
+        return payload.get('key'), int(payload['id'])
+    except (BadSignature, AttributeError, KeyError, TypeError, ValueError):
+        abort(400)
+
+
+def decode_cursor(cursor):
+    """ Returns the task id stored in the cursor. Bad cursor -> 400 """
+    return decode_sort_cursor(cursor)[1]
+
+
+def sort_order(sort='id'):
+    """
+    ORDER BY of the sort: its column, then the id.
+    NULLs of a nullable column are the smallest values whatever the
+    database is (first ascending, last descending), as seek() expects.
+    """
+    attribute, descending = SORTS[sort]
+    order = [Tasks.id.desc() if descending else Tasks.id]
+    if attribute != 'id':
+        column = getattr(Tasks, attribute)
+        if descending:
+            column = column.desc()
+            if getattr(Tasks, attribute).nullable:
+                column = column.nullslast()
+        elif column.nullable:
+            column = column.nullsfirst()
+        order.insert(0, column)
+    return order
+
+
+def seek(query, cursor, sort='id'):
+    """
+    Filters the query to the tasks after the cursor in the sort order.
+    On (column, id) the predicate is written as
+    'column >= key AND (column > key OR id > last id)': the first part
+    is a range of the (user_id, column) index.
+    A NULL never compares, so the NULLs (the smallest, see sort_order)
+    are matched by 'column IS NULL': a NULL key seeks among the NULLs by
+    id, then goes on to the values; a descending sort ends with them.
+    """
+    attribute, descending = SORTS[sort]
+    key, last_id = decode_sort_cursor(cursor, sort)
+    if attribute == 'id':
+        return query.filter(
+            Tasks.id < last_id if descending else Tasks.id > last_id)
+    column = getattr(Tasks, attribute)
+    if key is None:
+        if descending:
+            return query.filter(and_(column.is_(None), Tasks.id < last_id))
+        return query.filter(or_(
+            and_(column.is_(None), Tasks.id > last_id), column.isnot(None)))
+    # ? a bound value: SQLAlchemy compares True/False only with '='
+    key = literal(key, column.type)
+    if descending:
+        after = and_(column <= key, or_(column < key, Tasks.id < last_id))
+        if column.nullable:
+            after = or_(after, column.is_(None))
+        return query.filter(after)
+    return query.filter(and_(
+        column >= key, or_(column > key, Tasks.id > last_id)))
+
+
+def page_size(args):
+    """
+    Reads the 'limit' query parameter.
+    Default and upper bound are configured in the config.py
+    (TASKS_PAGE_SIZE, TASKS_MAX_PAGE_SIZE)
+    """
+    limit = args.get('limit', current_app.config['TASKS_PAGE_SIZE'], type=int)
+    if limit is None or limit < 1:
+        abort(400)
+    return min(limit, current_app.config['TASKS_MAX_PAGE_SIZE'])
+
+
+def page_query(query, args, sort='id'):
+    """
+    The query of one page (see keyset_page): the seek after the cursor,
+    the order of the sort and limit + 1 rows. Returns (query, limit).
+    """
+    limit = page_size(args)
+    cursor = args.get('cursor')
+    if cursor:
+        query = seek(query, cursor, sort)
+    return query.order_by(*sort_order(sort)).limit(limit + 1), limit
+
+
+def keyset_page(query, args, sort='id'):
+    """
+    Returns one page of tasks and the cursor of the next page.
+    Seeks on (user_id, id) instead of OFFSET: the query must already
+    be filtered by user_id, here only 'id > cursor' is added. So the cost
+    of a page does not depend on how deep the client has scrolled.
+    Other sorts seek the same way on (user_id, column, id), see seek().
+    One extra row is fetched to find out whether there is a next page.
+    next_cursor is None on the last page.
+    """
+    query, limit = page_query(query, args, sort)
+    tasks = query.all()
+    next_cursor = None
+    if len(tasks) > limit:
+        tasks = tasks[:limit]
+        next_cursor = encode_cursor(tasks[-1], sort)
+    return tasks, next_cursor
@@ -0,0 +1,56 @@
+from flask import current_app
+from sqlalchemy.orm import lazyload, noload, raiseload, selectinload
+
+from app_template.extensions import db
+from app_template.models import Tasks
+from .filters import filter_tasks
+from .pagination import SORTS
+from .serializers import task_serializer
+
+
+# ? How the task routes load 'Tasks.user', TASKS_USER_LOADER in the config.py
+# *  raiseload    --- accessing task.user raises: proves no lazy loads happen
+# *  noload       --- task.user is always None, never queried
+# *  selectinload --- all users of a page come in one extra query
+# *  lazyload     --- the model default, one query per task (N+1)
+USER_LOADERS = {
+    'raiseload': raiseload,
+    'noload': noload,
+    'selectinload': selectinload,
+    'lazyload': lazyload,
+}
+
+
+def user_loader(strategy=None):
+    """ Loader option for Tasks.user, by default from the config """
+    strategy = strategy or current_app.config['TASKS_USER_LOADER']
+    return USER_LOADERS[strategy](Tasks.user)
+
+
+def tasks_query(user_id, strategy=None):
+    """
+    The base query of the task routes: tasks of one user, with the
+    loader option of Tasks.user. The serializer never reads task.user,
+    so the routes run a constant number of queries whatever the size
+    of a page is.
+    """
+    return Tasks.query.filter_by(user_id=user_id).options(
+        user_loader(strategy))
+
+
+def task_rows(user_id, params=None):
+    """
+    Tasks of one user as plain rows of the columns the API shows.
+    Rows are not ORM objects: they do not go to the session, so reading
+    them in chunks keeps the memory flat.
+    'params' (filters.task_list_params) adds the filters and selects only
+    the columns of the asked fields, plus the sort column for the cursor.
+    Not ordered: keyset_page and stream_tasks order by the sort.
+    """
+    if params is None:
+        return db.session.query(*task_serializer.columns()).filter(
+            Tasks.user_id == user_id)
+    columns = task_serializer.columns(
+        params.fields, extra=(SORTS[params.sort][0],))
+    return filter_tasks(
+        db.session.query(*columns).filter(Tasks.user_id == user_id), params)
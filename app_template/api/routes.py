@@ -1,58 +1,53 @@
 from flask import (
+    Response,
+    current_app,
     jsonify,
     abort,
     make_response,
     request,
-    url_for,
-    render_template)
+    render_template,
+    stream_with_context)
 from flask_praetorian import auth_required, current_user, roles_required
 
-from app_template.extensions import db, guard
-from app_template.models import Tasks, TasksSchema, User
+from app_template.events import change_feed, parse_last_event_id, \
+    task_event
+from app_template.extensions import db
+from app_template.metrics import metrics
+from app_template.models import Tasks, User
+from app_template.passwords import hasher
+from app_template.ratelimit import limiter
+from app_template.search import search
+from app_template.tokens import guard
 from ..api import bp
-
-
-def make_public_task(tasks):
+from .batch import apply_batch, validate_batch
+from .etags import make_etag, not_modified, tag_response, tasks_etag
+from .export import EXPORT_FORMATS, export_rows, export_stream
+from .filters import task_list_params
+from .pagination import keyset_page, page_size
+from .queries import task_rows, tasks_query
+from .serializers import task_serializer
+from .stats import all_stats, user_stats
+from .streaming import stream_format, stream_tasks
+from .validators import valid_task_fields
+from .writes import record_task_write
+
+
+def make_public_task(tasks, fields=None):
     """
     This is a helper function.
-    Prepares a class 'Tasks' for serialization in JSON
-    Using a nested function 'pretty_task()'
-    hides the internal structure API from the user
-    and makes the output of information more beautiful.
-    """
-    def pretty_task(task):
-        """
-        This is a nested functions.
-        It changes the task id to the url task path.
-        Deletes the user id field.
-        """
-
-        pretty_task = {}
-        for field in task:
-            if field == 'id':
-                # ? Replace id task to uri
-                pretty_task['uri'] = url_for(
-                    'api.get_task', task_id=task['id'], _external=True)
-            # ? Delete user id
-            elif field == 'user':
-                continue
-            else:
-                pretty_task[field] = task[field]
-        return pretty_task
-
+    Prepares a class 'Tasks' for serialization in JSON.
+    Hides the internal structure API from the user
+    and makes the output of information more beautiful:
+    the task id is replaced by the url task path, the user is not shown.
+    The work is done by the compiled 'task_serializer'.
+    'fields' - names of the output fields of a list, by default all.
+    """
     if tasks:
-        if type(tasks) == list:
-            public_tasks = []
-            # ? class serialization in JSON
-            tasks = TasksSchema().dump(tasks, many=True)
-            for task in tasks:
-                public_tasks.append(pretty_task(task))
-            return public_tasks
-        else:
-            # ? class serialization in JSON
-            task = TasksSchema().dump(tasks)
-            public_task = pretty_task(task)
-            return public_task
+        with metrics.measure('serialization'):
+            if type(tasks) == list:
+                return task_serializer.dump_many(tasks, fields=fields)
+            else:
+                return task_serializer.dump(tasks)
 
 
 # ! API Routes
@@ -99,6 +94,19 @@ def get_tasks():
     With each request it is necessary to transfer a token in the request
     header. Based on this, the current user is determined and a database
     query is made.
+    Answers 304 Not Modified if the "If-None-Match" header has the ETag
+    of the current version of the user tasks.
+    The list is paginated: 'limit' sets the page size (capped by
+    TASKS_MAX_PAGE_SIZE in the config.py), 'cursor' takes the 'next_cursor'
+    value from the previous page. 'next_cursor' is null on the last page.
+    Streaming mode: with "Accept: application/x-ndjson" (one task per line)
+    or "Accept: application/stream+json" (one JSON array) all the tasks
+    are sent in one response, by chunks, without pages.
+    Filters, sort and projection run in the database
+    (see filters.task_list_params), a bad value answers 400:
+    'done' (true/false), 'title_prefix', 'sort' (id, title, done,
+    '-' for descending), 'fields' (comma-separated: uri,title,...).
+    A cursor belongs to its sort, the filters must stay the same.
 
     A simple request example:
 
@@ -106,16 +114,142 @@ def get_tasks():
     -i -X GET
     -H "Content-Type: application/json"
     -H "Authorization: Bearer <your token>"
-    http://localhost:5000/api/v.1.0/todo/tasks
+    http://localhost:5000/api/v.1.0/todo/tasks?limit=20&cursor=<next_cursor>
+
+    curl
+    -i -X GET
+    -H "Authorization: Bearer <your token>"
+    "http://localhost:5000/api/v.1.0/todo/tasks?done=false&sort=-title&fields=uri,title"
 
     """
+    params = task_list_params(request.args)
     user = current_user()
-    tasks = Tasks.query.filter_by(user_id=user.id).all()
-    response = make_public_task(tasks)
+    # * Conditional GET, nothing is queried if the client is up to date
+    etag = tasks_etag(user.id)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    # * Streaming mode, all tasks at once
+    media_type = stream_format()
+    if media_type:
+        response = stream_tasks(
+            task_rows(user.id, params), media_type,
+            params.sort, params.fields)
+        tag_response(response, etag)
+        return response
+
+    tasks, next_cursor = keyset_page(
+        task_rows(user.id, params), request.args, params.sort)
+    response = make_public_task(tasks, params.fields)
     if response:
-        return jsonify({'tasks': response})
+        response = jsonify({'tasks': response, 'next_cursor': next_cursor})
     else:
-        return jsonify({'tasks': 'no tasks'})
+        response = jsonify({'tasks': 'no tasks'})
+    tag_response(response, etag)
+    return response
+
+
+@bp.route('/v.1.0/todo/tasks/search', methods=['GET'])
+@auth_required
+def search_tasks():
+    """
+    Full-text search of the user tasks by title and description.
+    'q' - words to find, all of them must match (a word matches its
+    forms: "reviewed" finds "review"), other characters are ignored.
+    The best 'limit' tasks come first (ranked by bm25, title matches
+    count more), see app_template/search.py. No words in 'q' -> 400.
+    Answers 304 Not Modified the same way as get_tasks.
+
+    A simple request example:
+
+    curl
+    -i -X GET
+    -H "Authorization: Bearer <your token>"
+    "http://localhost:5000/api/v.1.0/todo/tasks/search?q=review+models"
+
+    """
+    words = search.terms(request.args.get('q'))
+    if not words:
+        abort(400)
+    limit = page_size(request.args)
+    user = current_user()
+    etag = tasks_etag(user.id)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    response = make_public_task(search.tasks(user.id, words, limit))
+    if response:
+        response = jsonify({'tasks': response})
+    else:
+        response = jsonify({'tasks': 'no tasks'})
+    tag_response(response, etag)
+    return response
+
+
+@bp.route('/v.1.0/todo/tasks/events', methods=['GET'])
+@auth_required
+def task_events():
+    """
+    Server-Sent Events (text/event-stream) of the user task changes,
+    instead of polling the task list. Every create, update and delete
+    (batch and ASGI routes too) is one message: "event: create" with
+    "data: {uri, title, description, done}", "event: delete" with
+    "data: {uri}"; the "id:" is the position in the log (events.py).
+    A new client gets "event: ready" first. A client that reconnects
+    with "Last-Event-ID" (or ?last_event_id=) gets the changes it missed;
+    "event: reset" means they are gone or too many, read the list again.
+    A comment line is sent every EVENTS_HEARTBEAT seconds of silence.
+
+    A simple request example:
+
+    curl
+    -N -H "Authorization: Bearer <your token>"
+    -H "Last-Event-ID: 42"
+    http://localhost:5000/api/v.1.0/todo/tasks/events
+
+    """
+    last_id = parse_last_event_id(
+        request.headers.get('Last-Event-ID') or
+        request.args.get('last_event_id'))
+    if last_id == -1:
+        abort(400)
+    messages = change_feed.stream(
+        current_user().id, last_id, task_serializer.uri_prefix())
+    return Response(
+        stream_with_context(messages), mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@bp.route('/v.1.0/todo/stats', methods=['GET'])
+@auth_required
+def get_stats():
+    """
+    Totals of the user tasks: {"total", "done", "undone"}.
+    Read from the counters that every task write moves (api/stats.py):
+    one primary key lookup, no COUNT over the tasks.
+    Answers 304 Not Modified the same way as get_tasks.
+
+    A simple request example:
+
+    curl
+    -i -X GET
+    -H "Authorization: Bearer <your token>"
+    http://localhost:5000/api/v.1.0/todo/stats
+
+    """
+    user = current_user()
+    version, stats = user_stats(user.id)
+    etag = make_etag(
+        user.id, version, request.full_path, request.host_url,
+        request.headers.get('Accept', ''))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    response = jsonify({'stats': stats})
+    tag_response(response, etag)
+    return response
 
 
 @bp.route('/v.1.0/todo/tasks/<int:task_id>', methods=['GET'])
@@ -127,6 +261,8 @@ def get_task(task_id):
     With each request it is necessary to transfer a token in the request
     header. Based on this, the current user is determined and a database
     query is made.
+    Answers 304 Not Modified if the "If-None-Match" header has the ETag
+    of the current version of the user tasks.
 
     A simple request example:
 
@@ -134,14 +270,23 @@ def get_task(task_id):
     -i -X GET
     -H "Content-Type: application/json"
     -H "Authorization: Bearer <your token>"
+    -H 'If-None-Match: "<ETag of the previous response>"'
     http://localhost:5000/api/v.1.0/todo/tasks/1 or 2,3....
 
     """
     user = current_user()
-    task = Tasks.query.filter_by(user_id=user.id, id=task_id).first()
+    # * Conditional GET, nothing is queried if the client is up to date
+    etag = tasks_etag(user.id)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    task = tasks_query(user.id).filter_by(id=task_id).first()
     response = make_public_task(task)
     if response:
-        return jsonify({'task': response})
+        response = jsonify({'task': response})
+        tag_response(response, etag)
+        return response
 
     abort(404)
 
@@ -169,7 +314,8 @@ def create_task():
     """
 
     user = current_user()
-    if not request.json or 'title' not in request.json:
+    if not request.json or not valid_task_fields(
+            request.json, required=('title',)):
         abort(400)
     new_task = Tasks(
         title=request.json['title'],
@@ -177,12 +323,11 @@ def create_task():
         user_id=user.id)
     # *Add to db new task
     db.session.add(new_task)
+    db.session.flush()
+    # *Show new task, the flush gave it an id, no need to query it back
+    response = make_public_task(new_task)
+    record_task_write(user.id, [task_event('create', new_task)], total=1)
     db.session.commit()
-    # *Get from db new task
-    last_task = Tasks.query.filter_by(user_id=user.id).order_by(
-        Tasks.id.desc()).first()
-    # *Show new task
-    response = make_public_task(last_task)
     if response:
         return jsonify({'new_task': response}), 201
 
@@ -212,24 +357,20 @@ def update_task(task_id):
 
     user = current_user()
     # * Request verification
-    if not request.json:
-        abort(400)
-    if 'title' in request.json and type(request.json['title']) != str:
-        abort(400)
-    if 'description' in request.json and type(
-            request.json['description']) is not str:
-        abort(400)
-    if 'done' in request.json and type(request.json['done']) is not bool:
+    if not request.json or not valid_task_fields(request.json):
         abort(400)
 
-    task = Tasks.query.filter_by(user_id=user.id, id=task_id).first()
+    task = tasks_query(user.id).filter_by(id=task_id).first()
     # * Change task
     if task:
+        was_done = task.done
         task.title = request.json.get('title', task.title)
         task.description = request.json.get('description', task.description)
         task.done = request.json.get('done', task.done)
 
         db.session.add(task)
+        record_task_write(user.id, [task_event('update', task)],
+                          done=int(task.done) - int(was_done))
         db.session.commit()
         response = make_public_task(task)
         return jsonify({'task_update': response})
@@ -258,9 +399,11 @@ def delete_task(task_id):
     """
 
     user = current_user()
-    task = Tasks.query.filter_by(user_id=user.id, id=task_id).first()
+    task = tasks_query(user.id).filter_by(id=task_id).first()
     if task:
         db.session.delete(task)
+        record_task_write(user.id, [task_event('delete', task)],
+                          total=-1, done=-int(task.done))
         db.session.commit()
         response = {'task_delete': 'Success'}
         return jsonify(response)
@@ -268,27 +411,151 @@ def delete_task(task_id):
     abort(404)
 
 
+@bp.route('/v.1.0/todo/tasks/batch', methods=['POST'])
+@auth_required
+def batch_tasks():
+    """
+    Creates, updates and deletes many tasks at once.
+    To access, you need to go through verification and get a token.
+    The whole batch is checked first: if any item is invalid nothing
+    is written and the indexes of the bad items are returned with 400.
+    Otherwise all changes are applied in one transaction.
+    'create' items need a "title", 'update' items need an "id",
+    'delete' is a list of task ids. The batch size is limited by
+    TASKS_BATCH_MAX_SIZE in the config.py
+    Results are returned per item, in the order of the request.
+
+    A simple request example:
+
+    curl
+    -i -X POST
+    -H "Content-Type: application/json"
+    -H "Authorization: Bearer <your token>"
+    -d '{"create":[{"title":"Read a book"}],
+         "update":[{"id":2,"done":true}],
+         "delete":[3]}'
+    http://localhost:5000/api/v.1.0/todo/tasks/batch
+
+    """
+
+    user = current_user()
+    # * Request verification
+    invalid = validate_batch(
+        request.get_json(silent=True),
+        current_app.config['TASKS_BATCH_MAX_SIZE'])
+    if invalid:
+        return make_response(
+            jsonify({'error': 'Bad request', 'invalid': invalid}), 400)
+
+    result = apply_batch(user.id, request.json)
+    with metrics.measure('serialization'):
+        return jsonify({
+            'created': task_serializer.dump_many(result['created']),
+            'updated': [
+                {'id': task, 'error': 'Not found'} if type(task) is int
+                else task_serializer.dump(task)
+                for task in result['updated']],
+            'deleted': [
+                {'id': task_id, 'task_delete': 'Success'} if found
+                else {'id': task_id, 'error': 'Not found'}
+                for task_id, found in result['deleted']],
+        })
+
+
 # ! API Admin routes
 
 
 @bp.route('/v.1.0/admin/todo/tasks/<username>', methods=['GET'])
 @roles_required('admin')
 def get_user_tasks(username):
-    user = User.query.filter_by(username=username).first()
+    """
+    Generates a list of tasks of any user. Only for admins.
+    Paginated, streamed and filtered the same way as get_tasks
+    ('limit', 'cursor', "Accept", 'done', 'title_prefix', 'sort', 'fields').
+    """
+    params = task_list_params(request.args)
+    user = User.lookup(username)
     if user:
-        tasks = Tasks.query.filter_by(user_id=user.id).all()
-        response = make_public_task(tasks)
+        etag = tasks_etag(user.id)
+        cached = not_modified(etag)
+        if cached:
+            return cached
+
+        media_type = stream_format()
+        if media_type:
+            response = stream_tasks(
+                task_rows(user.id, params), media_type,
+                params.sort, params.fields)
+            tag_response(response, etag)
+            return response
+
+        tasks, next_cursor = keyset_page(
+            task_rows(user.id, params), request.args, params.sort)
+        response = make_public_task(tasks, params.fields)
         if response:
-            return jsonify({'tasks': response})
+            response = jsonify(
+                {'tasks': response, 'next_cursor': next_cursor})
         else:
-            return jsonify({'tasks': 'no tasks'})
+            response = jsonify({'tasks': 'no tasks'})
+        tag_response(response, etag)
+        return response
     abort(404)
 
 
+@bp.route('/v.1.0/admin/todo/stats', methods=['GET'])
+@roles_required('admin')
+def get_all_stats():
+    """
+    Totals of the tasks of all users and the number of users.
+    Only for admins. A sum of the user counters, cached for
+    STATS_CACHE_TTL seconds (config.py).
+    """
+    return jsonify({'stats': all_stats()})
+
+
+@bp.route('/v.1.0/admin/todo/export', methods=['GET'])
+@roles_required('admin')
+def export_tasks():
+    """
+    Streams every task with the name of its user, as a download.
+    Only for admins. 'format' - csv (default) or ndjson, 'gzip=1' -
+    a .gz file compressed on the fly, 'username' - one user only.
+    Rows are read and sent by chunks of EXPORT_CHUNK (config.py),
+    the memory does not depend on the number of tasks.
+    The same export from the terminal: $ flask export-tasks
+
+    A simple request example:
+
+    curl
+    -H "Authorization: Bearer <your token>"
+    -o tasks.csv.gz
+    "http://localhost:5000/api/v.1.0/admin/todo/export?format=csv&gzip=1"
+
+    """
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        abort(400)
+    gzip = request.args.get('gzip') in ('1', 'true')
+    filename = 'tasks.' + export_format
+    mimetype = EXPORT_FORMATS[export_format]
+    if gzip:
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    chunks = export_stream(
+        export_rows(request.args.get('username')), export_format,
+        current_app.config['EXPORT_CHUNK'], gzip,
+        current_app.config['EXPORT_GZIP_LEVEL'])
+    return Response(
+        stream_with_context(chunks), mimetype=mimetype,
+        headers={'Content-Disposition':
+                 'attachment; filename="{}"'.format(filename)})
+
+
 # ! GUARD API
 
 
 @bp.route('/v.1.0/login', methods=['POST'])
+@limiter.limit('LOGIN_IP', 'LOGIN_USERNAME')  # ? before any hashing
 def login():
     """
     Creates a temporary token for a registered user.
@@ -312,15 +579,17 @@ def login():
     if 'username' not in request.json or 'password' not in request.json:
         abort(400)
 
-    user = User.query.filter_by(username=request.json['username']).first()
+    user = User.lookup(request.json['username'])
     if user is None or not user.check_password_hash(request.json['password']):
         abort(401)
+    user = hasher.rehash_if_needed(user, request.json['password'])
 
     token = guard.encode_jwt_token(user)
     return jsonify({'access_token': token})
 
 
 @bp.route('/v.1.0/refresh', methods=['POST'])
+@limiter.limit('REFRESH_IP')
 def refresh():
     """
     Updates the token if its lifetime has expired.
@@ -359,3 +628,15 @@ def not_found(error):
 @bp.errorhandler(400)
 def bad_request(error):
     return make_response(jsonify({'error': 'Bad request'}), 400)
+
+
+@bp.errorhandler(429)
+def too_many_requests(error):
+    response = make_response(jsonify({'error': 'Too many requests'}), 429)
+    response.headers['Retry-After'] = str(getattr(error, 'retry_after', 1))
+    return response
+
+
+@bp.errorhandler(503)
+def service_unavailable(error):
+    return make_response(jsonify({'error': 'Service unavailable'}), 503)
@@ -0,0 +1,135 @@
+import threading
+from operator import attrgetter
+
+from flask import current_app, has_request_context, request, url_for
+
+from app_template.cache import TTLCache
+from app_template.models import Tasks
+
+
+class TaskSerializer(object):
+    """
+    Serializes 'Tasks' for the API output.
+    The schema is built and compiled once, on first use: every dump
+    field of PublicTasksSchema turns into a plain attribute getter and
+    the 'id' field turns into the task 'uri'. The uri is made from a template
+    (one url_for call per app and host instead of one per task).
+
+    Simple example:
+    >>> task_serializer.dump(task)
+    {'description': '...', 'done': False, 'title': '...', 'uri': '...'}
+    >>> task_serializer.dump_many(tasks)
+    [{...}, {...}]
+    """
+
+    def __init__(self, app=None):
+        # ? (fields, attributes), built by compile()
+        self._compiled = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['task_serializer'] = self
+        # ? host url -> uri template, filled lazily by uri_prefix()
+        templates = TTLCache(
+            ttl=3600, maxsize=64, config_prefix='TASK_URI_CACHE')
+        templates.init_app(app)
+        app.extensions['task_uri_templates'] = templates
+
+    def uri_prefix(self):
+        """
+        Returns the external uri of a task without the id.
+        Computed once per host, the app may be reached by several names.
+        The host comes from the client (Host header): the templates are
+        an LRU of TASK_URI_CACHE_SIZE hosts, not one entry per name sent.
+        """
+        templates = current_app.extensions['task_uri_templates']
+        host = request.host_url if has_request_context() else None
+        prefix = templates.get(host)
+        if prefix is None:
+            uri = url_for('api.get_task', task_id=0, _external=True)
+            prefix = uri[:-1]
+            templates.set(host, prefix)
+        return prefix
+
+    def compile(self):
+        """
+        Output fields as (name, getter) and the model attributes they read.
+        Built by the first call: marshmallow (schemas.py) is imported
+        by the first task dumped, not by the API routes.
+        """
+        if self._compiled is not None:
+            return self._compiled
+        from app_template.schemas import PublicTasksSchema
+        with self._lock:
+            if self._compiled is None:
+                fields = []
+                # ? model attributes the fields read, see columns()
+                attributes = []
+                # ? sorted: the schema gives its fields in a per-process
+                # ? order, every process must give the same body for one ETag
+                for name, field in sorted(
+                        PublicTasksSchema().dump_fields.items()):
+                    attribute = field.attribute or name
+                    attributes.append(attribute)
+                    if name == 'id':
+                        # ? Replace id task to uri
+                        fields.append(('uri', None))
+                    else:
+                        fields.append((name, attrgetter(attribute)))
+                self._compiled = (fields, attributes)
+        return self._compiled
+
+    @property
+    def fields(self):
+        return self.compile()[0]
+
+    @property
+    def attributes(self):
+        return self.compile()[1]
+
+    def names(self):
+        """ Names of the output fields, 'uri' instead of 'id' """
+        return [name for name, _ in self.fields]
+
+    def columns(self, fields=None, extra=()):
+        """
+        Columns of 'Tasks' the output needs. A query of these columns
+        gives plain rows that dump_many takes as well as 'Tasks' objects.
+        'fields' - only the columns of these output fields (the id is
+        always there), 'extra' - more attributes, e.g. of the sort.
+        """
+        attributes = ['id']
+        for (name, _), attribute in zip(self.fields, self.attributes):
+            if fields is None or name in fields:
+                attributes.append(attribute)
+        attributes.extend(extra)
+        return [getattr(Tasks, attribute)
+                for attribute in dict.fromkeys(attributes)]
+
+    def dump(self, task):
+        return self.dump_many([task])[0]
+
+    def dump_many(self, tasks, prefix=None, fields=None):
+        """
+        Batch path: the uri template and getters are looked up once.
+        'prefix' - uri of a task without the id, for callers that have
+        no Flask request (the ASGI routes), by default uri_prefix().
+        'fields' - names of the output fields to keep, by default all.
+        """
+        if prefix is None:
+            prefix = self.uri_prefix()
+        if fields is None:
+            fields = self.fields
+        else:
+            fields = [field for field in self.fields if field[0] in fields]
+        return [
+            {
+                name: prefix + str(task.id) if get is None else get(task)
+                for name, get in fields
+            }
+            for task in tasks]
+
+
+task_serializer = TaskSerializer()
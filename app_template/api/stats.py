@@ -0,0 +1,94 @@
+from sqlalchemy import and_, case, func, or_, select
+
+from app_template.cache import TTLCache
+from app_template.extensions import db
+from app_template.models import Tasks, User
+
+
+# *Totals of all users for the admins. Lifetime: STATS_CACHE_TTL
+stats_cache = TTLCache(ttl=5, config_prefix='STATS_CACHE')
+
+
+def stats_dict(total, done):
+    return {'total': total, 'done': done, 'undone': total - done}
+
+
+def stats_query(user_id):
+    """ The task counters of the user, a primary key lookup """
+    return db.session.query(
+        User.tasks_version, User.tasks_total, User.tasks_done).filter(
+        User.id == user_id)
+
+
+def user_stats(user_id):
+    """
+    (tasks_version, stats) of the user from the counters of the 'user'
+    row: one primary key lookup, whatever the number of tasks is.
+    The counters are moved by every task write (writes.py),
+    in the transaction of the write.
+    """
+    row = stats_query(user_id).first()
+    if row is None:
+        return 0, stats_dict(0, 0)
+    return row.tasks_version, stats_dict(row.tasks_total, row.tasks_done)
+
+
+def all_stats():
+    """
+    Totals of every user, a sum of the counters (no scan of 'tasks'),
+    cached for STATS_CACHE_TTL seconds.
+    """
+    stats = stats_cache.get('all')
+    if stats is None:
+        users, total, done = db.session.query(
+            func.count(User.id),
+            func.coalesce(func.sum(User.tasks_total), 0),
+            func.coalesce(func.sum(User.tasks_done), 0)).one()
+        stats = stats_dict(int(total), int(done))
+        stats['users'] = users
+        stats_cache.set('all', stats)
+    return stats
+
+
+def drifted_users():
+    """
+    [(user id, (counters), (counted))] of the users whose counters
+    differ from a count of their tasks. One GROUP BY over 'tasks',
+    read from the (user_id, done) index.
+    """
+    counts = db.session.query(
+        Tasks.user_id.label('user_id'),
+        func.count(Tasks.id).label('total'),
+        func.sum(case([(Tasks.done, 1)], else_=0)).label('done')).group_by(
+        Tasks.user_id).subquery()
+    total = func.coalesce(counts.c.total, 0)
+    done = func.coalesce(counts.c.done, 0)
+    query = db.session.query(
+        User.id, User.tasks_total, User.tasks_done, total, done).outerjoin(
+        counts, counts.c.user_id == User.id).filter(or_(
+            User.tasks_total != total, User.tasks_done != done)).order_by(
+        User.id)
+    return [(row[0], (row[1], row[2]), (row[3], row[4])) for row in query]
+
+
+def reconcile_stats(user_ids, chunk=500):
+    """
+    Sets the counters of the users from a count of their tasks.
+    The count is a subquery of the UPDATE itself, so a write that
+    commits meanwhile is not lost. The tasks version is bumped too:
+    the stats responses get a new ETag.
+    """
+    user_ids = list(user_ids)
+    total = select([func.count(Tasks.id)]).where(
+        Tasks.user_id == User.id).as_scalar()
+    done = select([func.count(Tasks.id)]).where(and_(
+        Tasks.user_id == User.id, Tasks.done == True)).as_scalar()  # noqa E712
+    for start in range(0, len(user_ids), chunk):
+        db.session.query(User).filter(
+            User.id.in_(user_ids[start:start + chunk])).update({
+                User.tasks_version: User.tasks_version + 1,
+                User.tasks_total: total,
+                User.tasks_done: done}, synchronize_session=False)
+        db.session.commit()
+    stats_cache.invalidate()
+    return len(user_ids)
@@ -0,0 +1,55 @@
+from itertools import islice
+
+from flask import Response, current_app, json, request, stream_with_context
+
+from .pagination import seek, sort_order
+from .serializers import task_serializer
+
+
+# * Media types of the streaming mode, asked by the "Accept" header
+NDJSON = 'application/x-ndjson'  # ? one task per line
+JSON_STREAM = 'application/stream+json'  # ? one JSON array, sent by parts
+
+
+def stream_format():
+    """
+    Streaming is opt-in: the client must name one of the types
+    explicitly, "*/*" or "application/json" keep the usual response.
+    """
+    for value, quality in request.accept_mimetypes:
+        if quality and value in (NDJSON, JSON_STREAM):
+            return value
+    return None
+
+
+def stream_tasks(rows, media_type, sort='id', fields=None):
+    """
+    Streams every task of the query (from 'cursor', if the request
+    has it), without pages. Rows are read with yield_per by chunks of
+    TASKS_STREAM_CHUNK, every chunk is serialized and sent at once,
+    so the peak memory does not depend on the number of tasks.
+    'sort' and 'fields' are those of filters.task_list_params.
+    """
+    size = current_app.config['TASKS_STREAM_CHUNK']
+    cursor = request.args.get('cursor')
+    if cursor:
+        rows = seek(rows, cursor, sort)
+    rows = rows.order_by(*sort_order(sort))
+
+    def generate():
+        results = iter(rows.yield_per(size))
+        first = True
+        if media_type == JSON_STREAM:
+            yield '['
+        for chunk in iter(lambda: list(islice(results, size)), []):
+            items = [json.dumps(item) for item in
+                     task_serializer.dump_many(chunk, fields=fields)]
+            if media_type == NDJSON:
+                yield '\n'.join(items) + '\n'
+            else:
+                yield ('' if first else ',') + ','.join(items)
+            first = False
+        if media_type == JSON_STREAM:
+            yield ']'
+
+    return Response(stream_with_context(generate()), mimetype=media_type)
@@ -0,0 +1,24 @@
+# * Types of the task fields the API accepts from the user
+TASK_FIELDS = {
+    'title': str,
+    'description': str,
+    'done': bool,
+}
+
+
+def valid_task_fields(data, required=()):
+    """
+    Request verification - checks the task fields.
+    Fields from 'required' must be present. Known fields must have
+    the right type, extra fields that are not defined
+    in the "Tasks" class are ignored.
+    """
+    if not isinstance(data, dict):
+        return False
+    for field in required:
+        if field not in data:
+            return False
+    for field, field_type in TASK_FIELDS.items():
+        if field in data and type(data[field]) is not field_type:
+            return False
+    return True
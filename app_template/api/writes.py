@@ -0,0 +1,40 @@
+from app_template.extensions import db
+from app_template.models import TaskEvents, User
+
+
+def task_write_statements(user_id, events=(), total=0, done=0):
+    """
+    The side effects of every task write, as [(statement, params)]:
+    * one UPDATE of the user row: the tasks version (the ETag, etags.py)
+      and the task counters (stats.py), 'total' and 'done' are +1/-1 for
+      a created/deleted task and +1/-1 when 'done' changes;
+    * the rows of the change log (events.task_event), one executemany.
+    The Flask routes run them by record_task_write, the ASGI routes
+    (aio.py) on their own connection, both in the transaction of the
+    write: the change and its effects are committed together.
+    """
+    users = User.__table__
+    values = {users.c.tasks_version: users.c.tasks_version + 1}
+    if total:
+        values[users.c.tasks_total] = users.c.tasks_total + total
+    if done:
+        values[users.c.tasks_done] = users.c.tasks_done + done
+    statements = [(users.update().where(users.c.id == user_id).values(
+        values), None)]
+    if events:
+        statements.append((TaskEvents.__table__.insert(), [
+            dict(event, user_id=user_id) for event in events]))
+    return statements
+
+
+def record_task_write(user_id, events=(), total=0, done=0):
+    """
+    Runs task_write_statements in the session, before the commit.
+    A plain UPDATE: the identity cache does not keep tasks_version.
+    The change feed of this process reads the events after the commit.
+    """
+    for statement, params in task_write_statements(
+            user_id, events, total, done):
+        db.session.execute(statement, params)
+    if events:
+        db.session.info['task_events'] = True
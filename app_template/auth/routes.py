@@ -2,30 +2,26 @@ from flask import render_template, redirect, url_for, request
 from werkzeug.urls import url_parse
 from flask_login import login_user, current_user, logout_user
 
-from app_template.extensions import login
 from app_template.models import User
+from app_template.passwords import hasher
+from app_template.ratelimit import limiter, remote_addr
 from ..auth import bp
 
 
-login.login_view = 'auth.login'
-# login.login_message = 'Che OXYEL kyda presh'
-
-
-@login.user_loader
-def load_user(id):
-    return User.query.get(int(id))
-
-
 @bp.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('main.index'))
 
     if request.method == 'POST':
-        user = User.query.filter_by(username=request.form['username']).first()
+        # ? the limits of /api/v.1.0/login, before any hashing
+        limiter.hit('LOGIN_IP', remote_addr())
+        limiter.hit('LOGIN_USERNAME', request.form.get('username'))
+        user = User.lookup(request.form['username'])
         if user is None or not user.check_password_hash(
                 request.form['password']):
             return redirect(url_for('auth.login'))
+        user = hasher.rehash_if_needed(user, request.form['password'])
         login_user(user)
         next_page = request.args.get('next')
         if not next_page or url_parse(next_page).netloc != '':
@@ -0,0 +1,82 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache(object):
+    """
+    Small in-process cache. Every value lives 'ttl' seconds.
+    With 'maxsize' the cache is bounded: the least recently used
+    value is evicted first. Thread safe. Counts hits and misses,
+    see stats().
+    Like the other extensions it may be configured by init_app(app):
+    <CONFIG_PREFIX>_TTL and <CONFIG_PREFIX>_SIZE from the config.py
+
+    Simple example:
+    >>> cache = TTLCache(ttl=60, maxsize=100)
+    >>> cache.set('key', 'value')
+    >>> cache.get('key')
+    'value'
+    >>> cache.stats()
+    {'hits': 1, 'misses': 0, 'size': 1}
+    """
+
+    def __init__(self, ttl=60, maxsize=None, config_prefix=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.config_prefix = config_prefix
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        if self.config_prefix:
+            self.ttl = app.config.get(self.config_prefix + '_TTL', self.ttl)
+            self.maxsize = app.config.get(
+                self.config_prefix + '_SIZE', self.maxsize)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires = item
+                if expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            if self.maxsize is not None:
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """ Drops one key or, without a key, everything """
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """ Drops every value for which predicate(value) is true """
+        with self._lock:
+            for key in [
+                    key for key, (value, _) in self._data.items()
+                    if predicate(value)]:
+                del self._data[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._data)}
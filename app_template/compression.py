@@ -0,0 +1,220 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import zlib
+
+from flask import current_app, request, safe_join, send_from_directory, \
+    url_for
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header
+
+
+# ? Content codings, in the order of preference
+CODINGS = ('gzip', 'deflate')
+
+# ? Static files that are worth a .gz copy
+STATIC_EXTENSIONS = ('.css', '.js', '.map', '.svg', '.html', '.json',
+                     '.txt', '.xml', '.ico')
+
+
+def negotiate(accept_encoding):
+    """ Best coding of an Accept-Encoding header value, or None """
+    accept = parse_accept_header(accept_encoding or '', Accept)
+    return accept.best_match(CODINGS)
+
+
+def compress(data, coding, level=6):
+    if coding == 'gzip':
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    return zlib.compress(data, level)  # ? HTTP deflate is the zlib format
+
+
+def compress_chunks(iterable, coding, level=6, sync=True):
+    """
+    Compresses a stream of str/bytes chunks on the fly, the memory does
+    not grow with the stream. 'sync' flushes every chunk (Z_SYNC_FLUSH),
+    so the client can decode what came so far; without it zlib keeps
+    its window and the output is smaller (files, downloads).
+    """
+    # ? wbits: 31 - gzip header, 15 - zlib header (deflate)
+    compressor = zlib.compressobj(
+        level, zlib.DEFLATED, 31 if coding == 'gzip' else 15)
+    try:
+        for chunk in iterable:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compressor.compress(chunk)
+            if sync:
+                data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        close = getattr(iterable, 'close', None)
+        if close is not None:
+            close()
+
+
+def weak_etag(value):
+    """ A compressed body is another representation: W/"..." """
+    if value and not value.startswith('W/'):
+        return 'W/' + value
+    return value
+
+
+class Compressor(object):
+    """
+    Compresses the responses of the app, gzip or deflate as the client
+    asks by Accept-Encoding, and serves precompressed static files.
+    Configured by init_app(app), see the config.py:
+        COMPRESS_ENABLED        --- off: no after_request hook at all
+        COMPRESS_LEVEL          --- zlib level, 1 (fast) ... 9 (small)
+        COMPRESS_MIN_SIZE       --- smaller bodies are sent as they are
+        COMPRESS_MIMETYPES      --- what is compressed (text, JSON...)
+        COMPRESS_STATIC_MAX_AGE --- Cache-Control of versioned static
+    Streamed responses (NDJSON) are compressed chunk by chunk, each
+    chunk is flushed so the client still gets rows as they come.
+    A compressed response gets 'Vary: Accept-Encoding' and its ETag
+    becomes weak, the ETag checks use the weak comparison.
+    Static files: 'flask compress-static' writes a .gz next to every
+    text file of the static folder, the static route sends it to the
+    clients that accept gzip. static_url() in the templates adds the
+    content hash (?v=) to the url, such urls are cached for
+    COMPRESS_STATIC_MAX_AGE (immutable).
+    """
+
+    def __init__(self, app=None):
+        self.level = 6
+        self.min_size = 500
+        self.mimetypes = ()
+        self.static_max_age = 31536000
+        self._versions = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.level = app.config.get('COMPRESS_LEVEL', self.level)
+        self.min_size = app.config.get('COMPRESS_MIN_SIZE', self.min_size)
+        self.mimetypes = app.config.get('COMPRESS_MIMETYPES', self.mimetypes)
+        self.static_max_age = app.config.get(
+            'COMPRESS_STATIC_MAX_AGE', self.static_max_age)
+        app.add_template_global(static_url)
+        if not app.config.get('COMPRESS_ENABLED'):
+            return
+        app.extensions['compressor'] = self
+        app.after_request(self.after_request)
+        if 'static' in app.view_functions:
+            app.view_functions['static'] = self.send_static
+
+    # ! Dynamic responses
+
+    def compressible(self, response):
+        return (
+            response.mimetype in self.mimetypes and
+            200 <= response.status_code < 300 and
+            response.status_code not in (204, 206) and
+            not response.direct_passthrough and
+            'Content-Encoding' not in response.headers)
+
+    def after_request(self, response):
+        if not self.compressible(response):
+            return response
+        response.vary.add('Accept-Encoding')
+        coding = negotiate(request.headers.get('Accept-Encoding'))
+        if coding is None:
+            return response
+        if response.is_streamed:
+            response.response = self.compress_stream(
+                response.response, coding)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            response.set_data(compress(data, coding, self.level))
+        response.headers['Content-Encoding'] = coding
+        if 'ETag' in response.headers:
+            response.headers['ETag'] = weak_etag(response.headers['ETag'])
+        return response
+
+    def compress_stream(self, iterable, coding):
+        return compress_chunks(iterable, coding, self.level)
+
+    # ! Static files
+
+    def send_static(self, filename):
+        app = current_app
+        original = safe_join(app.static_folder, filename)
+        packed = original + '.gz'
+        if negotiate(request.headers.get('Accept-Encoding')) == 'gzip' \
+                and os.path.isfile(packed) and os.path.isfile(original) \
+                and os.path.getmtime(packed) >= os.path.getmtime(original):
+            response = send_from_directory(
+                app.static_folder, filename + '.gz',
+                mimetype=mimetypes.guess_type(filename)[0] or
+                'application/octet-stream',
+                cache_timeout=app.get_send_file_max_age(filename))
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = app.send_static_file(filename)
+        response.vary.add('Accept-Encoding')
+        if request.args.get('v'):
+            response.headers['Cache-Control'] = \
+                'public, max-age={}, immutable'.format(self.static_max_age)
+            response.expires = None
+        return response
+
+    def version(self, path):
+        """ Short content hash of a static file, cached by mtime """
+        mtime = os.path.getmtime(path)
+        cached = self._versions.get(path)
+        if cached is None or cached[0] != mtime:
+            with open(path, 'rb') as file:
+                digest = hashlib.md5(file.read()).hexdigest()[:12]
+            cached = self._versions[path] = (mtime, digest)
+        return cached[1]
+
+
+compressor = Compressor()
+
+
+def static_url(filename):
+    """
+    url_for('static') with the content hash, for the templates:
+    {{ static_url('css/app.css') }} -> /static/css/app.css?v=1a2b3c4d5e6f
+    """
+    path = safe_join(current_app.static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        return url_for('static', filename=filename)
+    return url_for(
+        'static', filename=filename, v=compressor.version(path))
+
+
+def compress_static(folder, level=9, min_size=0):
+    """
+    Writes <file>.gz next to every text file of the folder, unless it
+    is up to date or does not make the file smaller.
+    Returns [(path, size, gzip size)] of the written files.
+    """
+    written = []
+    for root, _, names in os.walk(folder):
+        for name in names:
+            if not name.endswith(STATIC_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            packed = path + '.gz'
+            if os.path.isfile(packed) and \
+                    os.path.getmtime(packed) >= os.path.getmtime(path):
+                continue
+            with open(path, 'rb') as file:
+                data = file.read()
+            if len(data) < min_size:
+                continue
+            compressed = compress(data, 'gzip', level)
+            if len(compressed) >= len(data):
+                continue
+            with open(packed, 'wb') as file:
+                file.write(compressed)
+            written.append((path, len(data), len(compressed)))
+    return written
@@ -0,0 +1,82 @@
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, orm
+from sqlalchemy.pool import QueuePool
+
+from .replicas import RoutingSession
+
+
+# ? Keys of a profile that go to create_engine, the rest is for SQLite
+POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout',
+                'pool_pre_ping', 'pool_recycle')
+
+
+def engine_profile(app):
+    """ The ENGINE_PROFILE of ENGINE_PROFILES in the config.py """
+    name = app.config.get('ENGINE_PROFILE') or 'default'
+    try:
+        return app.config['ENGINE_PROFILES'][name]
+    except KeyError:
+        raise RuntimeError('Unknown ENGINE_PROFILE: {}'.format(name))
+
+
+def pragma_statements(pragmas):
+    return ['PRAGMA {}={}'.format(name, value)
+            for name, value in pragmas.items()]
+
+
+def sqlite_pragmas(app):
+    return engine_profile(app).get('sqlite_pragmas', {})
+
+
+class TunedSQLAlchemy(SQLAlchemy):
+    """
+    Flask-SQLAlchemy with named engine profiles, see ENGINE_PROFILES in
+    the config.py. A profile sets the pool (size, overflow, timeout,
+    pre-ping, recycle) and, on SQLite, the PRAGMAs run by a connect
+    listener on every new connection (WAL, synchronous, busy_timeout,
+    cache_size, mmap_size).
+    On a SQLite file a pool_size gives a QueuePool (SQLAlchemy uses
+    NullPool there, a new connection and new PRAGMAs per checkout);
+    the in-memory database keeps its single StaticPool connection.
+    SQLALCHEMY_ENGINE_OPTIONS still have the last word.
+    The session routes the reads of GET requests to the read replicas,
+    see replicas.py.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(TunedSQLAlchemy, self).__init__(*args, **kwargs)
+        # ? url -> PRAGMAs, filled by apply_driver_hacks for create_engine
+        self._pragmas = {}
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        profile = engine_profile(app)
+        pool = {key: profile[key] for key in POOL_OPTIONS if key in profile}
+        if sa_url.drivername.startswith('sqlite'):
+            if sa_url.database in (None, '', ':memory:'):
+                pool = {key: value for key, value in pool.items()
+                        if key in ('pool_pre_ping', 'pool_recycle')}
+            elif pool.get('pool_size'):
+                options['poolclass'] = QueuePool
+                options.setdefault('connect_args', {})
+                # ? pooled connections move between the request threads
+                options['connect_args']['check_same_thread'] = False
+        options.update(pool)
+        super(TunedSQLAlchemy, self).apply_driver_hacks(app, sa_url, options)
+        if sa_url.drivername.startswith('sqlite'):
+            self._pragmas[str(sa_url)] = profile.get('sqlite_pragmas', {})
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = super(TunedSQLAlchemy, self).create_engine(
+            sa_url, engine_opts)
+        statements = pragma_statements(self._pragmas.get(str(sa_url), {}))
+        if statements:
+            @event.listens_for(engine, 'connect')
+            def set_pragmas(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.close()
+        return engine
@@ -0,0 +1,416 @@
+import queue
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+from json import JSONEncoder
+
+from sqlalchemy import and_, func, select
+
+from .extensions import db
+from .models import TaskEvents
+
+
+# ? A row of task_events, as the feeds pass it around
+Event = namedtuple('Event', (
+    'id', 'user_id', 'task_id', 'kind', 'title', 'description', 'done'))
+
+EVENT_COLUMNS = [getattr(TaskEvents, name) for name in Event._fields]
+
+# ? A comment line: keeps proxies and clients from closing an idle stream
+HEARTBEAT = ': keep-alive\n\n'
+
+encode = JSONEncoder().encode
+
+
+# ! Writing
+
+
+def task_event(kind, task):
+    """ The task_events row of a change of 'task' (a Tasks or a dict) """
+    if not isinstance(task, dict):
+        task = {'id': task.id, 'title': task.title,
+                'description': task.description, 'done': task.done}
+    if kind == 'delete':
+        return {'task_id': task['id'], 'kind': kind, 'title': None,
+                'description': None, 'done': None}
+    return {'task_id': task['id'], 'kind': kind, 'title': task['title'],
+            'description': task['description'], 'done': task['done']}
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def events_committed(session):
+    if session.info.pop('task_events', False):
+        change_feed.notify()
+
+
+def prune_events(days, chunk=10000):
+    """
+    Deletes the events older than 'days' by id ranges (the ids grow
+    with the time), no index on created_at is needed.
+    Returns the number of deleted events.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    keep = db.session.query(TaskEvents.id).filter(
+        TaskEvents.created_at >= cutoff).order_by(TaskEvents.id).first()
+    if keep is None:
+        # ? the last event stays: SQLite would give its id again
+        end = db.session.query(func.max(TaskEvents.id)).scalar() or 0
+    else:
+        end = keep.id
+    start = db.session.query(func.min(TaskEvents.id)).scalar() or end
+    deleted = 0
+    while start < end:
+        start = min(start + chunk, end)
+        deleted += db.session.query(TaskEvents).filter(
+            TaskEvents.id < start).delete(synchronize_session=False)
+        db.session.commit()
+    return deleted
+
+
+# ! Server-Sent Events
+
+
+def format_event(event, uri_prefix):
+    """ One 'create', 'update' or 'delete' message of the SSE stream """
+    data = {'uri': uri_prefix + str(event.task_id)}
+    if event.kind != 'delete':
+        data.update(title=event.title, description=event.description,
+                    done=bool(event.done))
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(
+        event.id, event.kind, encode(data))
+
+
+def format_control(kind, last_id):
+    """
+    A message without a task, its id is where the client resumes from:
+    'ready' - the stream is live (a new client), 'reset' - some changes
+    can not be sent (pruned, or more than EVENTS_REPLAY_MAX), the client
+    must read the task list again.
+    """
+    return 'id: {}\nevent: {}\ndata: {{}}\n\n'.format(last_id, kind)
+
+
+def parse_last_event_id(value):
+    """ The id a client resumes from: None - a new client, -1 - invalid """
+    if not value:
+        return None
+    try:
+        last_id = int(value)
+    except ValueError:
+        return -1
+    return last_id if last_id >= 0 else -1
+
+
+def needs_replay(last_id, newest):
+    return last_id is not None and last_id < newest
+
+
+def resume(last_id, oldest, newest, events, limit, uri_prefix):
+    """
+    The messages a client gets before the live events, and the id it is
+    at after them. 'oldest' - the first id of the log, 'newest' - the
+    last id of the user, 'events' - up to limit + 1 events of the user
+    after last_id (read only if needs_replay).
+    """
+    if last_id is None:
+        return [format_control('ready', newest)], newest
+    if last_id >= newest:
+        return [], last_id
+    if len(events) > limit or last_id < oldest - 1:
+        return [format_control('reset', newest)], newest
+    return [format_event(event, uri_prefix)
+            for event in events], events[-1].id
+
+
+# ! Fan-out
+
+
+class Subscription(object):
+    """
+    One SSE client: a bounded queue of the events of its user.
+    A client that falls EVENTS_QUEUE_SIZE events behind is dropped by
+    the feed ('overflow') and catches up from the log.
+    """
+
+    def __init__(self, user_id, events):
+        self.user_id = user_id
+        self.events = events
+        self.overflow = False
+
+
+class FeedHub(object):
+    """
+    Who listens to the changes of which user.
+    The feed reads the new rows of the log once for all its clients,
+    one primary key range per poll whatever their number is, and
+    publish() puts each event only in the queues of its user.
+    What a client and the poller do is written once, as steps
+    (stream_steps, poll_steps): generators of (action, args) that a
+    feed carries out with its own I/O, see drive(). ChangeFeed runs
+    them on a thread, AsyncChangeFeed (aio.py) on asyncio; both have
+    the actions:
+        subscribe(user_id)           --- a new Subscription
+        log_window(user_id, last_id) --- (oldest, newest, events), see
+                                         resume()
+        next_event(subscription)     --- an event, None after heartbeat
+        sleep()                      --- until a write or poll_interval
+        new_events(cursor)           --- up to 1000 events after cursor
+    """
+
+    Full = queue.Full
+
+    def __init__(self):
+        self.app = None
+        self.cursor = None  # ? the last id read from the log
+        self.poll_interval = 0.5
+        self.heartbeat = 15
+        self.queue_size = 1000
+        self.replay_max = 1000
+        self._subscribers = {}
+        self._runner = None  # ? the poller: a thread or an asyncio task
+        self._lock = threading.Lock()
+
+    def configure(self, app):
+        self.poll_interval = app.config.get(
+            'EVENTS_POLL_INTERVAL', self.poll_interval)
+        self.heartbeat = app.config.get('EVENTS_HEARTBEAT', self.heartbeat)
+        self.queue_size = app.config.get('EVENTS_QUEUE_SIZE', self.queue_size)
+        self.replay_max = app.config.get('EVENTS_REPLAY_MAX', self.replay_max)
+
+    def join(self, subscription, cursor, start):
+        """
+        Adds a client. With no poller running, the log is read from
+        'cursor' (read before the client reads the log) by a new poller:
+        start() starts it.
+        """
+        with self._lock:
+            self._subscribers.setdefault(
+                subscription.user_id, set()).add(subscription)
+            if self._runner is None:
+                self.cursor = cursor
+                self._runner = start()
+        return subscription
+
+    def discard(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id, set())
+            subscribers.discard(subscription)
+            if not subscribers:
+                self._subscribers.pop(subscription.user_id, None)
+
+    def subscribers(self):
+        with self._lock:
+            return sum(len(users) for users in self._subscribers.values())
+
+    def publish(self, events):
+        with self._lock:
+            for event in events:
+                self.cursor = event.id
+                subscribers = self._subscribers.get(event.user_id, ())
+                for subscription in list(subscribers):
+                    try:
+                        subscription.events.put_nowait(event)
+                    except self.Full:
+                        subscription.overflow = True
+                        subscribers.discard(subscription)
+                if not subscribers:
+                    self._subscribers.pop(event.user_id, None)
+
+    def stream_steps(self, user_id, last_id, uri_prefix):
+        """
+        The SSE messages of one client ('send'): the events it missed
+        since last_id, then the live ones.
+        """
+        subscription = yield 'subscribe', (user_id,)
+        try:
+            while True:
+                oldest, newest, events = yield 'log_window', (
+                    user_id, last_id)
+                messages, last_id = resume(
+                    last_id, oldest, newest, events, self.replay_max,
+                    uri_prefix)
+                for message in messages:
+                    yield 'send', message
+                while not subscription.overflow:
+                    event = yield 'next_event', (subscription,)
+                    if event is None:
+                        yield 'send', HEARTBEAT
+                    elif event.id > last_id:
+                        last_id = event.id
+                        yield 'send', format_event(event, uri_prefix)
+                # ? too slow: catch up from the log with a new queue
+                subscription = yield 'subscribe', (user_id,)
+        finally:
+            self.discard(subscription)
+
+    def poll_steps(self):
+        """
+        The poller: reads the new rows of the log after a write or every
+        poll_interval and fans them out. Ends with the last client.
+        """
+        while True:
+            yield 'sleep', ()
+            with self._lock:
+                if not self._subscribers:
+                    self._runner = None
+                    return
+            try:
+                events = yield 'new_events', (self.cursor,)
+                while events:
+                    self.publish(events)
+                    events = yield 'new_events', (self.cursor,)
+            except Exception:
+                # ? the clients wait, the next poll tries again
+                self.app.logger.exception('Change feed: reading task_events')
+
+
+def drive(steps, feed):
+    """
+    Runs the steps of a feed in a thread: every action is a method of
+    the feed, its result is sent back to the steps, an error of it is
+    raised in the steps; 'send' messages are yielded.
+    """
+    result = error = None
+    try:
+        while True:
+            try:
+                if error is not None:
+                    action, args = steps.throw(error)
+                else:
+                    action, args = steps.send(result)
+            except StopIteration:
+                return
+            result = error = None
+            if action == 'send':
+                yield args
+                continue
+            try:
+                result = getattr(feed, action)(*args)
+            except Exception as exc:
+                error = exc
+    finally:
+        steps.close()
+
+
+def user_events_select(user_id, after, limit):
+    """ Events of the user after the id 'after', seek on (user_id, id) """
+    return select(EVENT_COLUMNS).where(and_(
+        TaskEvents.user_id == user_id, TaskEvents.id > after)).order_by(
+        TaskEvents.id).limit(limit)
+
+
+def user_events(connection, user_id, after, limit):
+    return [Event(*row) for row in connection.execute(
+        user_events_select(user_id, after, limit))]
+
+
+def event_bounds(connection, user_id):
+    """ (first id of the log, last id of the user), index lookups """
+    oldest = connection.execute(select([func.min(TaskEvents.id)])).scalar()
+    newest = connection.execute(select([func.max(TaskEvents.id)]).where(
+        TaskEvents.user_id == user_id)).scalar()
+    return oldest, newest or 0
+
+
+def new_events_select(cursor, limit):
+    """ Events of all users after 'cursor', a primary key range """
+    return select(EVENT_COLUMNS).where(TaskEvents.id > cursor).order_by(
+        TaskEvents.id).limit(limit)
+
+
+def new_events(connection, cursor, limit):
+    return [Event(*row) for row in connection.execute(
+        new_events_select(cursor, limit))]
+
+
+class ChangeFeed(FeedHub):
+    """
+    Change feed of the task routes for the SSE clients of the Flask app.
+    A poller thread reads the new rows of task_events every
+    EVENTS_POLL_INTERVAL seconds, and at once after a task write of this
+    process, then fans them out; other processes see the writes at the
+    next poll. The thread runs only while there are clients.
+    Configured by init_app(app), see the config.py:
+        EVENTS_POLL_INTERVAL --- seconds between two reads of the log
+        EVENTS_HEARTBEAT     --- seconds of silence before a keep-alive
+        EVENTS_QUEUE_SIZE    --- events a client may lag behind
+        EVENTS_REPLAY_MAX    --- events sent on resume, more -> 'reset'
+    Under WSGI every client holds a worker thread; the ASGI mode (aio.py)
+    runs the same steps on asyncio, where an idle client is a coroutine.
+    The log ids are read in order, as SQLite commits them. The log is
+    always read from the primary (db.get_engine), never from a replica
+    (replicas.py): a lagging replica would make a client skip events
+    that the cursor of the feed has already passed.
+    """
+
+    def __init__(self, app=None):
+        super(ChangeFeed, self).__init__()
+        self._wake = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.configure(app)
+        app.extensions['change_feed'] = self
+
+    def notify(self):
+        self._wake.set()
+
+    def stream(self, user_id, last_id, uri_prefix):
+        """
+        The SSE messages of one client (stream_steps). Holds no database
+        connection while it waits.
+        """
+        # ? the request is done with its session (the user of the token)
+        db.session.remove()
+        yield from drive(self.stream_steps(user_id, last_id, uri_prefix), self)
+
+    def engine(self):
+        """ The primary database, as the poller reads it """
+        return db.get_engine(self.app)
+
+    # ! Actions of the steps
+
+    def subscribe(self, user_id):
+        subscription = Subscription(
+            user_id, queue.Queue(maxsize=self.queue_size))
+        with self.engine().connect() as connection:
+            cursor = connection.execute(select([
+                func.coalesce(func.max(TaskEvents.id), 0)])).scalar()
+        return self.join(subscription, cursor, self._start)
+
+    def log_window(self, user_id, last_id):
+        with self.engine().connect() as connection:
+            oldest, newest = event_bounds(connection, user_id)
+            events = []
+            if needs_replay(last_id, newest):
+                events = user_events(
+                    connection, user_id, last_id, self.replay_max + 1)
+        return oldest, newest, events
+
+    def next_event(self, subscription):
+        try:
+            return subscription.events.get(timeout=self.heartbeat)
+        except queue.Empty:
+            return None
+
+    def sleep(self):
+        self._wake.wait(self.poll_interval)
+        self._wake.clear()
+
+    def new_events(self, cursor):
+        with self.engine().connect() as connection:
+            return new_events(connection, cursor, 1000)
+
+    def _start(self):
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+        return thread
+
+    def _run(self):
+        for _ in drive(self.poll_steps(), self):
+            pass  # ? the poller sends nothing
+
+
+change_feed = ChangeFeed()
@@ -1,23 +1,38 @@
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
-from flask_marshmallow import Marshmallow
-from flask_praetorian import Praetorian
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
 
-# *SQL DataBase
-db = SQLAlchemy()
-migrate = Migrate()
+from .engine import TunedSQLAlchemy
 
 
-# *Marshmallow /Converting Flask-SQLAlchemy to JSON/
-ma = Marshmallow()
+class LazyMigrate(object):
+    """
+    Flask-Migrate imports alembic, which only 'flask db' needs.
+    It is imported by init_app, create_app calls it for the CLI only
+    in the lazy mode (see app_template/startup.py).
+    """
+
+    def __init__(self):
+        self.migrate = None
+
+    def init_app(self, app, db=None, **kwargs):
+        from flask_migrate import Migrate
+        if self.migrate is None:
+            self.migrate = Migrate()
+        self.migrate.init_app(app, db, **kwargs)
+
+
+# *SQL DataBase /engine profiles: ENGINE_PROFILE in the config.py/
+db = TunedSQLAlchemy()
+migrate = LazyMigrate()
 
 
 # *Login Manager
 login = LoginManager()
 
 
-# *GUARD App
-guard = Praetorian()
+# *CSRF
 csrf = CSRFProtect()
+
+
+# ? GUARD App: tokens.guard, set up with the API (setup_api).
+# ? Marshmallow: schemas.ma. flask_praetorian and marshmallow load slowly
@@ -0,0 +1,90 @@
+from flask import current_app
+from sqlalchemy.orm import make_transient_to_detached
+
+from .cache import TTLCache
+from .extensions import db
+
+
+# *Users by id and by username.
+# ? Size and lifetime: IDENTITY_CACHE_SIZE, IDENTITY_CACHE_TTL in the config.py
+identity_cache = TTLCache(maxsize=1024, config_prefix='IDENTITY_CACHE')
+
+# ? Columns copied into the cache, relationships are never cached
+IDENTITY_COLUMNS = ('id', 'username', 'password_hash', 'roles')
+
+
+def _key(field, value):
+    return (current_app.config['SQLALCHEMY_DATABASE_URI'], field, value)
+
+
+def identity_query(cls, field, value):
+    """ The user whose 'field' equals 'value', a unique index lookup """
+    return cls.query.filter_by(**{field: value})
+
+
+def load_identity(cls, field, value):
+    """
+    Returns the user whose 'field' equals 'value', or None.
+    Behind User.identify, User.lookup and the flask_login user_loader.
+    Only the column values are cached. Every call builds a new
+    detached instance from them, so requests never share an object and
+    the instance is not bound to any session: relationships (user.tasks)
+    raise instead of silently querying. To change the user, get it
+    attached first: db.session.merge(user).
+    """
+    row = cached_identity(field, value)
+    if row is None:
+        user = identity_query(cls, field, value).one_or_none()
+        if user is None:
+            return None
+        row = {column: getattr(user, column) for column in IDENTITY_COLUMNS}
+        remember_identity(row)
+    user = cls(**row)
+    make_transient_to_detached(user)
+    return user
+
+
+def cached_identity(field, value):
+    """ The cached columns (IDENTITY_COLUMNS) of the user or None, no query """
+    return identity_cache.get(_key(field, value))
+
+
+def remember_identity(row):
+    """ Caches the columns of a user read elsewhere (the ASGI routes) """
+    identity_cache.set(_key('id', row['id']), row)
+    identity_cache.set(_key('username', row['username']), row)
+
+
+def forget_identity(user):
+    identity_cache.invalidate(_key('id', user.id))
+    identity_cache.invalidate(_key('username', user.username))
+
+
+# ! Invalidation
+# ? A changed password or roles (or any other update, or a delete) drops
+# ? the user right away and once more after the commit, like the links
+# ? of base.html in navigation.py
+
+
+def user_changed(mapper, connection, target):
+    # ? the old username may be still cached under its own key
+    history = db.inspect(target).attrs.username.history
+    for username in history.deleted or ():
+        identity_cache.invalidate(_key('username', username))
+    forget_identity(target)
+    db.session.info.setdefault('users_changed', []).append(
+        (target.id, target.username))
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def users_committed(session):
+    for user_id, username in session.info.pop('users_changed', ()):
+        identity_cache.invalidate(_key('id', user_id))
+        identity_cache.invalidate(_key('username', username))
+
+
+def watch_identity(cls):
+    """ Subscribes the cache to the changes of the user model """
+    db.event.listen(cls, 'after_update', user_changed)
+    db.event.listen(cls, 'after_delete', user_changed)
+    return cls
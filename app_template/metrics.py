@@ -0,0 +1,231 @@
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# ? Upper bounds of the histogram buckets
+LATENCY_BUCKETS = (
+    .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram(object):
+    """ Prometheus histogram with labels. Thread safe. """
+
+    def __init__(self, name, documentation, labels, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            counts, total = self._values.get(labels, (None, 0))
+            if counts is None:
+                counts = [0] * (len(self.buckets) + 1)
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[labels] = (counts, total + value)
+
+    def expose(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.documentation),
+            '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, (counts, total) in values:
+            pairs = ['{}="{}"'.format(name, value)
+                     for name, value in zip(self.labels, labels)]
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append('{}_bucket{{{}}} {}'.format(
+                    self.name, ','.join(pairs + ['le="{}"'.format(bound)]),
+                    cumulative))
+            lines.append('{}_sum{{{}}} {}'.format(
+                self.name, ','.join(pairs), total))
+            lines.append('{}_count{{{}}} {}'.format(
+                self.name, ','.join(pairs), cumulative))
+        return lines
+
+
+class Metrics(object):
+    """
+    Per-request instrumentation, exposed in the Prometheus text format.
+    Enabled by METRICS_ENABLED in the config.py, when it is off init_app
+    installs nothing, so there is no overhead at all.
+    * request latency per endpoint (before/after request hooks)
+    * number of SQL queries and DB time per request
+      (before/after_cursor_execute of SQLAlchemy)
+    * serialization time of the api blueprint, see measure()
+    * hits and misses of the caches, the password hashing queue
+    The route is METRICS_PATH ('/metrics'). The values belong to one
+    process: with several workers scrape every worker.
+    """
+
+    def __init__(self, app=None):
+        self.request_latency = Histogram(
+            'http_request_duration_seconds', 'Request latency.',
+            ('endpoint', 'method', 'status'), LATENCY_BUCKETS)
+        self.db_queries = Histogram(
+            'db_queries_per_request', 'SQL queries made by one request.',
+            ('endpoint',), COUNT_BUCKETS)
+        self.db_time = Histogram(
+            'db_time_seconds', 'Time of the SQL queries of one request.',
+            ('endpoint',), LATENCY_BUCKETS)
+        self.serialization_time = Histogram(
+            'serialization_seconds', 'Serialization time of one request.',
+            ('endpoint',), LATENCY_BUCKETS)
+        self.collectors = []
+        self._engine_hooked = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get('METRICS_ENABLED'):
+            return
+        app.extensions['metrics'] = self
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule(
+            app.config.get('METRICS_PATH', '/metrics'), 'metrics', self.view)
+        if not self._engine_hooked:
+            event.listen(Engine, 'before_cursor_execute', self._before_query)
+            event.listen(Engine, 'after_cursor_execute', self._after_query)
+            self._engine_hooked = True
+
+    def add_collector(self, func):
+        """
+        func() returns a list of (name, labels dict, value), exported as
+        gauges. Used for the counters of the caches.
+        """
+        self.collectors.append(func)
+        return func
+
+    # ! Hooks
+
+    def _before_request(self):
+        g.metrics = {'start': time.perf_counter(), 'queries': 0,
+                     'db_time': 0.0, 'serialization': 0.0}
+
+    def _after_request(self, response):
+        data = g.pop('metrics', None)
+        if data is not None:
+            endpoint = request.endpoint or 'unknown'
+            self.request_latency.observe(
+                time.perf_counter() - data['start'],
+                endpoint, request.method, str(response.status_code))
+            self.db_queries.observe(data['queries'], endpoint)
+            self.db_time.observe(data['db_time'], endpoint)
+            if data['serialization']:
+                self.serialization_time.observe(
+                    data['serialization'], endpoint)
+        return response
+
+    @staticmethod
+    def _before_query(conn, cursor, statement, parameters, context, many):
+        if has_request_context() and 'metrics' in g:
+            context._metrics_start = time.perf_counter()
+
+    @staticmethod
+    def _after_query(conn, cursor, statement, parameters, context, many):
+        start = getattr(context, '_metrics_start', None)
+        if start is not None and has_request_context() and 'metrics' in g:
+            g.metrics['queries'] += 1
+            g.metrics['db_time'] += time.perf_counter() - start
+
+    def measure(self, name='serialization'):
+        """
+        Times a block inside a request:
+        >>> with metrics.measure():
+        ...     task_serializer.dump_many(tasks)
+        Does nothing if the metrics are off.
+        """
+        return _Timer(name)
+
+    # ! Exposition
+
+    def expose(self):
+        lines = []
+        for histogram in (self.request_latency, self.db_queries,
+                          self.db_time, self.serialization_time):
+            lines.extend(histogram.expose())
+        typed = set()
+        for collector in self.collectors:
+            for name, labels, value in collector():
+                if name not in typed:
+                    lines.append('# TYPE {} gauge'.format(name))
+                    typed.add(name)
+                pairs = ','.join(
+                    '{}="{}"'.format(key, labels[key]) for key in labels)
+                if pairs:
+                    name = '{}{{{}}}'.format(name, pairs)
+                lines.append('{} {}'.format(name, value))
+        return '\n'.join(lines) + '\n'
+
+    def view(self):
+        return Response(
+            self.expose(), mimetype='text/plain; version=0.0.4')
+
+
+class _Timer(object):
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.enabled = has_request_context() and 'metrics' in g
+        if self.enabled:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.enabled:
+            g.metrics[self.name] += time.perf_counter() - self.start
+
+
+metrics = Metrics()
+
+
+@metrics.add_collector
+def cache_stats():
+    """ Counters of the in-process caches and of the password hashing """
+    from .identity import identity_cache
+    from .navigation import links_cache
+    from .passwords import hasher
+    from .tokens import guard
+
+    values = []
+    caches = (('links', links_cache), ('identity', identity_cache),
+              ('jwt', guard.token_cache))
+    for cache_name, cache in caches:
+        for key, value in cache.stats().items():
+            values.append(('cache_' + key, {'cache': cache_name}, value))
+    for key, value in hasher.stats().items():
+        values.append(('password_hasher_' + key, {}, value))
+    return values
+
+
+@metrics.add_collector
+def replica_stats():
+    """ 1 if a read replica is healthy, 0 while it is skipped """
+    from .replicas import replicas
+    return [('db_replica_up', {'bind': key}, value)
+            for key, value in replicas.stats().items()]
+
+
+@metrics.add_collector
+def ratelimit_stats():
+    """ Calls admitted and rejected (429) by every rate limit rule """
+    from .ratelimit import limiter
+    values = []
+    for rule, counters in limiter.stats().items():
+        for key, value in counters.items():
+            values.append(
+                ('ratelimit_' + key, {'rule': rule.lower()}, value))
+    return values
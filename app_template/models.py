@@ -1,11 +1,22 @@
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
-from .extensions import db, ma
+from .extensions import db
+from .identity import load_identity, watch_identity
+from .navigation import watch_links
+from .passwords import hasher
 
 
 class Tasks(db.Model):
     """ Test database model. Create your models."""
 
+    # ? Every API query filters on user_id: a page of tasks seeks
+    # ? on (user_id, id), open/closed tasks are counted on (user_id, done),
+    # ? title prefixes and the title sort seek on (user_id, title, id)
+    __table_args__ = (
+        db.Index('ix_tasks_user_id_id', 'user_id', 'id'),
+        db.Index('ix_tasks_user_id_done', 'user_id', 'done'),
+        db.Index('ix_tasks_user_id_title', 'user_id', 'title', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     user = db.relationship('User', backref='tasks')
@@ -18,6 +29,7 @@ class Tasks(db.Model):
         return '<Task: {}>'.format(self.title)
 
 
+@watch_identity
 class User(UserMixin, db.Model):
     """ Test database model. Create your models."""
 
@@ -25,13 +37,22 @@ class User(UserMixin, db.Model):
     username = db.Column(db.String(50), unique=True)
     password_hash = db.Column(db.String(512))
     roles = db.Column(db.Text)  # ? admin, operator...see method "rolenames"
+    # ? Bumped by every write of the user tasks, gives the ETags (api/etags.py)
+    tasks_version = db.Column(
+        db.Integer, default=0, server_default='0', nullable=False)
+    # ? Counters of the user tasks, moved by the same writes (api/stats.py)
+    tasks_total = db.Column(
+        db.Integer, default=0, server_default='0', nullable=False)
+    tasks_done = db.Column(
+        db.Integer, default=0, server_default='0', nullable=False)
     # tasks = db.relationship('Tasks', backref='user', lazy=True)
 
+    # ? Hashing runs on the process pool of passwords.py
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hasher.hash(password)
 
     def check_password_hash(self, password):
-        return check_password_hash(self.password_hash, password)
+        return hasher.verify(self.password_hash, password)
 
     # * Flask Praetorian methods
     @property
@@ -47,13 +68,15 @@ class User(UserMixin, db.Model):
         except Exception:
             return []
 
+    # ? lookup and identify go through the identity cache (identity.py)
+    # ? and return detached users
     @classmethod
     def lookup(cls, username):
-        return cls.query.filter_by(username=username).one_or_none()
+        return load_identity(cls, 'username', username)
 
     @classmethod
     def identify(cls, id):
-        return cls.query.filter_by(id=id).one_or_none()
+        return load_identity(cls, 'id', id)
 
     @property
     def identity(self):
@@ -64,6 +87,35 @@ class User(UserMixin, db.Model):
         return '<User: {}>'.format(self.username)
 
 
+class TaskEvents(db.Model):
+    """
+    Append-only log of the task changes of every user: one row per
+    created, updated or deleted task, written by the task routes in the
+    transaction of the change. The id is the SSE event id, see events.py.
+    """
+
+    __tablename__ = 'task_events'
+    # ? A client resumes from its Last-Event-ID: seek on (user_id, id)
+    __table_args__ = (
+        db.Index('ix_task_events_user_id_id', 'user_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    task_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(6), nullable=False)  # ? create/update/delete
+    # ? The task after the change, empty for 'delete'
+    title = db.Column(db.String(50))
+    description = db.Column(db.String(150))
+    done = db.Column(db.Boolean)
+    created_at = db.Column(
+        db.DateTime, server_default=db.func.now(), nullable=False)
+
+    def __repr__(self):
+        return '<TaskEvent: {} {}>'.format(self.kind, self.task_id)
+
+
+@watch_links
 class Links(db.Model):
     """
     Test database model. Create your models.
@@ -81,13 +133,6 @@ class Links(db.Model):
         return '<Link: {}>'.format(self.name_url)
 
 
-# *Marshmellow Schemes
-class TasksSchema(ma.ModelSchema):
-    """ Class serialization in JSON """
-    class Meta:
-        model = Tasks
-
-
 __doc__ = """
 #TODO: SQLAlchemy prompt:
     Official documentation:
@@ -198,11 +243,15 @@ __doc__ = """
 
 #TODO: Migrate prompt:
 
-To create repository migration, run the commands in terminal:
+The migration repository is in migrations/, run the commands in terminal:
     $ export FLASK_APP=setup.py
 
-    $ flask db init
+    $ flask db upgrade
+    After a change of the models:
     $ flask db migrate -m "your message"
     $ flask db upgrade
 
+    Check that the API queries use the indexes:
+    $ flask explain-queries --fail-on-scan
+
 """
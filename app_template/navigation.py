@@ -0,0 +1,50 @@
+from flask import current_app
+
+from .cache import TTLCache
+from .extensions import db
+
+
+# *Links for the base.html navbar. Lifetime: LINKS_CACHE_TTL in the config.py
+links_cache = TTLCache(config_prefix='LINKS_CACHE')
+
+
+def get_links():
+    """
+    Returns the links for the base.html.
+    In steady state it is served from links_cache without any database
+    round trip. Only plain (name_url, url) rows are cached, never ORM
+    objects, so they are safe to share between sessions and threads.
+    """
+    from .models import Links
+    key = current_app.config['SQLALCHEMY_DATABASE_URI']
+    links = links_cache.get(key)
+    if links is None:
+        links = db.session.query(Links.name_url, Links.url).order_by(
+            Links.id).all()
+        links_cache.set(key, links)
+    return links
+
+
+# ! Invalidation
+# ? The cache is dropped as soon as a Links row is flushed and once more
+# ? after the commit, so a render between the flush and the commit
+# ? can not keep stale links until the TTL expires.
+
+
+def watch_links(cls):
+    """ Subscribes the cache to the changes of the links model """
+    db.event.listen(cls, 'after_insert', links_changed)
+    db.event.listen(cls, 'after_update', links_changed)
+    db.event.listen(cls, 'after_delete', links_changed)
+    return cls
+
+
+def links_changed(mapper, connection, target):
+    links_cache.invalidate()
+    db.session.info['links_changed'] = True
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def links_committed(session):
+    if session.info.pop('links_changed', False):
+        links_cache.invalidate()
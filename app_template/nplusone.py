@@ -0,0 +1,66 @@
+from collections import Counter
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class NPlusOneError(RuntimeError):
+    """ A request ran the same query more times than allowed """
+
+
+class NPlusOneDetector(object):
+    """
+    Debug helper that finds N+1 queries (a lazy load per row).
+    Every SQL statement of a request is counted by its text, the
+    parameters are ignored: a lazy relationship read in a loop shows up
+    as the same SELECT repeated for every row.
+    If a statement runs more than NPLUSONE_THRESHOLD times in one request,
+    the detector warns in the app log or, with NPLUSONE_RAISE,
+    fails the request with NPlusOneError.
+    Enabled by NPLUSONE_ENABLED in the config.py (DevelopmentConfig).
+    """
+
+    def __init__(self, app=None):
+        self._engine_hooked = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get('NPLUSONE_ENABLED'):
+            return
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        if not self._engine_hooked:
+            event.listen(Engine, 'before_cursor_execute', self._count)
+            self._engine_hooked = True
+
+    @staticmethod
+    def _before_request():
+        g.statements = Counter()
+
+    @staticmethod
+    def _count(conn, cursor, statement, parameters, context, many):
+        if has_request_context() and 'statements' in g:
+            g.statements[statement] += 1
+
+    @staticmethod
+    def _after_request(response):
+        statements = g.pop('statements', None)
+        if not statements:
+            return response
+        threshold = current_app.config['NPLUSONE_THRESHOLD']
+        repeated = [
+            (count, statement)
+            for statement, count in statements.most_common()
+            if count > threshold]
+        for count, statement in repeated:
+            message = 'N+1 queries in {}: {} times {}'.format(
+                request.endpoint, count, ' '.join(statement.split()))
+            if current_app.config['NPLUSONE_RAISE']:
+                raise NPlusOneError(message)
+            current_app.logger.warning(message)
+        return response
+
+
+nplusone = NPlusOneDetector()
@@ -0,0 +1,184 @@
+import os
+import threading
+from functools import partial
+
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import (
+    DEFAULT_PBKDF2_ITERATIONS,
+    check_password_hash,
+    generate_password_hash)
+
+from .extensions import db
+
+
+class HasherBusy(ServiceUnavailable):
+    """ Too many password hashes are waiting, the request is shed (503) """
+    description = 'Too many login attempts are in progress, try again later.'
+
+
+def normalize_method(method):
+    """ 'pbkdf2:sha256' -> 'pbkdf2:sha256:150000' """
+    parts = method.split(':')
+    if parts[0] == 'pbkdf2' and len(parts) == 2:
+        parts.append(str(DEFAULT_PBKDF2_ITERATIONS))
+    return ':'.join(parts)
+
+
+def pool_context():
+    """
+    Start method of the hashing processes: forkserver (or spawn where
+    there is none), never a fork. The pool is started lazily from request
+    threads or executor threads, and a fork of a multithreaded process
+    may inherit a lock held by another thread and deadlock on it.
+    """
+    import multiprocessing
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+def process_pool(workers):
+    """
+    A pool of 'workers' hashing processes. Imported here, on the first
+    pool: the app that does not hash never loads multiprocessing.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    return ProcessPoolExecutor(max_workers=workers, mp_context=pool_context())
+
+
+class PasswordHasher(object):
+    """
+    Runs werkzeug password hashing on a process pool, out of the request
+    thread, so a burst of logins can not pin the CPU of every worker.
+    Configured by init_app(app), see the config.py:
+        PASSWORD_HASH_METHOD  --- werkzeug method, 'pbkdf2:sha256:150000'
+        PASSWORD_SALT_LENGTH  --- salt length
+        PASSWORD_POOL_SIZE    --- worker processes, 0 = hash in the thread,
+                                  started one by one as the hashes come
+        PASSWORD_MAX_PENDING  --- hashes waiting or running at once
+        PASSWORD_WAIT_TIMEOUT --- seconds to wait for a free slot, then 503
+    stats() shows the queue depth and counters, a hash that raised is
+    'failed', not 'completed'.
+    """
+
+    def __init__(self, app=None):
+        self.method = 'pbkdf2:sha256'
+        self.salt_length = 8
+        self.pool_size = 0
+        self.max_pending = 64
+        self.wait_timeout = 1.0
+        self._pool = None
+        self._pool_pid = None
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._counters = {
+            'waiting': 0, 'pending': 0, 'completed': 0, 'failed': 0,
+            'rejected': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.method = normalize_method(app.config['PASSWORD_HASH_METHOD'])
+        self.salt_length = app.config['PASSWORD_SALT_LENGTH']
+        self.pool_size = app.config['PASSWORD_POOL_SIZE']
+        self.max_pending = app.config['PASSWORD_MAX_PENDING']
+        self.wait_timeout = app.config['PASSWORD_WAIT_TIMEOUT']
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+
+    def _executor(self):
+        """
+        The pool is started on first use and again after a fork,
+        a pool inherited from the parent process does not work.
+        """
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = process_pool(self.pool_size)
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _count(self, name, step=1):
+        with self._lock:
+            self._counters[name] += step
+
+    def _run(self, func, *args):
+        self._count('waiting')
+        acquired = self._slots.acquire(timeout=self.wait_timeout)
+        self._count('waiting', -1)
+        if not acquired:
+            self._count('rejected')
+            raise HasherBusy()
+        self._count('pending')
+        try:
+            if not self.pool_size:
+                result = func(*args)
+            else:
+                result = self._executor().submit(func, *args).result()
+        except Exception:
+            self._count('failed')
+            raise
+        else:
+            self._count('completed')
+            return result
+        finally:
+            self._count('pending', -1)
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(
+            generate_password_hash, password, self.method, self.salt_length)
+
+    def hash_many(self, passwords, workers=None):
+        """
+        Hashes a list of passwords at once, for seeding and imports.
+        'workers' - processes (by default os.cpu_count()), 1 = in the
+        thread. A pool of its own, not limited by PASSWORD_MAX_PENDING:
+        it is not meant to run inside a request.
+        """
+        func = partial(
+            generate_password_hash, method=self.method,
+            salt_length=self.salt_length)
+        workers = workers or os.cpu_count() or 1
+        if workers == 1 or len(passwords) < 2:
+            return [func(password) for password in passwords]
+        with process_pool(workers) as pool:
+            chunksize = max(1, len(passwords) // (workers * 4))
+            return list(pool.map(func, passwords, chunksize=chunksize))
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """ True if the hash was made with other method or salt length """
+        try:
+            method, salt, _ = pwhash.split('$', 2)
+        except (AttributeError, ValueError):
+            return True
+        return normalize_method(method) != self.method or \
+            len(salt) != self.salt_length
+
+    def rehash_if_needed(self, user, password):
+        """
+        Call it after a successful login: the password is known, so an
+        outdated hash is replaced by a hash with the current parameters.
+        The user may be detached (identity cache), it is merged first.
+        """
+        if not self.needs_rehash(user.password_hash):
+            return user
+        user = db.session.merge(user)
+        user.set_password(password)
+        db.session.commit()
+        return user
+
+    def stats(self):
+        """
+        'pending' - hashes submitted to the pool (queued or running),
+        'waiting' - requests waiting for a free slot (PASSWORD_MAX_PENDING)
+        """
+        with self._lock:
+            stats = dict(self._counters)
+        stats['pool_size'] = self.pool_size
+        stats['max_pending'] = self.max_pending
+        return stats
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,168 @@
+import abc
+import math
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request
+from werkzeug.exceptions import TooManyRequests
+from werkzeug.utils import import_string
+
+
+class RateLimited(TooManyRequests):
+    """ 429 with the Retry-After header, in seconds """
+
+    def __init__(self, retry_after, rule=None):
+        super(RateLimited, self).__init__()
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+        self.rule = rule
+
+    def get_headers(self, environ=None):
+        headers = super(RateLimited, self).get_headers(environ)
+        headers.append(('Retry-After', str(self.retry_after)))
+        return headers
+
+
+class BucketStore(abc.ABC):
+    """
+    Where the token buckets live. A shared backend (Redis, memcached...)
+    subclasses it and makes take() atomic on the server, then it is set
+    in the config.py: RATELIMIT_STORE = 'package.module:StoreClass'
+    """
+
+    def __init__(self, app=None):
+        pass
+
+    @abc.abstractmethod
+    def take(self, key, capacity, rate, cost=1):
+        """
+        Takes 'cost' tokens from the bucket 'key' that holds 'capacity'
+        tokens and refills 'rate' tokens a second.
+        Returns 0 if allowed, else the seconds until it would be.
+        """
+
+
+class MemoryStore(BucketStore):
+    """
+    Buckets of one process, in RATELIMIT_SHARDS shards with a lock each,
+    so the calls for different keys rarely wait for each other.
+    A shard keeps at most RATELIMIT_SIZE / RATELIMIT_SHARDS buckets,
+    the least recently used is dropped (it comes back full).
+    """
+
+    def __init__(self, app=None, shards=16, maxsize=100000):
+        if app is not None:
+            shards = app.config.get('RATELIMIT_SHARDS', shards)
+            maxsize = app.config.get('RATELIMIT_SIZE', maxsize)
+        self.shard_size = max(1, maxsize // shards)
+        self.shards = [(OrderedDict(), threading.Lock())
+                       for _ in range(shards)]
+
+    def take(self, key, capacity, rate, cost=1):
+        buckets, lock = self.shards[zlib.crc32(key) % len(self.shards)]
+        now = time.monotonic()
+        with lock:
+            tokens, last = buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - last) * rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0
+            else:
+                wait = (cost - tokens) / rate
+            buckets[key] = (tokens, now)
+            if len(buckets) > self.shard_size:
+                buckets.popitem(last=False)
+        return wait
+
+
+def remote_addr():
+    return request.remote_addr or ''
+
+
+def json_username():
+    data = request.get_json(silent=True)
+    if isinstance(data, dict) and isinstance(data.get('username'), str):
+        return data['username']
+    return None
+
+
+class RateLimiter(object):
+    """
+    Token bucket limits of the expensive routes: login (password hash)
+    and refresh (JWT signing). The check runs before the view, so a
+    rejected call costs no hashing at all: 429 with Retry-After.
+    Configured by init_app(app), see the config.py:
+        RATELIMIT_ENABLED  --- off: every call is admitted
+        RATELIMIT_<RULE>   --- (burst, seconds): 'burst' calls at once,
+                               refilled over 'seconds'; None - no limit
+        RATELIMIT_STORE    --- import path of a BucketStore, by default
+                               the in-memory MemoryStore
+    Rules and their keys are in RULES. stats() counts the admitted and
+    rejected calls of every rule.
+
+    Simple example:
+    >>> @bp.route('/v.1.0/login', methods=['POST'])
+    ... @limiter.limit('LOGIN_IP', 'LOGIN_USERNAME')
+    ... def login():
+    """
+
+    # ? rule -> key of the request, a rule without a key is skipped
+    RULES = {
+        'LOGIN_IP': remote_addr,
+        'LOGIN_USERNAME': json_username,
+        'REFRESH_IP': remote_addr,
+    }
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.limits = {}
+        self.store = MemoryStore()
+        self._lock = threading.Lock()
+        self._counters = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('RATELIMIT_ENABLED', False)
+        self.limits = {}
+        for rule in self.RULES:
+            limit = app.config.get('RATELIMIT_' + rule)
+            if limit:
+                burst, seconds = limit
+                self.limits[rule] = (burst, burst / float(seconds))
+        store = app.config.get('RATELIMIT_STORE')
+        self.store = import_string(store)(app) if store else MemoryStore(app)
+        self._counters = {
+            rule: {'admitted': 0, 'rejected': 0} for rule in self.limits}
+
+    def hit(self, rule, key):
+        """ Takes a token of the rule for the key or raises RateLimited """
+        if not self.enabled or key is None or rule not in self.limits:
+            return
+        capacity, rate = self.limits[rule]
+        wait = self.store.take(
+            '{}:{}'.format(rule, key).encode('utf-8'), capacity, rate)
+        with self._lock:
+            self._counters[rule]['rejected' if wait else 'admitted'] += 1
+        if wait:
+            raise RateLimited(wait, rule)
+
+    def limit(self, *rules):
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                for rule in rules:
+                    self.hit(rule, self.RULES[rule]())
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def stats(self):
+        with self._lock:
+            return {rule: dict(counters)
+                    for rule, counters in self._counters.items()}
+
+
+limiter = RateLimiter()
@@ -0,0 +1,217 @@
+import hashlib
+import itertools
+import os
+import sqlite3
+import threading
+import time
+
+from flask import current_app, has_request_context, request
+from flask_sqlalchemy import SignallingSession, get_state
+from sqlalchemy import event, exc
+from sqlalchemy.engine.url import make_url
+
+from .cache import TTLCache
+
+
+# ? Requests that may read from a replica
+READ_METHODS = ('GET', 'HEAD')
+
+
+class ReplicaSet(object):
+    """
+    Read replicas of the primary database, for the reads of GET requests.
+    Configured by init_app(app), see the config.py:
+        REPLICA_URLS        --- database urls, each becomes the bind
+                                'replica<N>' of SQLALCHEMY_BINDS
+        REPLICA_RETRY_AFTER --- seconds a failed replica is skipped
+        REPLICA_PIN_TTL     --- seconds the reads of a client go to the
+                                primary after its write (read-after-write)
+    Replicas are taken round-robin, one per session (request). A replica
+    whose query fails with a connection or operational error is marked
+    down and skipped until REPLICA_RETRY_AFTER passes (the failed query
+    itself is not retried); with no healthy replica the reads go to the
+    primary.
+    Replica connections of SQLite are opened with PRAGMA query_only.
+    """
+
+    def __init__(self, app=None):
+        self.keys = []
+        self.retry_after = 30
+        self.pins = TTLCache(
+            ttl=5, maxsize=100000, config_prefix='REPLICA_PIN')
+        self._down = {}
+        self._hooked = set()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        urls = app.config.get('REPLICA_URLS') or []
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        self.keys = []
+        for number, url in enumerate(urls, 1):
+            key = 'replica{}'.format(number)
+            binds[key] = url
+            self.keys.append(key)
+        app.config['SQLALCHEMY_BINDS'] = binds or None
+        self.retry_after = app.config.get(
+            'REPLICA_RETRY_AFTER', self.retry_after)
+        self.pins.init_app(app)
+        if self.keys:
+            app.extensions['replicas'] = self
+            app.after_request(self._after_request)
+
+    # ! Routing
+
+    def readable(self, session):
+        """ True if the session of this request may read from a replica """
+        return (
+            has_request_context() and request.method in READ_METHODS and
+            not session.info.get('read_primary') and
+            self.pins.get(client_key()) is None)
+
+    def choose(self):
+        """ Next healthy replica, round-robin, or None """
+        now = time.monotonic()
+        for _ in range(len(self.keys)):
+            key = self.keys[next(self._counter) % len(self.keys)]
+            if self._down.get(key, 0) <= now:
+                return key
+        return None
+
+    def engine(self, app, key):
+        engine = get_state(app).db.get_engine(app, bind=key)
+        if engine not in self._hooked:
+            with self._lock:
+                if engine not in self._hooked:
+                    self._hook(engine, key)
+                    self._hooked.add(engine)
+        return engine
+
+    def _hook(self, engine, key):
+        @event.listens_for(engine, 'handle_error')
+        def replica_failed(context):
+            # ? not a bad query: a lost connection, a missing or broken file
+            if context.is_disconnect or type(context.sqlalchemy_exception) \
+                    in (exc.OperationalError, exc.DatabaseError):
+                self.mark_down(key)
+
+        if engine.dialect.name == 'sqlite':
+            @event.listens_for(engine, 'connect')
+            def read_only(dbapi_connection, connection_record):
+                dbapi_connection.execute('PRAGMA query_only=1')
+            # ? connections opened before the listener, if any
+            engine.dispose()
+
+    # ! Health
+
+    def mark_down(self, key):
+        self._down[key] = time.monotonic() + self.retry_after
+
+    def stats(self):
+        now = time.monotonic()
+        return {key: int(self._down.get(key, 0) <= now) for key in self.keys}
+
+    # ! Read-after-write
+
+    def _after_request(self, response):
+        if request.method not in READ_METHODS and response.status_code < 400:
+            self.pins.set(client_key(), True)
+        return response
+
+
+def client_key():
+    """ The client of the request: its token, session cookie or address """
+    value = request.headers.get('Authorization') or \
+        request.cookies.get(current_app.session_cookie_name) or \
+        request.remote_addr or ''
+    return hashlib.sha256(value.encode('utf-8')).digest()
+
+
+class RoutingSession(SignallingSession):
+    """
+    The session of db (see engine.py). Writes, flushes and every query
+    outside of GET requests use the primary. The reads of a GET request
+    go to one replica of the ReplicaSet, unless the request has flushed
+    or its client wrote a moment ago (read-after-write).
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        replicas = self.app.extensions.get('replicas')
+        if replicas is not None:
+            if self._flushing:
+                # ? later reads of the request see its own writes
+                self.info['read_primary'] = True
+            elif replicas.readable(self):
+                if 'replica' not in self.info:
+                    self.info['replica'] = replicas.choose()
+                key = self.info['replica']
+                if key is not None:
+                    return replicas.engine(self.app, key)
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+replicas = ReplicaSet()
+
+
+class SQLiteReplicator(object):
+    """
+    Stand-in for database replication, for local runs: copies the
+    primary SQLite file into every replica file with the online backup
+    API, every 'interval' seconds, in a thread of its own.
+    ! Terminal:
+    * $ flask replicate --interval 1
+    """
+
+    def __init__(self, primary, replicas, interval=1.0):
+        self.primary = sqlite_path(primary)
+        self.replicas = [sqlite_path(url) for url in replicas]
+        self.interval = interval
+        self.copies = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        source = sqlite3.connect(self.primary, timeout=30)
+        try:
+            for path in self.replicas:
+                try:
+                    self._copy(source, path)
+                except sqlite3.DatabaseError:
+                    # ? a broken replica file is made again from scratch
+                    os.remove(path)
+                    self._copy(source, path)
+        finally:
+            source.close()
+        self.copies += 1
+
+    @staticmethod
+    def _copy(source, path):
+        target = sqlite3.connect(path, timeout=30)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+
+    def run(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def sqlite_path(url):
+    url = make_url(url)
+    if url.drivername.split('+')[0] != 'sqlite' or not url.database:
+        raise ValueError('Not a SQLite file: {}'.format(url))
+    return url.database
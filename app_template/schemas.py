@@ -0,0 +1,31 @@
+from flask_marshmallow import Marshmallow
+
+from .extensions import db
+from .models import Tasks
+
+
+# *Marshmallow /Converting Flask-SQLAlchemy to JSON/
+# ? Not in extensions.py: marshmallow imports distutils, slow to load.
+# ? Imported by the first task dumped (api/serializers.py). No init_app:
+# ? the schemas get the session of db by their Meta.sqla_session
+ma = Marshmallow()
+
+
+# *Marshmellow Schemes
+class TasksSchema(ma.ModelSchema):
+    """ Class serialization in JSON """
+    class Meta:
+        model = Tasks
+        sqla_session = db.session
+
+
+class PublicTasksSchema(ma.ModelSchema):
+    """
+    Class serialization in JSON for the API.
+    The 'user' relationship is excluded here, at the schema level,
+    so it is never loaded or dumped.
+    """
+    class Meta:
+        model = Tasks
+        sqla_session = db.session
+        exclude = ('user',)
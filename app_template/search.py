@@ -0,0 +1,154 @@
+import re
+
+from sqlalchemy import DDL, and_, event, or_, text
+
+from .extensions import db
+from .models import Tasks
+
+
+# ? Words of a search query, the rest (FTS5 operators too) is dropped
+TERM = re.compile(r'\w+', re.UNICODE)
+
+# * The index of Tasks: a contentless FTS5 table, rowid = tasks.id.
+# * 'owner' holds the token u<user_id>, so a search of one user is
+# * an intersection inside the index, not a filter of every match.
+FTS_CREATE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5("
+    "owner, title, description, content='', "
+    "tokenize='porter unicode61')"
+)
+FTS_INSERT = (
+    "INSERT INTO tasks_fts(rowid, owner, title, description) "
+    "VALUES (new.id, 'u' || new.user_id, new.title, new.description);"
+)
+# ? a contentless table forgets a row by its old values
+FTS_DELETE = (
+    "INSERT INTO tasks_fts(tasks_fts, rowid, owner, title, description) "
+    "VALUES ('delete', old.id, 'u' || old.user_id, old.title, "
+    "old.description);"
+)
+# ? The triggers keep the index in the transaction of every write:
+# ? ORM, Core executemany (flask seed), batch and the ASGI routes alike
+TRIGGERS = (
+    "CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks "
+    "BEGIN " + FTS_INSERT + " END",
+    "CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks "
+    "BEGIN " + FTS_DELETE + " END",
+    # ? 'done' is not indexed, toggling it does not touch the index
+    "CREATE TRIGGER IF NOT EXISTS tasks_fts_update "
+    "AFTER UPDATE OF user_id, title, description ON tasks "
+    "BEGIN " + FTS_DELETE + " " + FTS_INSERT + " END",
+)
+
+SEARCH_SQL = (
+    "SELECT tasks.id, tasks.title, tasks.description, tasks.done "
+    "FROM tasks_fts JOIN tasks ON tasks.id = tasks_fts.rowid "
+    "WHERE tasks_fts MATCH :query AND tasks.user_id = :user_id "
+    "ORDER BY bm25(tasks_fts, 0.0, :title_weight, :description_weight) "
+    "LIMIT :limit"
+)
+
+for _statement in (FTS_CREATE,) + TRIGGERS:
+    event.listen(Tasks.__table__, 'after_create',
+                 DDL(_statement).execute_if(dialect='sqlite'))
+event.listen(Tasks.__table__, 'after_drop',
+             DDL('DROP TABLE IF EXISTS tasks_fts').execute_if(
+                 dialect='sqlite'))
+
+
+def terms(q, max_terms=8):
+    """ Words of the query, at most max_terms """
+    return TERM.findall(q or '')[:max_terms]
+
+
+def match_query(user_id, words):
+    """
+    FTS5 query of the words for one user: every word must match,
+    each is quoted, so no user input is read as FTS5 syntax.
+    """
+    return 'owner : u{} AND {}'.format(
+        user_id, ' AND '.join('"{}"'.format(word) for word in words))
+
+
+class TaskSearch(object):
+    """
+    Full-text search of the task title and description.
+    On SQLite it is an FTS5 index (the table 'tasks_fts' and the triggers
+    on 'tasks', made by db.create_all and by the migrations), the results
+    are ranked by bm25, a title match weighs more than a description one.
+    Other databases get an unranked LIKE search, same output.
+    Configured by init_app(app), see the config.py:
+        SEARCH_MAX_TERMS  --- words of a query that are used
+        SEARCH_WEIGHTS    --- bm25 weights of (title, description)
+    The index can be made again from 'tasks' at any moment:
+    ! Terminal:
+    * $ flask rebuild-search
+    """
+
+    def __init__(self, app=None):
+        self.max_terms = 8
+        self.weights = (10.0, 1.0)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_terms = app.config.get('SEARCH_MAX_TERMS', self.max_terms)
+        self.weights = app.config.get('SEARCH_WEIGHTS', self.weights)
+        app.extensions['search'] = self
+
+    def terms(self, q):
+        return terms(q, self.max_terms)
+
+    def tasks(self, user_id, words, limit):
+        """ Best 'limit' tasks of the user matching all the words """
+        if db.session.get_bind().dialect.name != 'sqlite':
+            return self.like_tasks(user_id, words, limit)
+        title_weight, description_weight = self.weights
+        # ? typed columns: 'done' comes back as a bool, not 0/1
+        statement = text(SEARCH_SQL).columns(
+            Tasks.id, Tasks.title, Tasks.description, Tasks.done)
+        return db.session.execute(statement, {
+            'query': match_query(user_id, words),
+            'user_id': user_id,
+            'title_weight': title_weight,
+            'description_weight': description_weight,
+            'limit': limit}).fetchall()
+
+    @staticmethod
+    def like_tasks(user_id, words, limit):
+        conditions = []
+        for word in words:
+            pattern = '%{}%'.format(word)
+            conditions.append(or_(
+                Tasks.title.ilike(pattern),
+                Tasks.description.ilike(pattern)))
+        return db.session.query(
+            Tasks.id, Tasks.title, Tasks.description, Tasks.done).filter(
+            Tasks.user_id == user_id, and_(*conditions)).order_by(
+            Tasks.id).limit(limit).all()
+
+    @staticmethod
+    def rebuild(connection):
+        """
+        Makes the index and the triggers if they are missing and fills
+        the index again from 'tasks'. Returns the number of indexed tasks.
+        """
+        if connection.dialect.name != 'sqlite':
+            raise RuntimeError(
+                'The search index is SQLite FTS5, not {}'.format(
+                    connection.dialect.name))
+        connection.execute(text(FTS_CREATE))
+        for statement in TRIGGERS:
+            connection.execute(text(statement))
+        connection.execute(text(
+            "INSERT INTO tasks_fts(tasks_fts) VALUES ('delete-all')"))
+        connection.execute(text(
+            "INSERT INTO tasks_fts(rowid, owner, title, description) "
+            "SELECT id, 'u' || user_id, title, description FROM tasks"))
+        connection.execute(text(
+            "INSERT INTO tasks_fts(tasks_fts) VALUES ('optimize')"))
+        return connection.execute(text(
+            'SELECT count(*) FROM tasks')).scalar()
+
+
+search = TaskSearch()
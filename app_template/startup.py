@@ -0,0 +1,158 @@
+import importlib
+import os
+import threading
+from collections import OrderedDict
+
+from flask import url_for
+
+
+def from_cli():
+    """ True when the app is loaded by the 'flask' command """
+    return os.environ.get('FLASK_RUN_FROM_CLI') == 'true'
+
+
+class LazyBlueprints(object):
+    """
+    Registers the blueprints of the app, at once or on demand.
+    In the lazy mode (LAZY_LOADING in the config.py) a blueprint package
+    is imported and registered by the first request under its url prefix,
+    with its setup(app, bp): the extensions only its views use (see
+    setup_api). The blueprints without a prefix (main, auth) are loaded
+    by the first request outside every prefix. The CLI and a process
+    that is only started (preforked workers, health checks of the master)
+    never import the views, forms, models and their libraries.
+    url_for to a blueprint that is not loaded yet loads it.
+
+    Flask does not expect a blueprint to be registered on an app that
+    serves requests: the url_map is sorted in place, app.blueprints is
+    iterated by the template loader. So a load waits until no request is
+    being dispatched, and new requests wait for the load (a gate: many
+    readers, one writer). The response bodies are sent outside the gate.
+    Once every blueprint is loaded, requests skip the gate.
+
+    Simple example:
+    >>> blueprints = LazyBlueprints(app)
+    >>> blueprints.add('app_template.api', '/api', setup=setup_api)
+    >>> blueprints.start(lazy=True)
+    """
+
+    def __init__(self, app):
+        self.app = app
+        # ? blueprint name -> (package, url prefix, setup(app, bp))
+        self.pending = OrderedDict()
+        self.prefixes = []
+        self.wsgi_app = app.wsgi_app
+        self._gate = threading.Condition()
+        self._readers = 0
+        self._writers = 0  # ? waiting or loading, they go before new readers
+        self._writing = False
+        self._local = threading.local()
+        app.extensions['lazy_blueprints'] = self
+
+    def add(self, package, url_prefix=None, setup=None):
+        """ 'package' has the blueprint as 'bp', as every blueprint here """
+        name = package.rsplit('.', 1)[-1]
+        self.pending[name] = (package, url_prefix, setup)
+        if url_prefix:
+            self.prefixes.append(url_prefix)
+
+    def start(self, lazy=False):
+        if not lazy:
+            self.load(*self.pending)
+            return
+        self.app.wsgi_app = self
+        self.app.url_build_error_handlers.append(self._build_error)
+
+    def needed(self, path):
+        """ The pending blueprints that may serve 'path' """
+        wanted = None
+        for prefix in self.prefixes:
+            if path == prefix or path.startswith(prefix + '/'):
+                wanted = prefix
+                break
+        with self._gate:
+            return [name for name, (_, url_prefix, _) in self.pending.items()
+                    if url_prefix == wanted]
+
+    def load(self, *names):
+        """ Imports and registers the blueprints 'names' if still pending """
+        if not any(name in self.pending for name in names):
+            return
+        reading = getattr(self._local, 'reading', False)
+        if reading:
+            self._leave()  # ? url_for in a view: the gate waits for us
+        self._write(True)
+        try:
+            self._register(names)
+        finally:
+            self._write(False)
+            if reading:
+                self._enter()
+
+    def _register(self, names):
+        app = self.app
+        # ? the debug checks of Flask forbid a setup after the first
+        # ? request: the gate makes it safe, no request is dispatched
+        got_first_request = app._got_first_request
+        app._got_first_request = False
+        try:
+            for name in names:
+                if name not in self.pending:
+                    continue  # ? loaded by another thread meanwhile
+                package, url_prefix, setup = self.pending[name]
+                bp = importlib.import_module(package).bp
+                app.register_blueprint(bp, url_prefix=url_prefix)
+                if setup is not None:
+                    setup(app, bp)
+                with self._gate:
+                    del self.pending[name]
+            app.url_map.update()  # ? sorted here, not by a reader
+        finally:
+            app._got_first_request = got_first_request
+
+    # ! Gate
+
+    def _enter(self):
+        with self._gate:
+            while self._writers:
+                self._gate.wait()
+            self._readers += 1
+        self._local.reading = True
+
+    def _leave(self):
+        self._local.reading = False
+        with self._gate:
+            self._readers -= 1
+            if not self._readers:
+                self._gate.notify_all()
+
+    def _write(self, start):
+        with self._gate:
+            if not start:
+                self._writers -= 1
+                self._writing = False
+                self._gate.notify_all()
+                return
+            self._writers += 1
+            while self._writing or self._readers:
+                self._gate.wait()
+            self._writing = True
+
+    # ! WSGI
+
+    def __call__(self, environ, start_response):
+        if not self.pending:
+            return self.wsgi_app(environ, start_response)
+        self.load(*self.needed(environ.get('PATH_INFO', '')))
+        self._enter()
+        try:
+            return self.wsgi_app(environ, start_response)
+        finally:
+            self._leave()
+
+    def _build_error(self, error, endpoint, values):
+        name = endpoint.split('.', 1)[0]
+        if '.' not in endpoint or name not in self.pending:
+            return None  # ? Flask raises the BuildError
+        self.load(name)
+        return url_for(endpoint, **values)
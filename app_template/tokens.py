@@ -0,0 +1,103 @@
+import hashlib
+import re
+import time
+
+import jwt
+from flask import current_app, request
+from flask_praetorian import Praetorian
+from flask_praetorian.constants import AccessType
+from flask_praetorian.exceptions import BlacklistedError, \
+    InvalidTokenHeader, MissingTokenHeader
+
+from .cache import TTLCache
+
+
+class CachedPraetorian(Praetorian):
+    """
+    Praetorian that remembers verified access tokens.
+    A client sends the same token many times during JWT_ACCESS_LIFESPAN:
+    the first request decodes it and verifies the signature and claims,
+    the next ones take the verified claims from token_cache.
+    * The key is the sha256 digest of the app SECRET_KEY and the token,
+      the token itself is not kept. guard is shared by every app of the
+      process: a token of one SECRET_KEY is never a hit for another.
+    * An entry lives until the token's own 'exp'.
+    * The cache is bounded: JWT_CACHE_SIZE in the config.py, 0 disables it.
+    * The blacklist (is_blacklisted) is checked on every request, hits
+      included: a revoked token stops working at once.
+    A token is evicted by forget_token(): when it is refreshed (by jti,
+    so older tokens of the same jti go too).
+    """
+
+    def __init__(self, app=None, user_class=None, is_blacklisted=None):
+        self.token_cache = TTLCache(maxsize=4096, config_prefix='JWT_CACHE')
+        super().__init__(app, user_class, is_blacklisted)
+
+    def init_app(self, app, user_class, is_blacklisted=None):
+        self.token_cache.init_app(app)
+        return super().init_app(app, user_class, is_blacklisted)
+
+    def _digest(self, token):
+        if isinstance(token, str):
+            token = token.encode('utf-8')
+        digest = hashlib.sha256(
+            current_app.config['SECRET_KEY'].encode('utf-8'))
+        digest.update(b'\0' + token)
+        return digest.digest()
+
+    def extract_jwt_token(self, token, access_type=AccessType.access):
+        if access_type != AccessType.access or not self.token_cache.maxsize:
+            return super().extract_jwt_token(token, access_type)
+        key = self._digest(token)
+        data = self.token_cache.get(key)
+        if data is not None and time.time() <= data['exp']:
+            BlacklistedError.require_condition(
+                not self.is_blacklisted(data['jti']),
+                'Token has a blacklisted jti',
+            )
+            return dict(data)
+        data = super().extract_jwt_token(token, access_type)
+        self.token_cache.set(key, dict(data), ttl=data['exp'] - time.time())
+        return data
+
+    def read_token(self, headers):
+        """
+        The token of the JWT header in 'headers': of the Flask request
+        (read_token_from_header) or of an ASGI request (aio.py).
+        """
+        header = headers.get(self.header_name)
+        MissingTokenHeader.require_condition(
+            header is not None,
+            "JWT token not found in headers under '{}'",
+            self.header_name,
+        )
+        match = re.match(self.header_type + r'\s*([\w\.-]+)', header)
+        InvalidTokenHeader.require_condition(
+            match is not None,
+            "JWT header structure is invalid",
+        )
+        return match.group(1)
+
+    def read_token_from_header(self):
+        return self.read_token(request.headers)
+
+    def refresh_jwt_token(self, token, override_access_lifespan=None):
+        new_token = super().refresh_jwt_token(token, override_access_lifespan)
+        self.forget_token(token)
+        return new_token
+
+    def forget_token(self, token=None, jti=None):
+        """ Evicts one token, or every cached token with the jti """
+        if token is not None:
+            self.token_cache.invalidate(self._digest(token))
+            if jti is None:
+                # ? only to find the jti, the token was verified before
+                jti = jwt.decode(token, options={
+                    'verify_signature': False, 'verify_exp': False}).get('jti')
+        if jti is not None:
+            self.token_cache.invalidate_where(lambda data: data['jti'] == jti)
+
+
+# *GUARD App /caches verified access tokens/
+# ? init_app: setup_api in app_template/__init__.py, with the API blueprint
+guard = CachedPraetorian()
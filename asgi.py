@@ -0,0 +1,18 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+from app_template import create_app
+from app_template.aio import create_asgi_app
+
+
+app = create_app()
+
+# *ASGI entry point: async /api/v.1.0 task and auth routes,
+# *everything else is served by the Flask app (see app_template/aio.py)
+asgi_app = create_asgi_app(app)
+
+
+# TODO: start app: $ uvicorn asgi:asgi_app --host 0.0.0.0 --port 5000
+# TODO: sync WSGI mode as before: $ python3 setup.py OR $ flask run
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(asgi_app, host='0.0.0.0', port=5000)
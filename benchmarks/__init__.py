@@ -0,0 +1,5 @@
+"""
+Benchmarks of the application.
+Every module is a script, run it from the project root:
+    $ python3 -m benchmarks.<module_name> --help
+"""
@@ -0,0 +1,49 @@
+"""
+Helpers shared by the benchmarks.
+"""
+import timeit
+
+from commands import seed_database
+from config import DevelopmentConfig
+from app_template import create_app
+from app_template.extensions import db
+from app_template.models import Links
+
+
+def make_config(**options):
+    """
+    DevelopmentConfig with an in-memory database (unless
+    SQLALCHEMY_DATABASE_URI is passed), quiet, without CSRF, rate
+    limits and the debug N+1 detector.
+    """
+    options.setdefault('SQLALCHEMY_DATABASE_URI', 'sqlite://')
+    options.setdefault('DEBUG', False)
+    options.setdefault('TESTING', True)
+    options.setdefault('WTF_CSRF_ENABLED', False)
+    options.setdefault('PASSWORD_POOL_SIZE', 0)
+    options.setdefault('NPLUSONE_ENABLED', False)
+    options.setdefault('RATELIMIT_ENABLED', False)
+    return type('BenchmarkConfig', (DevelopmentConfig,), options)
+
+
+def make_app(**options):
+    return create_app(make_config(**options))
+
+
+def best_of(func, repeat, number=1):
+    """ Best time of one call, seconds """
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def seed(users, tasks_per_user, chunk=10000):
+    """
+    Fills an empty database (inside an app context):
+    'users' users named user<N> with the password 'password<N>',
+    the first one is an admin, every user has 'tasks_per_user' tasks.
+    The rows are written by seed_database (commands.py, flask seed).
+    """
+    db.create_all()
+    db.session.add(
+        Links(name_url='Flask', url='https://flask.palletsprojects.com'))
+    db.session.commit()
+    seed_database(users, tasks_per_user, chunk=chunk)
@@ -0,0 +1,186 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Concurrency benchmark of the serving modes:
+    wsgi - the Flask app on the threaded werkzeug server (setup.py)
+    asgi - the async API (app_template/aio.py) on uvicorn (asgi.py)
+Both serve the same seeded SQLite file. An asyncio client opens
+--connections connections at once, every connection makes --requests
+requests in a row (one TCP connection per request, 'Connection: close').
+! Terminal:
+* $ python3 -m benchmarks.concurrency run
+* $ python3 -m benchmarks.concurrency run -c 1000 -n 5 \
+*       --path /api/v.1.0/todo/tasks -o concurrency.json
+"""
+import asyncio
+import json
+import logging
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+import click
+
+from app_template.models import User
+from app_template.tokens import guard
+from benchmarks.common import make_app, seed
+from benchmarks.routes import percentile
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def fetch(port, raw):
+    """ One request on a new connection, returns the status code """
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(raw)
+        await writer.drain()
+        data = await reader.read()
+    finally:
+        writer.close()
+    return int(data.split(b' ', 2)[1])
+
+
+async def load(port, raw, connections, requests):
+    latencies = []
+    errors = [0]
+
+    async def connection():
+        for _ in range(requests):
+            start = time.perf_counter()
+            try:
+                status = await fetch(port, raw)
+            except (OSError, IndexError, ValueError):
+                status = None
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors[0] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(connection() for _ in range(connections)))
+    return latencies, errors[0], time.perf_counter() - start
+
+
+def measure(mode, database, path, token, connections, requests):
+    port = free_port()
+    server = subprocess.Popen([
+        sys.executable, '-m', 'benchmarks.concurrency', 'serve',
+        '--mode', mode, '--database', database, '--port', str(port)])
+    try:
+        if not wait_for_port(port):
+            raise click.ClickException('{} server did not start'.format(mode))
+        raw = (
+            'GET {} HTTP/1.1\r\nHost: 127.0.0.1:{}\r\n'
+            'Authorization: Bearer {}\r\nConnection: close\r\n\r\n').format(
+                path, port, token).encode('latin-1')
+        latencies, errors, elapsed = asyncio.run(
+            load(port, raw, connections, requests))
+    finally:
+        server.terminate()
+        server.wait()
+    latencies.sort()
+    return OrderedDict([
+        ('requests', len(latencies)),
+        ('errors', errors),
+        ('rps', len(latencies) / elapsed),
+        ('p50_ms', percentile(latencies, 0.50) * 1000),
+        ('p95_ms', percentile(latencies, 0.95) * 1000),
+        ('p99_ms', percentile(latencies, 0.99) * 1000),
+    ])
+
+
+@click.group()
+def cli():
+    """ WSGI against ASGI under many concurrent connections """
+
+
+@cli.command()
+@click.option('--mode', type=click.Choice(['wsgi', 'asgi']), required=True)
+@click.option('--database', required=True)
+@click.option('--port', type=int, required=True)
+def serve(mode, database, port):
+    """ Internal: runs one server for 'run' """
+    app = make_app(SQLALCHEMY_DATABASE_URI='sqlite:///' + database)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    if mode == 'wsgi':
+        from werkzeug.serving import BaseWSGIServer, run_simple
+        # ? the same listen backlog as uvicorn, 1k connects at once
+        BaseWSGIServer.request_queue_size = 2048
+        run_simple('127.0.0.1', port, app, threaded=True)
+    else:
+        import uvicorn
+        from app_template.aio import create_asgi_app
+        uvicorn.run(
+            create_asgi_app(app), host='127.0.0.1', port=port,
+            log_level='warning', backlog=2048)
+
+
+@cli.command()
+@click.option('--connections', '-c', default=1000, help='at the same time')
+@click.option('--requests', '-n', default=3, help='per connection')
+@click.option('--path', default='/api/v.1.0/todo/tasks/1')
+@click.option('--tasks-per-user', '-t', default=100, help='seeded tasks')
+@click.option('--output', '-o', default=None, help='write results as JSON')
+def run(connections, requests, path, tasks_per_user, output):
+    """ Runs both modes and prints the results """
+    # ? every connection is a file descriptor
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = connections + 256
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        limit = wanted if hard == resource.RLIM_INFINITY else min(
+            wanted, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+
+    database = os.path.join(tempfile.mkdtemp(), 'concurrency.db')
+    app = make_app(SQLALCHEMY_DATABASE_URI='sqlite:///' + database)
+    with app.app_context():
+        seed(2, tasks_per_user)
+        token = guard.encode_jwt_token(User.lookup('user1'))
+
+    results = OrderedDict()
+    click.secho(
+        '{:<6} {:>9} {:>9} {:>9} {:>9} {:>7}'.format(
+            'mode', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'),
+        fg='yellow')
+    for mode in ('wsgi', 'asgi'):
+        result = measure(
+            mode, database, path, token, connections, requests)
+        results[mode] = result
+        click.secho(
+            '{:<6} {:>9.1f} {:>9.2f} {:>9.2f} {:>9.2f} {:>7}'.format(
+                mode, result['rps'], result['p50_ms'], result['p95_ms'],
+                result['p99_ms'], result['errors']),
+            fg='red' if result['errors'] else 'green')
+
+    if output:
+        with open(output, 'w') as file:
+            json.dump(OrderedDict([
+                ('connections', connections),
+                ('requests', requests),
+                ('path', path),
+                ('results', results)]), file, indent=2)
+        click.secho('[+] Results: {}'.format(output), fg='green')
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,198 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Mixed read/write API load under every engine profile (ENGINE_PROFILES
+in the config.py: pool settings and SQLite PRAGMAs).
+For every profile a new SQLite file is seeded (the WAL mode stays in
+the file) and served by the threaded werkzeug server in a process of
+its own. --connections clients run at once, each makes --requests
+requests on keep-alive-less connections: task lists and tasks, and a
+--writes share of updates and new tasks, spread over --users users.
+! Terminal:
+* $ python3 -m benchmarks.engine run
+* $ python3 -m benchmarks.engine run -c 100 -n 50 --writes 0.5 \
+*       --profile default --profile production -o engine.json
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+import click
+
+from app_template.models import User
+from app_template.tokens import guard
+from benchmarks.common import make_app, seed
+from benchmarks.concurrency import fetch, free_port, wait_for_port
+from benchmarks.routes import percentile
+from config import Config
+
+
+def make_request(method, path, port, token, body=None):
+    data = b'' if body is None else json.dumps(body).encode('utf-8')
+    head = (
+        '{} {} HTTP/1.1\r\nHost: 127.0.0.1:{}\r\n'
+        'Authorization: Bearer {}\r\nConnection: close\r\n'
+        'Content-Type: application/json\r\nContent-Length: {}\r\n\r\n'
+    ).format(method, path, port, token, len(data))
+    return head.encode('latin-1') + data
+
+
+def operations(port, tokens, tasks_per_user, writes, seed_value):
+    """ Endless (kind, raw request, expected status), the same per seed """
+    rng = random.Random(seed_value)
+    while True:
+        user = rng.randrange(len(tokens))
+        task_id = user * tasks_per_user + rng.randrange(tasks_per_user) + 1
+        token = tokens[user]
+        if rng.random() < writes:
+            if rng.random() < 0.5:
+                yield 'write', make_request(
+                    'PUT', '/api/v.1.0/todo/tasks/{}'.format(task_id), port,
+                    token, {'done': rng.random() < 0.5}), 200
+            else:
+                yield 'write', make_request(
+                    'POST', '/api/v.1.0/todo/tasks/new', port, token,
+                    {'title': 'load test'}), 201
+        elif rng.random() < 0.5:
+            yield 'read', make_request(
+                'GET', '/api/v.1.0/todo/tasks?limit=20', port, token), 200
+        else:
+            yield 'read', make_request(
+                'GET', '/api/v.1.0/todo/tasks/{}'.format(task_id), port,
+                token), 200
+
+
+async def load(port, tokens, tasks_per_user, writes, connections, requests):
+    latencies = {'read': [], 'write': []}
+    errors = [0]
+
+    async def connection(number):
+        ops = operations(port, tokens, tasks_per_user, writes, number)
+        for _ in range(requests):
+            kind, raw, expected = next(ops)
+            start = time.perf_counter()
+            try:
+                status = await fetch(port, raw)
+            except (OSError, IndexError, ValueError):
+                status = None
+            latencies[kind].append(time.perf_counter() - start)
+            if status != expected:
+                errors[0] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(connection(n) for n in range(connections)))
+    return latencies, errors[0], time.perf_counter() - start
+
+
+def summary(latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return OrderedDict([('requests', 0)])
+    return OrderedDict([
+        ('requests', len(latencies)),
+        ('p50_ms', percentile(latencies, 0.50) * 1000),
+        ('p95_ms', percentile(latencies, 0.95) * 1000),
+        ('p99_ms', percentile(latencies, 0.99) * 1000),
+    ])
+
+
+def measure(profile, users, tasks_per_user, writes, connections, requests):
+    database = os.path.join(tempfile.mkdtemp(), 'engine.db')
+    app = make_app(
+        SQLALCHEMY_DATABASE_URI='sqlite:///' + database,
+        ENGINE_PROFILE=profile)
+    with app.app_context():
+        seed(users, tasks_per_user)
+        tokens = [guard.encode_jwt_token(User.lookup('user{}'.format(n)))
+                  for n in range(1, users + 1)]
+
+    port = free_port()
+    server = subprocess.Popen([
+        sys.executable, '-m', 'benchmarks.engine', 'serve',
+        '--profile', profile, '--database', database, '--port', str(port)])
+    try:
+        if not wait_for_port(port):
+            raise click.ClickException('server did not start')
+        latencies, errors, elapsed = asyncio.run(load(
+            port, tokens, tasks_per_user, writes, connections, requests))
+    finally:
+        server.terminate()
+        server.wait()
+    total = len(latencies['read']) + len(latencies['write'])
+    return OrderedDict([
+        ('requests', total),
+        ('errors', errors),
+        ('rps', total / elapsed),
+        ('all', summary(latencies['read'] + latencies['write'])),
+        ('read', summary(latencies['read'])),
+        ('write', summary(latencies['write'])),
+    ])
+
+
+@click.group()
+def cli():
+    """ Mixed API load under the engine profiles """
+
+
+@cli.command()
+@click.option('--profile', required=True)
+@click.option('--database', required=True)
+@click.option('--port', type=int, required=True)
+def serve(profile, database, port):
+    """ Internal: runs one server for 'run' """
+    from werkzeug.serving import run_simple
+    app = make_app(
+        SQLALCHEMY_DATABASE_URI='sqlite:///' + database,
+        ENGINE_PROFILE=profile)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    run_simple('127.0.0.1', port, app, threaded=True)
+
+
+@cli.command()
+@click.option('--profile', 'profiles', multiple=True,
+              help='profiles to run, default: all of the config.py')
+@click.option('--connections', '-c', default=50, help='at the same time')
+@click.option('--requests', '-n', default=20, help='per connection')
+@click.option('--writes', '-w', default=0.2, help='share of writes')
+@click.option('--users', '-u', default=10, help='seeded users')
+@click.option('--tasks-per-user', '-t', default=1000, help='seeded tasks')
+@click.option('--output', '-o', default=None, help='write results as JSON')
+def run(profiles, connections, requests, writes, users, tasks_per_user,
+        output):
+    """ Runs every profile and prints the results """
+    profiles = profiles or list(Config.ENGINE_PROFILES)
+    results = OrderedDict()
+    click.secho(
+        '{:<12} {:>8} {:>9} {:>9} {:>9} {:>9} {:>7}'.format(
+            'profile', 'req/s', 'p50 ms', 'p99 ms', 'read p99',
+            'write p99', 'errors'), fg='yellow')
+    for profile in profiles:
+        result = results[profile] = measure(
+            profile, users, tasks_per_user, writes, connections, requests)
+        click.secho(
+            '{:<12} {:>8.1f} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>7}'.format(
+                profile, result['rps'], result['all']['p50_ms'],
+                result['all']['p99_ms'],
+                result['read'].get('p99_ms', 0),
+                result['write'].get('p99_ms', 0), result['errors']),
+            fg='red' if result['errors'] else 'green')
+
+    if output:
+        with open(output, 'w') as file:
+            json.dump(OrderedDict([
+                ('connections', connections),
+                ('requests', requests),
+                ('writes', writes),
+                ('results', results)]), file, indent=2)
+        click.secho('[+] Results: {}'.format(output), fg='green')
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,150 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Change feed of the tasks (GET /api/v.1.0/todo/tasks/events) on the
+ASGI server (app_template/aio.py): --streams idle SSE clients of one
+user, then --writes task creations. It reports the memory of the
+server per idle stream and how long a change takes to reach every
+client (p50, p99, max).
+! Terminal:
+* $ python3 -m benchmarks.events
+* $ python3 -m benchmarks.events -s 5000 -w 10 -o events.json
+"""
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+import click
+
+from app_template.models import User
+from app_template.tokens import guard
+from benchmarks.common import make_app, seed
+from benchmarks.concurrency import free_port, wait_for_port
+from benchmarks.routes import percentile
+
+
+def rss_mb(pid):
+    with open('/proc/{}/status'.format(pid)) as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+async def open_stream(port, token):
+    """ One SSE client, returns after its 'ready' event """
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write((
+        'GET /api/v.1.0/todo/tasks/events HTTP/1.1\r\nHost: bench\r\n'
+        'Authorization: Bearer {}\r\n\r\n'.format(token)).encode())
+    await writer.drain()
+    await read_until(reader, b'event: ready')
+    return reader, writer
+
+
+async def read_until(reader, marker):
+    data = b''
+    while marker not in data:
+        chunk = await reader.read(4096)
+        if not chunk:
+            raise ConnectionError('stream closed')
+        data += chunk
+    return time.perf_counter()
+
+
+async def create_task(port, token, title):
+    body = json.dumps({'title': title}).encode()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write((
+        'POST /api/v.1.0/todo/tasks/new HTTP/1.1\r\nHost: bench\r\n'
+        'Authorization: Bearer {}\r\nContent-Type: application/json\r\n'
+        'Content-Length: {}\r\nConnection: close\r\n\r\n'.format(
+            token, len(body))).encode() + body)
+    await writer.drain()
+    await reader.read()
+    writer.close()
+
+
+async def measure(port, token, streams, writes, pid):
+    before = rss_mb(pid)
+    clients = []
+    for start in range(0, streams, 100):
+        clients += await asyncio.gather(*[
+            open_stream(port, token)
+            for _ in range(min(100, streams - start))])
+    await asyncio.sleep(1)
+    after = rss_mb(pid)
+    delays = []
+    for number in range(writes):
+        marker = '"title": "bench {}"'.format(number).encode()
+        waits = [asyncio.ensure_future(read_until(reader, marker))
+                 for reader, _ in clients]
+        begin = time.perf_counter()
+        await create_task(port, token, 'bench {}'.format(number))
+        ends = await asyncio.gather(*waits)
+        delays += [(end - begin) * 1000 for end in ends]
+    for _, writer in clients:
+        writer.close()
+    delays.sort()
+    return OrderedDict([
+        ('rss_idle_mb', after - before),
+        ('kb_per_stream', (after - before) * 1024 / streams),
+        ('p50_ms', percentile(delays, 0.5)),
+        ('p99_ms', percentile(delays, 0.99)),
+        ('max_ms', delays[-1]),
+    ])
+
+
+@click.command()
+@click.option('--streams', '-s', default=2000, help='idle SSE clients')
+@click.option('--writes', '-w', default=5, help='tasks created meanwhile')
+@click.option('--output', '-o', default=None, help='write results as JSON')
+def start(streams, writes, output):
+    # ? every stream is a file descriptor, here and in the server
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = streams + 256
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (
+            wanted if hard == resource.RLIM_INFINITY else min(wanted, hard),
+            hard))
+
+    database = os.path.join(tempfile.mkdtemp(), 'events.db')
+    app = make_app(SQLALCHEMY_DATABASE_URI='sqlite:///' + database)
+    with app.app_context():
+        seed(1, 10)
+        token = guard.encode_jwt_token(User.lookup('user1'))
+    port = free_port()
+    server = subprocess.Popen([
+        sys.executable, '-m', 'benchmarks.concurrency', 'serve',
+        '--mode', 'asgi', '--database', database, '--port', str(port)])
+    try:
+        wait_for_port(port)
+        results = asyncio.run(
+            measure(port, token, streams, writes, server.pid))
+    finally:
+        server.terminate()
+        server.wait()
+
+    click.secho('[+] {} idle streams: {:.1f} MB, {:.1f} KB each'.format(
+        streams, results['rss_idle_mb'], results['kb_per_stream']),
+        fg='green')
+    click.secho('[+] Change to every stream: p50 {:.1f} ms, p99 {:.1f} ms, '
+                'max {:.1f} ms'.format(results['p50_ms'], results['p99_ms'],
+                                       results['max_ms']), fg='green')
+    if output:
+        with open(output, 'w') as file:
+            json.dump(OrderedDict([
+                ('streams', streams),
+                ('writes', writes),
+                ('results', results)]), file, indent=2)
+        click.secho('[+] Results: {}'.format(output), fg='green')
+
+
+if __name__ == "__main__":
+    start()
@@ -0,0 +1,54 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the verified-JWT cache of GUARD (app_template/tokens.py).
+Measures the token check alone and a whole request to
+/api/v.1.0/protected, with the cache (JWT_CACHE_SIZE) and without it.
+! Terminal:
+* $ python3 -m benchmarks.jwt_cache
+* $ python3 -m benchmarks.jwt_cache -n 5000
+"""
+import click
+
+from app_template.extensions import db
+from app_template.models import User
+from app_template.tokens import guard
+from benchmarks.common import best_of, make_app
+
+
+def measure(cache_size, number, repeat):
+    app = make_app(JWT_CACHE_SIZE=cache_size)
+    with app.app_context():
+        db.create_all()
+        user = User(username='bench')
+        user.set_password('bench')
+        db.session.add(user)
+        db.session.commit()
+        token = guard.encode_jwt_token(user)
+        extract = best_of(
+            lambda: guard.extract_jwt_token(token), repeat, number)
+
+    client = app.test_client()
+    headers = {'Authorization': 'Bearer ' + token}
+    request = best_of(
+        lambda: client.get('/api/v.1.0/protected', headers=headers),
+        repeat, number)
+    return extract, request
+
+
+@click.command()
+@click.option('--number', '-n', default=2000, help='calls per run')
+@click.option('--repeat', '-r', default=5, help='best of N runs')
+def start(number, repeat):
+    plain = measure(0, number, repeat)
+    cached = measure(4096, number, repeat)
+    for name, before, after in zip(('token check', 'request'), plain, cached):
+        click.secho(
+            '[+] {:<12} no cache {:8.1f} us  cache {:8.1f} us  '
+            'saved {:8.1f} us per request'.format(
+                name, before * 1e6, after * 1e6, (before - after) * 1e6),
+            fg='green')
+
+
+if __name__ == "__main__":
+    start()
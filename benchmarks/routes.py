@@ -0,0 +1,308 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTTP benchmark of every route of the main, auth, cors and api blueprints.
+The app is built by create_app against a seeded SQLite database and
+driven in-process through the Flask test client, so runs are
+reproducible and do not depend on the network.
+For every endpoint it reports throughput and p50/p95/p99 latency and
+writes the results as JSON, to compare them between commits.
+! Terminal:
+* $ python3 -m benchmarks.routes run --users 50 --tasks-per-user 1000 \
+*       -n 200 -o before.json
+* $ git checkout <other commit>
+* $ python3 -m benchmarks.routes run ... -o after.json
+* $ python3 -m benchmarks.routes compare before.json after.json
+"""
+import datetime
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from collections import OrderedDict
+
+import click
+
+from app_template.extensions import db
+from app_template.models import User
+from app_template.tokens import guard
+from benchmarks.common import make_app, seed
+
+
+class Scenario(object):
+    """
+    One endpoint under load.
+    'request' returns (url, options of the test client) for the call N.
+    'fresh_client' - every call gets a client without cookies.
+    """
+
+    def __init__(self, name, method, request, status=200, fresh_client=False):
+        self.name = name
+        self.method = method
+        self.request = request
+        self.status = status
+        self.fresh_client = fresh_client
+
+
+def scenarios(state):
+    """ Every route of the blueprints, in an order that keeps ids valid """
+    auth = {'Authorization': 'Bearer ' + state['token']}
+    admin = {'Authorization': 'Bearer ' + state['admin_token']}
+    tasks = state['tasks_per_user'] or 1
+
+    def task_url(n):
+        # ? tasks of the seeded user have ids from first_task
+        return '/api/v.1.0/todo/tasks/{}'.format(
+            state['first_task'] + n % tasks)
+
+    def get(url, **options):
+        return lambda n: (url, options)
+
+    def with_etag(url):
+        return lambda n: (url, {'headers': dict(
+            auth, **{'If-None-Match': state['etags'][url]})})
+
+    return [
+        # ! main
+        Scenario('main.index', 'GET', get('/')),
+        Scenario('main.index /index', 'GET', get('/index')),
+        # ! cors
+        Scenario('cors.index', 'GET', get('/cors/')),
+        Scenario('cors.ping_pong', 'GET', get('/cors/pong')),
+        # ! auth
+        Scenario('auth.login GET', 'GET', get('/login'), fresh_client=True),
+        Scenario(
+            'auth.login POST', 'POST',
+            get('/login', data={
+                'username': state['username'],
+                'password': state['password']}),
+            status=302, fresh_client=True),
+        Scenario('auth.logout', 'GET', get('/logout'), status=302),
+        # ! api
+        Scenario('api.index', 'GET', get('/api/')),
+        Scenario('api.ping', 'GET', get('/api/v.1.0/ping')),
+        Scenario(
+            'api.login', 'POST',
+            get('/api/v.1.0/login', json={
+                'username': state['username'],
+                'password': state['password']})),
+        Scenario(
+            'api.refresh', 'POST',
+            get('/api/v.1.0/refresh', json={'token': state['old_token']})),
+        Scenario(
+            'api.protected', 'GET',
+            get('/api/v.1.0/protected', headers=auth)),
+        Scenario(
+            'api.get_tasks', 'GET',
+            get('/api/v.1.0/todo/tasks', headers=auth)),
+        Scenario(
+            'api.get_tasks 304', 'GET',
+            with_etag('/api/v.1.0/todo/tasks'), status=304),
+        Scenario(
+            'api.get_task', 'GET',
+            lambda n: (task_url(n), {'headers': auth})),
+        Scenario(
+            'api.create_task', 'POST',
+            lambda n: ('/api/v.1.0/todo/tasks/new', {
+                'headers': auth,
+                'json': {'title': 'new task {}'.format(n)}}),
+            status=201),
+        Scenario(
+            'api.update_task', 'PUT',
+            lambda n: (task_url(n), {
+                'headers': auth, 'json': {'done': bool(n % 2)}})),
+        Scenario(
+            'api.delete_task', 'DELETE',
+            # ? deletes the tasks made by api.create_task
+            lambda n: ('/api/v.1.0/todo/tasks/{}'.format(
+                state['created'].pop()), {'headers': auth})),
+        Scenario(
+            'api.batch_tasks', 'POST',
+            lambda n: ('/api/v.1.0/todo/tasks/batch', {
+                'headers': auth,
+                'json': {
+                    'create': [{'title': 'batch {}'.format(n)}],
+                    'update': [{'id': state['first_task'], 'done': True}],
+                }})),
+        Scenario(
+            'api.get_user_tasks', 'GET',
+            get('/api/v.1.0/admin/todo/tasks/{}'.format(
+                state['username']), headers=admin)),
+        Scenario(
+            'api.get_stats', 'GET',
+            get('/api/v.1.0/todo/stats', headers=auth)),
+        Scenario(
+            'api.get_all_stats', 'GET',
+            get('/api/v.1.0/admin/todo/stats', headers=admin)),
+    ]
+
+
+def percentile(latencies, share):
+    """ Nearest rank percentile of sorted latencies """
+    index = max(0, int(round(share * len(latencies) + 0.5)) - 1)
+    return latencies[min(index, len(latencies) - 1)]
+
+
+def run_scenario(app, client, scenario, number, warmup, state):
+    latencies = []
+    errors = 0
+    for n in range(warmup + number):
+        url, options = scenario.request(n)
+        current = app.test_client() if scenario.fresh_client else client
+        start = time.perf_counter()
+        response = current.open(url, method=scenario.method, **options)
+        elapsed = time.perf_counter() - start
+        if scenario.name == 'api.create_task' and response.status_code == 201:
+            uri = response.get_json()['new_task']['uri']
+            state['created'].append(int(uri.rsplit('/', 1)[1]))
+        if n < warmup:
+            continue
+        latencies.append(elapsed)
+        if response.status_code != scenario.status:
+            errors += 1
+    latencies.sort()
+    total = sum(latencies)
+    return OrderedDict([
+        ('requests', number),
+        ('errors', errors),
+        ('rps', number / total if total else 0.0),
+        ('mean_ms', total / number * 1000),
+        ('p50_ms', percentile(latencies, 0.50) * 1000),
+        ('p95_ms', percentile(latencies, 0.95) * 1000),
+        ('p99_ms', percentile(latencies, 0.99) * 1000),
+    ])
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            encoding='utf-8').stdout.strip() or None
+    except OSError:
+        return None
+
+
+def prepare(app, users, tasks_per_user):
+    """ Seeds the database and makes the tokens the scenarios need """
+    with app.app_context():
+        if not db.engine.has_table(User.__tablename__):
+            seed(users, tasks_per_user)
+        # ? the admin reads the tasks of the second user if there is one
+        username = 'user2' if users > 1 else 'user1'
+        user = User.lookup(username)
+        admin = User.lookup('user1')
+        first_task = db.session.execute(
+            'SELECT min(id) FROM tasks WHERE user_id = :id',
+            {'id': user.id}).scalar() or 1
+        state = {
+            'username': username,
+            'password': 'password' + username[4:],
+            'tasks_per_user': tasks_per_user,
+            'first_task': first_task,
+            'token': guard.encode_jwt_token(user),
+            'admin_token': guard.encode_jwt_token(admin),
+            # ? access expires at once, so it may be refreshed in a second
+            'old_token': guard.encode_jwt_token(
+                user, override_access_lifespan=datetime.timedelta(0)),
+            'created': [],
+            'etags': {},
+        }
+    time.sleep(1.1)
+    client = app.test_client()
+    url = '/api/v.1.0/todo/tasks'
+    state['etags'][url] = client.get(url, headers={
+        'Authorization': 'Bearer ' + state['token']}).headers['ETag']
+    return state
+
+
+@click.group()
+def cli():
+    """ HTTP benchmark of the blueprint routes """
+
+
+@cli.command()
+@click.option('--users', '-u', default=10, help='seeded users')
+@click.option('--tasks-per-user', '-t', default=100, help='seeded tasks')
+@click.option('--requests', '-n', default=200, help='requests per endpoint')
+@click.option('--warmup', '-w', default=10, help='untimed requests first')
+@click.option(
+    '--database', '-d', default=None,
+    help='SQLite file, reused if it exists (default: a new temporary file)')
+@click.option('--only', multiple=True, help='run only these endpoints')
+@click.option('--output', '-o', default=None, help='write results as JSON')
+def run(users, tasks_per_user, requests, warmup, database, only, output):
+    """ Runs every endpoint and prints the results """
+    if database is None:
+        database = os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+    app = make_app(
+        SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.abspath(database))
+    state = prepare(app, users, tasks_per_user)
+    client = app.test_client()
+
+    results = OrderedDict()
+    click.secho(
+        '{:<22} {:>9} {:>9} {:>9} {:>9} {:>7}'.format(
+            'endpoint', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'),
+        fg='yellow')
+    for scenario in scenarios(state):
+        if only and scenario.name not in only:
+            continue
+        result = run_scenario(app, client, scenario, requests, warmup, state)
+        results[scenario.name] = result
+        click.secho(
+            '{:<22} {:>9.1f} {:>9.2f} {:>9.2f} {:>9.2f} {:>7}'.format(
+                scenario.name, result['rps'], result['p50_ms'],
+                result['p95_ms'], result['p99_ms'], result['errors']),
+            fg='red' if result['errors'] else 'green')
+
+    if output:
+        report = OrderedDict([
+            ('meta', OrderedDict([
+                ('commit', git_commit()),
+                ('date', datetime.datetime.utcnow().isoformat() + 'Z'),
+                ('python', platform.python_version()),
+                ('platform', platform.platform()),
+                ('users', users),
+                ('tasks_per_user', tasks_per_user),
+                ('requests', requests),
+                ('warmup', warmup),
+            ])),
+            ('results', results),
+        ])
+        with open(output, 'w') as file:
+            json.dump(report, file, indent=2)
+        click.secho('[+] Results: {}'.format(output), fg='green')
+
+
+@cli.command()
+@click.argument('before', type=click.File())
+@click.argument('after', type=click.File())
+def compare(before, after):
+    """ Compares two JSON results of 'run' """
+    before, after = json.load(before), json.load(after)
+    click.secho('{} -> {}'.format(
+        before['meta']['commit'], after['meta']['commit']), fg='yellow')
+    click.secho(
+        '{:<22} {:>10} {:>10} {:>10}'.format(
+            'endpoint', 'req/s', 'p50', 'p99'), fg='yellow')
+    for name, new in after['results'].items():
+        old = before['results'].get(name)
+        if old is None:
+            click.echo('{:<22} {:>10}'.format(name, 'new'))
+            continue
+
+        def change(key):
+            return (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+
+        faster = change('rps') >= 0
+        click.secho(
+            '{:<22} {:>+9.1f}% {:>+9.1f}% {:>+9.1f}%'.format(
+                name, change('rps'), change('p50_ms'), change('p99_ms')),
+            fg='green' if faster else 'red')
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,85 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Full-text search of the tasks: the FTS5 index against a LIKE '%word%'
+scan, on a seeded SQLite file (1M tasks by default).
+For every query it reports the best time of the ranked FTS5 search
+(search.tasks, what /todo/tasks/search runs) and of the LIKE search of
+the same user, the number of matches, plus the time to seed the table
+(the triggers index every row) and to rebuild the index.
+! Terminal:
+* $ python3 -m benchmarks.search
+* $ python3 -m benchmarks.search -u 100 -t 10000 -q review -q "fix cache" \
+*       -o search.json
+"""
+import json
+import os
+import tempfile
+import time
+from collections import OrderedDict
+
+import click
+
+from app_template.extensions import db
+from app_template.search import search
+from benchmarks.common import best_of, make_app, seed
+
+
+@click.command()
+@click.option('--users', '-u', default=10, help='seeded users')
+@click.option('--tasks-per-user', '-t', default=100000,
+              help='seeded tasks of every user')
+@click.option('--query', '-q', 'queries', multiple=True, type=str,
+              default=('review', 'deploy the cache', 'documented migrations',
+                       'zebra'),
+              help='search query, may be repeated')
+@click.option('--limit', '-l', default=50, help='results of a search')
+@click.option('--repeat', '-r', default=5, help='best of N runs')
+@click.option('--output', '-o', default=None, help='write results as JSON')
+def start(users, tasks_per_user, queries, limit, repeat, output):
+    database = os.path.join(tempfile.mkdtemp(), 'search.db')
+    app = make_app(SQLALCHEMY_DATABASE_URI='sqlite:///' + database)
+    results = OrderedDict()
+    with app.app_context():
+        begin = time.perf_counter()
+        seed(users, tasks_per_user)
+        results['seed_s'] = time.perf_counter() - begin
+        click.secho('[+] Seeded {} tasks in {:.1f} s (indexed by the '
+                    'triggers)'.format(users * tasks_per_user,
+                                       results['seed_s']), fg='green')
+        begin = time.perf_counter()
+        with db.engine.begin() as connection:
+            search.rebuild(connection)
+        results['rebuild_s'] = time.perf_counter() - begin
+        click.secho('[+] Rebuilt the index in {:.1f} s'.format(
+            results['rebuild_s']), fg='green')
+
+        click.secho('{:<26} {:>8} {:>10} {:>10} {:>8}'.format(
+            'query', 'matches', 'fts ms', 'like ms', 'x'), fg='yellow')
+        results['queries'] = OrderedDict()
+        for query in queries:
+            words = search.terms(query)
+            matches = len(search.tasks(1, words, tasks_per_user))
+            fts = best_of(lambda: search.tasks(1, words, limit), repeat)
+            like = best_of(
+                lambda: search.like_tasks(1, words, limit), repeat)
+            results['queries'][query] = OrderedDict([
+                ('matches', matches), ('fts_ms', fts * 1000),
+                ('like_ms', like * 1000)])
+            click.secho('{:<26} {:>8} {:>10.2f} {:>10.2f} {:>8.1f}'.format(
+                query, matches, fts * 1000, like * 1000, like / fts),
+                fg='green')
+        db.session.remove()
+
+    if output:
+        with open(output, 'w') as file:
+            json.dump(OrderedDict([
+                ('users', users),
+                ('tasks_per_user', tasks_per_user),
+                ('limit', limit),
+                ('results', results)]), file, indent=2)
+        click.secho('[+] Results: {}'.format(output), fg='green')
+
+
+if __name__ == "__main__":
+    start()
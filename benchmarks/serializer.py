@@ -0,0 +1,87 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark of the task serialization.
+Compares the old make_public_task (new TasksSchema on every call,
+url_for per task) with the compiled task_serializer.
+! Terminal:
+* $ python3 -m benchmarks.serializer
+* $ python3 -m benchmarks.serializer -s 10 -s 1000 -r 3
+"""
+import click
+from flask import url_for
+
+from app_template import create_app
+from app_template.api.serializers import task_serializer
+from app_template.models import Tasks
+from app_template.schemas import TasksSchema
+from benchmarks.common import best_of
+
+
+def legacy_make_public_task(tasks):
+    """ make_public_task as it was before the compiled serializer """
+    def pretty_task(task):
+        pretty_task = {}
+        for field in task:
+            if field == 'id':
+                pretty_task['uri'] = url_for(
+                    'api.get_task', task_id=task['id'], _external=True)
+            elif field == 'user':
+                continue
+            else:
+                pretty_task[field] = task[field]
+        return pretty_task
+
+    if tasks:
+        if type(tasks) == list:
+            public_tasks = []
+            tasks = TasksSchema().dump(tasks, many=True)
+            for task in tasks:
+                public_tasks.append(pretty_task(task))
+            return public_tasks
+        else:
+            task = TasksSchema().dump(tasks)
+            public_task = pretty_task(task)
+            return public_task
+
+
+def make_tasks(size):
+    """ Transient tasks, the database is not touched """
+    return [
+        Tasks(
+            id=i,
+            user_id=1,
+            title='task {}'.format(i),
+            description='description of the task {}'.format(i),
+            done=bool(i % 2))
+        for i in range(1, size + 1)]
+
+
+@click.command()
+@click.option(
+    '--size', '-s', multiple=True, type=int, default=(10, 1000, 100000),
+    help='number of tasks, may be repeated')
+@click.option('--repeat', '-r', default=5, help='best of N runs')
+def start(size, repeat):
+    app = create_app()
+    with app.test_request_context():
+        for n in size:
+            tasks = make_tasks(n)
+            # ! check result:
+            if legacy_make_public_task(tasks) != task_serializer.dump_many(
+                    tasks):
+                click.secho('[-] Outputs differ at {} tasks'.format(n),
+                            fg='red')
+                return
+            legacy = best_of(lambda: legacy_make_public_task(tasks), repeat)
+            compiled = best_of(
+                lambda: task_serializer.dump_many(tasks), repeat)
+            click.secho(
+                '[+] {:>7} tasks: legacy {:9.2f} ms  compiled {:9.2f} ms  '
+                'x{:.1f}'.format(
+                    n, legacy * 1000, compiled * 1000, legacy / compiled),
+                fg='green')
+
+
+if __name__ == "__main__":
+    start()
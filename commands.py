@@ -1,8 +1,35 @@
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
 import click
+from flask import current_app
 from flask.cli import with_appcontext
+from sqlalchemy import bindparam, func
+from werkzeug.urls import url_decode
 
+from app_template.api.batch import owned_tasks
+from app_template.api.etags import tasks_version_query
+from app_template.api.export import EXPORT_FORMATS, export_rows, \
+    export_stream
+from app_template.api.filters import task_list_params
+from app_template.api.pagination import encode_cursor, page_query
+from app_template.api.queries import task_rows, tasks_query
+from app_template.api.stats import drifted_users, stats_query, \
+    reconcile_stats as reconcile_users
+from app_template.api.writes import record_task_write
+from app_template.events import new_events_select, user_events_select, \
+    prune_events as prune_log
 from app_template.extensions import db
+from app_template.identity import identity_query
 from app_template.models import User, Tasks, Links
+from app_template.compression import compress_static as compress_folder
+from app_template.passwords import hasher
+from app_template.replicas import SQLiteReplicator
+from app_template.search import search
 
 
 @click.command(name='create_database')
@@ -50,6 +77,8 @@ def create_tasks():
         done=False)
 
     db.session.add_all([first, second, third])
+    record_task_write(1, total=2)
+    record_task_write(2, total=1)
     db.session.commit()
 
 
@@ -77,3 +106,457 @@ def create_links():
 
     db.session.add_all([flask_doc, sqlachemy, migrate, login, cors, wtf])
     db.session.commit()
+
+
+# ? Words of the generated tasks
+TASK_VERBS = ('write', 'review', 'fix', 'test', 'deploy', 'plan',
+              'refactor', 'document', 'profile', 'release')
+TASK_OBJECTS = ('the API', 'the models', 'the login form', 'the cache',
+                'the migrations', 'the templates', 'the benchmarks',
+                'the docs', 'the config', 'the queries')
+
+
+def seed_database(users, tasks_per_user, seed=0, chunk=10000, workers=None,
+                  password=None, progress=None):
+    """
+    Adds 'users' users with 'tasks_per_user' tasks each, by chunks of
+    Core inserts (one executemany per chunk, no ORM objects).
+    The users are named user<N>, N continues after the biggest user id
+    (on an empty database user<N> has the id N), user1 is an admin.
+    Passwords are 'password<N>', hashed in parallel (hasher.hash_many),
+    or one shared 'password' hashed once.
+    The same 'seed' gives the same rows (except the password salts).
+    progress(table, done, total) is called after every chunk.
+    Returns the number of inserted rows.
+    """
+    rng = random.Random(seed)
+    first = (db.session.query(func.max(User.id)).scalar() or 0) + 1
+    numbers = range(first, first + users)
+    if password is None:
+        hashes = hasher.hash_many(
+            ['password{}'.format(number) for number in numbers], workers)
+    else:
+        hashes = hasher.hash_many([password], workers) * users
+
+    def insert(table, rows, done, total):
+        db.session.execute(table.insert(), rows)
+        db.session.commit()
+        if progress is not None:
+            progress(table.name, done, total)
+
+    rows = []
+    for index, number in enumerate(numbers):
+        rows.append({
+            'username': 'user{}'.format(number),
+            'password_hash': hashes[index],
+            'roles': 'admin' if number == 1 else None})
+        if len(rows) >= chunk:
+            insert(User.__table__, rows, index + 1, users)
+            rows = []
+    if rows:
+        insert(User.__table__, rows, users, users)
+
+    # ? ids of the new users, the database may not give first..first+users
+    user_ids = [row[0] for row in db.session.query(User.id).filter(
+        User.id >= first).order_by(User.id)]
+    total = len(user_ids) * tasks_per_user
+    done = 0
+    rows = []
+    counters = []
+    titles = ['{} {}'.format(verb, name)
+              for verb in TASK_VERBS for name in TASK_OBJECTS]
+    uniform = rng.random
+    for user_id in user_ids:
+        done_tasks = 0
+        for number in range(tasks_per_user):
+            title = titles[int(uniform() * len(titles))]
+            task_done = uniform() < 0.3
+            done_tasks += task_done
+            rows.append({
+                'user_id': user_id,
+                'title': title,
+                'description': '{} #{}'.format(title, number),
+                'done': task_done})
+            if len(rows) >= chunk:
+                done += len(rows)
+                insert(Tasks.__table__, rows, done, total)
+                rows = []
+        counters.append({
+            'user': user_id, 'total': tasks_per_user, 'done': done_tasks})
+    if rows:
+        insert(Tasks.__table__, rows, total, total)
+
+    # ? task counters of the new users (api/stats.py), one executemany
+    users_table = User.__table__
+    if counters:
+        db.session.execute(users_table.update().where(
+            users_table.c.id == bindparam('user')).values(
+            tasks_total=bindparam('total'),
+            tasks_done=bindparam('done')), counters)
+        db.session.commit()
+    return users + total
+
+
+@click.command(name='seed')
+@click.option('--users', default=100, help='users to add')
+@click.option('--tasks-per-user', default=100, help='tasks of every user')
+@click.option('--seed', 'seed', default=0, help='random seed of the data')
+@click.option('--chunk', default=10000, help='rows per insert')
+@click.option('--workers', type=int, default=None,
+              help='password hashing processes, default: all cores')
+@click.option('--password', default=None,
+              help='one password for every user, hashed once')
+@with_appcontext
+def seed(users, tasks_per_user, seed, chunk, workers, password):
+    """
+    Bulk data for load tests.
+    ! Terminal:
+    * $ flask seed --users 1000 --tasks-per-user 1000 --password secret
+    """
+    start = time.perf_counter()
+
+    def progress(table, done, total):
+        elapsed = time.perf_counter() - start
+        click.echo('    {:<6} {:>10}/{:<10} {:>8.1f}s'.format(
+            table, done, total, elapsed))
+
+    click.secho('[!] Hashing {} password(s)'.format(
+        1 if password else users), fg='yellow')
+    rows = seed_database(
+        users, tasks_per_user, seed=seed, chunk=chunk, workers=workers,
+        password=password, progress=progress)
+    elapsed = time.perf_counter() - start
+    click.secho('[+] {} rows in {:.1f}s, {:.0f} rows/s'.format(
+        rows, elapsed, rows / elapsed), fg='green')
+
+
+@click.command(name='replicate')
+@click.option('--interval', default=1.0, help='seconds between copies')
+@click.option('--once', is_flag=True, help='copy once and exit')
+@with_appcontext
+def replicate(interval, once):
+    """
+    Stand-in replication for local runs: copies the SQLite database
+    into the REPLICA_URLS files (DATABASE_REPLICA_URLS) until Ctrl+C.
+    ! Terminal:
+    * $ export DATABASE_REPLICA_URLS=sqlite:////tmp/replica1.db
+    * $ flask replicate --interval 1
+    """
+    config = current_app.config
+    if not config['REPLICA_URLS']:
+        raise click.ClickException('No REPLICA_URLS in the config')
+    replicator = SQLiteReplicator(
+        config['SQLALCHEMY_DATABASE_URI'], config['REPLICA_URLS'], interval)
+    click.secho('[!] {} -> {}'.format(
+        replicator.primary, ', '.join(replicator.replicas)), fg='yellow')
+    if once:
+        replicator.run_once()
+        return
+    try:
+        replicator.run()
+    except KeyboardInterrupt:
+        click.secho('[+] Copies: {}'.format(replicator.copies), fg='green')
+
+
+@click.command(name='compress-static')
+@click.option('--level', default=9, help='gzip level')
+@click.option('--min-size', default=0, help='bytes, smaller files are kept')
+@with_appcontext
+def compress_static(level, min_size):
+    """
+    Build step: writes a .gz next to every text file of the static
+    folder, the static route sends it to clients that accept gzip.
+    ! Terminal:
+    * $ flask compress-static
+    """
+    folder = current_app.static_folder
+    if not folder or not os.path.isdir(folder):
+        raise click.ClickException('No static folder: {}'.format(folder))
+    written = compress_folder(folder, level, min_size)
+    for path, size, packed in written:
+        click.echo('    {:>9} -> {:>9}  {}'.format(
+            size, packed, os.path.relpath(path, folder)))
+    click.secho('[+] Compressed: {} file(s)'.format(len(written)),
+                fg='green')
+
+
+@click.command(name='rebuild-search')
+@with_appcontext
+def rebuild_search():
+    """
+    Fills the full-text search index of the tasks again from the table:
+    after a restore, a bulk load with the triggers off or a broken index.
+    Makes the index and its triggers first if they are missing.
+    ! Terminal:
+    * $ flask rebuild-search
+    """
+    start = time.perf_counter()
+    try:
+        with db.engine.begin() as connection:
+            count = search.rebuild(connection)
+    except RuntimeError as error:
+        raise click.ClickException(str(error))
+    click.secho('[+] Indexed: {} task(s) in {:.2f} s'.format(
+        count, time.perf_counter() - start), fg='green')
+
+
+@click.command(name='reconcile-stats')
+@click.option('--dry-run', is_flag=True, help='only show the drift')
+@with_appcontext
+def reconcile_stats(dry_run):
+    """
+    Finds the users whose task counters (tasks_total, tasks_done) drifted
+    from their tasks, e.g. after a manual SQL or a restore, and sets them
+    from a count of the tasks.
+    ! Terminal:
+    * $ flask reconcile-stats --dry-run
+    * $ flask reconcile-stats
+    """
+    drifted = drifted_users()
+    for user_id, (total, done), (real_total, real_done) in drifted:
+        click.echo('    user {}: total {} -> {}, done {} -> {}'.format(
+            user_id, total, real_total, done, real_done))
+    if not drifted:
+        click.secho('[+] No drift', fg='green')
+    elif dry_run:
+        click.secho('[-] Drifted: {} user(s)'.format(len(drifted)),
+                    fg='yellow')
+    else:
+        count = reconcile_users(user_id for user_id, _, _ in drifted)
+        click.secho('[+] Reconciled: {} user(s)'.format(count), fg='green')
+
+
+@click.command(name='export-tasks')
+@click.option('--format', 'export_format', default='csv',
+              type=click.Choice(sorted(EXPORT_FORMATS)))
+@click.option('--output', '-o', default='-',
+              help='file to write, default: stdout')
+@click.option('--gzip', is_flag=True, help='gzip on the fly')
+@click.option('--username', default=None, help='tasks of one user only')
+@click.option('--chunk', type=int, default=None,
+              help='rows read at once, default: EXPORT_CHUNK')
+@with_appcontext
+def export_tasks(export_format, output, gzip, username, chunk):
+    """
+    Writes every task with the name of its user as CSV or NDJSON,
+    by chunks: the memory stays flat for any number of tasks.
+    The same export as GET /api/v.1.0/admin/todo/export
+    ! Terminal:
+    * $ flask export-tasks -o tasks.csv
+    * $ flask export-tasks --format ndjson --gzip -o tasks.ndjson.gz
+    """
+    start = time.perf_counter()
+    chunks = export_stream(
+        export_rows(username), export_format,
+        chunk or current_app.config['EXPORT_CHUNK'], gzip,
+        current_app.config['EXPORT_GZIP_LEVEL'])
+    written = 0
+    with click.open_file(output, 'wb') as file:
+        for data in chunks:
+            file.write(data)
+            written += len(data)
+    if output != '-':
+        click.secho('[+] Exported: {} bytes in {:.1f} s -> {}'.format(
+            written, time.perf_counter() - start, output), fg='green')
+
+
+@click.command(name='prune-events')
+@click.option('--days', type=int, default=None,
+              help='events kept, default: EVENTS_RETENTION_DAYS')
+@with_appcontext
+def prune_events(days):
+    """
+    Deletes the old events of the task change feed (task_events).
+    A client that resumes from a pruned event gets 'reset'.
+    ! Terminal:
+    * $ flask prune-events
+    * $ flask prune-events --days 1
+    """
+    if days is None:
+        days = current_app.config['EVENTS_RETENTION_DAYS']
+    deleted = prune_log(days)
+    click.secho('[+] Pruned: {} events older than {} days'.format(
+        deleted, days), fg='green')
+
+
+def api_queries(user_id=1, username='One'):
+    """
+    The queries that the API routes make, with sample values.
+    Built by the same helpers the routes call, so they can not drift
+    from app_template/api/routes.py
+    """
+    task = Tasks(id=1, title='a', done=False)
+
+    def page(query_string):
+        args = url_decode(query_string)
+        params = task_list_params(args)
+        query, _ = page_query(task_rows(user_id, params), args, params.sort)
+        return query.statement
+
+    return [
+        ('task page (get_tasks, get_user_tasks)',
+            page('cursor=' + encode_cursor(task))),
+        ('open tasks page (get_tasks?done=false)',
+            page('done=false&fields=uri,title&cursor=' + encode_cursor(task))),
+        ('title prefix page, by title (get_tasks?title_prefix=a&sort=title)',
+            page('title_prefix=a&sort=title&cursor=' + encode_cursor(
+                task, 'title'))),
+        ('one task (get_task, update_task, delete_task)',
+            tasks_query(user_id).filter_by(id=1).statement),
+        ('owned tasks of a batch, read and deleted (batch_tasks)',
+            owned_tasks(user_id, [1, 2]).statement),
+        ('user by name (login, User.lookup)',
+            identity_query(User, 'username', username).statement),
+        ('user by id (User.identify)',
+            identity_query(User, 'id', user_id).statement),
+        ('task counters (get_stats)', stats_query(user_id).statement),
+        ('missed events of a client (task_events)',
+            user_events_select(user_id, 0, 1001)),
+        ('new events of the change feed (task_events)',
+            new_events_select(0, 1000)),
+        ('tasks version (ETag of the task routes)',
+            tasks_version_query(user_id).statement),
+    ]
+
+
+# ? dialect -> (explain prefix, full table scan marker)
+EXPLAIN = {
+    'sqlite': ('EXPLAIN QUERY PLAN ', lambda line: line.startswith(
+        'SCAN') and ' USING ' not in line),
+    'postgresql': ('EXPLAIN ', lambda line: 'Seq Scan' in line),
+}
+
+
+@click.command(name='explain-queries')
+@click.option(
+    '--fail-on-scan', is_flag=True,
+    help='exit with code 1 if a query reads a whole table (for CI)')
+@with_appcontext
+def explain_queries(fail_on_scan):
+    """
+    Prints the query plan of every API query.
+    ! Terminal:
+    * $ flask explain-queries --fail-on-scan
+    """
+    dialect = db.engine.dialect
+    prefix, is_scan = EXPLAIN.get(
+        dialect.name, ('EXPLAIN ', lambda line: False))
+    scans = 0
+    for name, statement in api_queries():
+        sql = str(statement.compile(
+            dialect=dialect, compile_kwargs={'literal_binds': True}))
+        click.secho('[!] {}'.format(name), fg='yellow')
+        click.echo(sql)
+        for row in db.session.execute(prefix + sql):
+            line = str(row[-1])
+            if is_scan(line):
+                scans += 1
+                click.secho('    {}'.format(line), fg='red')
+            else:
+                click.secho('    {}'.format(line), fg='green')
+    if scans:
+        click.secho('[-] Full table scans: {}'.format(scans), fg='red')
+        if fail_on_scan:
+            raise SystemExit(1)
+    else:
+        click.secho('[+] No full table scans', fg='green')
+
+
+# ? Runs in a fresh interpreter: python -X importtime -c PROFILE_SCRIPT
+PROFILE_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from config import Config
+from app_template import create_app
+imported = time.perf_counter()
+app = create_app(Config)
+created = time.perf_counter()
+client = app.test_client()
+requests = []
+for path in sys.argv[1:]:
+    begin = time.perf_counter()
+    status = client.get(path).status_code
+    requests.append([path, status, time.perf_counter() - begin])
+print(json.dumps({'import': imported - start, 'create_app': created - imported,
+                  'requests': requests}))
+"""
+
+
+def profile_startup(lazy, paths):
+    """
+    Cold start of the app in a new process: import time of every module
+    (-X importtime), create_app and the first request to every path.
+    """
+    env = dict(os.environ, LAZY_LOADING='1' if lazy else '0')
+    env.pop('FLASK_RUN_FROM_CLI', None)  # ? profile a server, not the CLI
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROFILE_SCRIPT] +
+        list(paths), cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    if process.returncode:
+        raise click.ClickException(process.stderr)
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    modules = []
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        modules.append({
+            'module': name.strip(),
+            'top_level': not name[1:].startswith(' '),
+            'self_ms': int(own) / 1000,
+            'cumulative_ms': int(cumulative) / 1000})
+    result['modules'] = modules
+    return result
+
+
+@click.command(name='startup-profile')
+@click.option('--mode', type=click.Choice(['lazy', 'eager', 'both']),
+              default='both', help='LAZY_LOADING on, off or both')
+@click.option('--path', 'paths', multiple=True, default=['/api/v.1.0/ping'],
+              help='first requests to time, repeatable')
+@click.option('--top', default=20, help='slowest modules to print')
+@click.option('--max-ms', type=float, default=None,
+              help='exit with code 1 if a cold start is slower (for CI)')
+@click.option('--output', '-o', default=None, help='write results as JSON')
+def startup_profile(mode, paths, top, max_ms, output):
+    """
+    Cold start time: imports per module, create_app, first requests.
+    ! Terminal:
+    * $ flask startup-profile
+    * $ flask startup-profile --mode lazy --max-ms 800 -o startup.json
+    """
+    modes = ['lazy', 'eager'] if mode == 'both' else [mode]
+    results = {}
+    slow = False
+    for name in modes:
+        result = results[name] = profile_startup(name == 'lazy', paths)
+        cold = (result['import'] + result['create_app'] +
+                sum(request[2] for request in result['requests'])) * 1000
+        result['cold_start_ms'] = cold
+        click.secho('[!] Mode: {}'.format(name), fg='yellow')
+        click.echo('    {:>9.1f} ms  import'.format(result['import'] * 1000))
+        click.echo('    {:>9.1f} ms  create_app'.format(
+            result['create_app'] * 1000))
+        for path, status, elapsed in result['requests']:
+            click.echo('    {:>9.1f} ms  GET {} {}'.format(
+                elapsed * 1000, path, status))
+        too_slow = max_ms is not None and cold > max_ms
+        slow = slow or too_slow
+        click.secho('    {:>9.1f} ms  cold start'.format(cold),
+                    fg='red' if too_slow else 'green')
+        click.secho('    {:>9} {:>9}  slowest imports'.format(
+            'cumul. ms', 'self ms'), fg='yellow')
+        modules = sorted(result['modules'],
+                         key=lambda module: -module['cumulative_ms'])
+        for module in modules[:top]:
+            click.echo('    {:>9.1f} {:>9.1f}  {}'.format(
+                module['cumulative_ms'], module['self_ms'],
+                module['module']))
+    if output:
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2)
+        click.secho('[+] Results: {}'.format(output), fg='green')
+    if slow:
+        raise SystemExit(1)
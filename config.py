@@ -9,10 +9,99 @@ class Config(object):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'app.db')  # ? sqlite example
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # ? Engine profiles: pool and SQLite PRAGMAs, see app_template/engine.py
+    ENGINE_PROFILES = {
+        'default': {},  # ? SQLAlchemy defaults, no PRAGMAs
+        'development': {
+            'pool_size': 5,
+            'max_overflow': 5,
+            'pool_pre_ping': False,
+            'sqlite_pragmas': {
+                'busy_timeout': 5000,  # ? ms to wait for a lock
+                'journal_mode': 'WAL',  # ? readers do not block the writer
+                'synchronous': 'NORMAL',
+                'cache_size': -16000,  # ? KiB (negative), per connection
+            },
+        },
+        'production': {
+            'pool_size': 10,
+            'max_overflow': 20,
+            'pool_timeout': 10,  # ? seconds to wait for a connection
+            'pool_pre_ping': True,  # ? drops dead server connections
+            'pool_recycle': 1800,  # ? seconds, under the server timeouts
+            'sqlite_pragmas': {
+                'busy_timeout': 5000,
+                'journal_mode': 'WAL',
+                'synchronous': 'NORMAL',
+                'cache_size': -64000,
+                'mmap_size': 268435456,  # ? bytes read through mmap
+            },
+        },
+    }
+    ENGINE_PROFILE = os.environ.get('ENGINE_PROFILE') or 'production'
+    # ? Read replicas for GET requests, see app_template/replicas.py
+    REPLICA_URLS = [url for url in os.environ.get(
+        'DATABASE_REPLICA_URLS', '').split(',') if url]  # ? comma separated
+    REPLICA_RETRY_AFTER = 30  # ? seconds a failed replica is skipped
+    REPLICA_PIN_TTL = 5  # ? seconds of reads from primary after a write
     JWT_ACCESS_LIFESPAN = {'minutes': 50}  # ? GUARD token lifespan
+    JWT_CACHE_SIZE = 4096  # ? verified tokens kept by GUARD, 0 = no cache
+    TASKS_PAGE_SIZE = 50  # ? default page of the task lists
+    TASKS_MAX_PAGE_SIZE = 500  # ? upper bound for ?limit=
+    TASKS_BATCH_MAX_SIZE = 1000  # ? items in one /todo/tasks/batch request
+    TASKS_STREAM_CHUNK = 1000  # ? rows read and sent at once when streaming
+    EXPORT_CHUNK = 5000  # ? rows of the admin export read and sent at once
+    EXPORT_GZIP_LEVEL = 6  # ? gzip=1 exports, 1 (fast) ... 9 (small)
+    # ? Change feed of the tasks (SSE), see app_template/events.py
+    EVENTS_POLL_INTERVAL = 0.5  # ? seconds between two reads of the log
+    EVENTS_HEARTBEAT = 15  # ? seconds, keep-alive of an idle stream
+    EVENTS_QUEUE_SIZE = 1000  # ? events a client may lag, then it catches up
+    EVENTS_REPLAY_MAX = 1000  # ? missed events sent on resume, more: reset
+    EVENTS_RETENTION_DAYS = 7  # ? flask prune-events, the rest is reset
+    # ? Full-text search of the tasks, see app_template/search.py
+    SEARCH_MAX_TERMS = 8  # ? words of ?q= that are used
+    SEARCH_WEIGHTS = (10.0, 1.0)  # ? bm25 weights: title, description
+    LINKS_CACHE_TTL = 300  # ? seconds, links of base.html
+    IDENTITY_CACHE_TTL = 60  # ? seconds, users of User.identify/lookup
+    IDENTITY_CACHE_SIZE = 1024  # ? users kept in the identity cache
+    STATS_CACHE_TTL = 5  # ? seconds, totals of all users (admin stats)
+    TASK_URI_CACHE_SIZE = 64  # ? hosts with a task uri template kept
+    # ? Password hashing, see app_template/passwords.py
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:150000'  # ? old hashes: rehash
+    PASSWORD_SALT_LENGTH = 16
+    PASSWORD_POOL_SIZE = 2  # ? processes, 0 = in thread
+    PASSWORD_MAX_PENDING = 64  # ? hashes in flight, then wait
+    PASSWORD_WAIT_TIMEOUT = 1.0  # ? seconds to wait for a slot, then 503
+    # ? Rate limits of login and refresh, see app_template/ratelimit.py
+    RATELIMIT_ENABLED = True
+    RATELIMIT_LOGIN_IP = (20, 60)  # ? 20 calls at once, refilled in 60 s
+    RATELIMIT_LOGIN_USERNAME = (5, 60)  # ? None = no limit
+    RATELIMIT_REFRESH_IP = (60, 60)
+    RATELIMIT_STORE = None  # ? 'module:Class' of a shared BucketStore
+    RATELIMIT_SHARDS = 16  # ? locks of the in-memory store
+    RATELIMIT_SIZE = 100000  # ? buckets kept in memory
+    # ? Response compression and static files, see compression.py
+    COMPRESS_ENABLED = True
+    COMPRESS_LEVEL = 6  # ? 1 (fast) ... 9 (small)
+    COMPRESS_MIN_SIZE = 500  # ? bytes, smaller bodies are not worth it
+    COMPRESS_MIMETYPES = (
+        'text/html', 'text/css', 'text/plain', 'text/xml',
+        'application/json', 'application/javascript', 'image/svg+xml',
+        'application/x-ndjson', 'application/stream+json', 'text/csv')
+    COMPRESS_STATIC_MAX_AGE = 31536000  # ? seconds, static_url() urls
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED') == '1'  # ? metrics.py
+    METRICS_PATH = '/metrics'  # ? Prometheus text format
+    ASYNC_DB_POOL_SIZE = 4  # ? aiosqlite connections of the ASGI mode
+    LAZY_LOADING = os.environ.get('LAZY_LOADING') == '1'  # ? startup.py
+    TASKS_USER_LOADER = 'raiseload'  # ? see app_template/api/queries.py
+    NPLUSONE_ENABLED = False  # ? N+1 query detector, nplusone.py
+    NPLUSONE_THRESHOLD = 5  # ? same statement more times in one request
+    NPLUSONE_RAISE = False  # ? fail the request instead of a warning
 
 
 class DevelopmentConfig(Config):
     DEBUG = True
+    ENGINE_PROFILE = os.environ.get('ENGINE_PROFILE') or 'development'
     SEND_FILE_MAX_AGE_DEFAULT = 0  # ? disable static file cache JS CSS
     JSON_SORT_KEYS = False
+    NPLUSONE_ENABLED = True
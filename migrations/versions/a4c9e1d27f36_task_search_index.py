@@ -0,0 +1,63 @@
+"""task search index
+
+Full-text search of the tasks (SQLite only): the FTS5 table tasks_fts,
+the triggers that keep it in sync with 'tasks', and the index of the
+tasks that are already there. Other databases are left as they are.
+Same statements as app_template/search.py, 'flask rebuild-search'
+fills the index again.
+
+Revision ID: a4c9e1d27f36
+Revises: 8b3e5f2a9c17
+Create Date: 2026-10-18 16:48:12.904417
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c9e1d27f36'
+down_revision = '8b3e5f2a9c17'
+branch_labels = None
+depends_on = None
+
+
+FTS_INSERT = (
+    "INSERT INTO tasks_fts(rowid, owner, title, description) "
+    "VALUES (new.id, 'u' || new.user_id, new.title, new.description);"
+)
+FTS_DELETE = (
+    "INSERT INTO tasks_fts(tasks_fts, rowid, owner, title, description) "
+    "VALUES ('delete', old.id, 'u' || old.user_id, old.title, "
+    "old.description);"
+)
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute(
+        "CREATE VIRTUAL TABLE tasks_fts USING fts5("
+        "owner, title, description, content='', "
+        "tokenize='porter unicode61')")
+    op.execute(
+        "CREATE TRIGGER tasks_fts_insert AFTER INSERT ON tasks "
+        "BEGIN " + FTS_INSERT + " END")
+    op.execute(
+        "CREATE TRIGGER tasks_fts_delete AFTER DELETE ON tasks "
+        "BEGIN " + FTS_DELETE + " END")
+    op.execute(
+        "CREATE TRIGGER tasks_fts_update "
+        "AFTER UPDATE OF user_id, title, description ON tasks "
+        "BEGIN " + FTS_DELETE + " " + FTS_INSERT + " END")
+    op.execute(
+        "INSERT INTO tasks_fts(rowid, owner, title, description) "
+        "SELECT id, 'u' || user_id, title, description FROM tasks")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute("DROP TRIGGER IF EXISTS tasks_fts_update")
+    op.execute("DROP TRIGGER IF EXISTS tasks_fts_delete")
+    op.execute("DROP TRIGGER IF EXISTS tasks_fts_insert")
+    op.execute("DROP TABLE IF EXISTS tasks_fts")
@@ -1,8 +1,11 @@
 #! /usr/bin/env python3
 # -*- coding: utf-8 -*-
 from app_template import create_app
-from app_template.extensions import db, ma, guard
-from app_template.models import User, Links, Tasks, TasksSchema
+from app_template.extensions import db
+from app_template.models import User, Links, Tasks
+from app_template.navigation import links_cache
+from app_template.schemas import ma, TasksSchema
+from app_template.tokens import guard
 
 
 app = create_app()
@@ -27,10 +30,14 @@ def make_shell_context():
         'Links': Links,
         'Tasks': Tasks,
         'TasksSchema': TasksSchema,
-        'guard': guard
+        'guard': guard,
+        'links_cache': links_cache
         }  # Add more variables {name:variable}
 
 
 # TODO: start app: $ python3 setup.py OR $ flask run
+# TODO: async API (ASGI): $ uvicorn asgi:asgi_app, see asgi.py
+# TODO: fast cold start: $ export LAZY_LOADING=1, $ flask startup-profile
+# TODO: read replicas: $ export DATABASE_REPLICA_URLS=..., $ flask replicate
 if __name__ == "__main__":
     app.run(host='0.0.0.0')